@@ -0,0 +1,166 @@
+import argparse
+import csv
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+import Source.game as game
+
+# headless pathfinding benchmark, run from the repository root:
+#   python -m Source.benchmark --sizes 9 51 101 --output results.json
+#   python -m Source.benchmark --baseline results.json  (compare against an earlier run)
+# the same arguments always generate the same levels and start/goal pairs, so runs made
+# on different commits can be compared directly
+
+DEFAULT_SIZES = [9, 21, 51, 101, 201, 501]
+DEFAULT_DENSITIES = [0.0, 0.15, 0.3]
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+# generate a level without ghosts and coins, seeded so that every run gets the same maze
+def make_level(size, density, seed):
+    return game.Level(size, size, ghosts_n_coins=False, wall_chance=density, seed=seed)
+
+
+# fixed list of ((x1, y1), (x2, y2)) queries between distinct corridor tiles
+def make_corpus(level, pairs, seed):
+    rng = random.Random(seed)
+    corridors = [(int(x), int(y)) for y, x in zip(*np.nonzero(level.tile_map == 0))]
+    return [tuple(rng.sample(corridors, 2)) for _ in range(pairs)]
+
+
+# run every query of the corpus with one algorithm and summarize the measurements
+def benchmark_algo(level, algo, corpus):
+    level.pathfinding_algo_id = level.pathfinding_algos.index(algo)
+    (x1, y1), (x2, y2) = corpus[0]
+    level.find_shortest_path(x1, y1, x2, y2, None)  # warm up the level's caches
+    latencies, expanded, frontier, optimality = [], [], [], []
+    for (x1, y1), (x2, y2) in corpus:
+        stats = {"algo": algo}
+        start = time.perf_counter_ns()
+        path = level.find_shortest_path(x1, y1, x2, y2, stats)
+        latencies.append(time.perf_counter_ns() - start)
+        expanded.append(stats["steps"])
+        frontier.append(stats["memory"] // 8)
+        optimality.append(level.shortest_path_length(x1, y1, x2, y2) / max(1, len(path)))
+    row = {"algo": algo, "queries": len(corpus)}
+    for percentile in LATENCY_PERCENTILES:
+        row[f"latency_p{percentile}_ns"] = int(np.percentile(latencies, percentile))
+    row["latency_mean_ns"] = int(np.mean(latencies))
+    row["expanded_mean"] = float(np.mean(expanded))
+    row["expanded_max"] = int(np.max(expanded))
+    row["peak_frontier_max"] = int(np.max(frontier))
+    row["optimality_mean"] = float(np.mean(optimality))  # shortest length / found length
+    row["optimal_paths"] = int(sum(1 for ratio in optimality if ratio == 1.0))
+    return row
+
+
+# level seed of a maze, hashed by a SeedSequence like the games of Source.selfplay (63 bits like the seed
+# of an unseeded Level), the density in thousandths
+def level_seed(seed, size, density):
+    return int(np.random.SeedSequence([seed, size, round(density * 1000)]).generate_state(1, np.uint64)[0]) >> 1
+
+
+def run(sizes, densities, algos, pairs, seed, log=None):
+    results = []
+    for size in sizes:
+        for density in densities:
+            maze_seed = level_seed(seed, size, density)
+            start = time.perf_counter()
+            level = make_level(size, density, maze_seed)
+            generation_ns = int((time.perf_counter() - start) * 1e9)
+            corpus = make_corpus(level, pairs, maze_seed)
+            for algo in algos:
+                row = {"size": size, "density": density, "corridors": int(np.count_nonzero(level.tile_map == 0)),
+                       "generation_ns": generation_ns}
+                row.update(benchmark_algo(level, algo, corpus))
+                results.append(row)
+                if log:
+                    log(f"{size}x{size} density {density:.2f} {algo}: "
+                        f"p50 {row['latency_p50_ns'] / 1e6:.3f} ms, "
+                        f"{row['expanded_mean']:.0f} expanded, optimality {row['optimality_mean']:.3f}")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(args):
+    return {"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.machine(), "processor": platform.processor(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sizes": args.sizes, "densities": args.densities, "algos": args.algos,
+            "pairs": args.pairs, "seed": args.seed}
+
+
+def write_results(results, meta, output, output_format):
+    stream = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if output_format == "json":
+            json.dump({"meta": meta, "results": results}, stream, indent=2)
+            stream.write("\n")
+        else:
+            writer = csv.DictWriter(stream, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    finally:
+        if output:
+            stream.close()
+
+
+# compare median latencies against an earlier JSON run, returns the rows that got slower
+def find_regressions(results, baseline_file, tolerance):
+    with open(baseline_file) as file:
+        baseline = {(row["size"], row["density"], row["algo"]): row for row in json.load(file)["results"]}
+    regressions = []
+    for row in results:
+        old_row = baseline.get((row["size"], row["density"], row["algo"]))
+        if old_row and row["latency_p50_ns"] > old_row["latency_p50_ns"] * tolerance:
+            regressions.append((row, old_row))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless pathfinding benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="level sizes (odd numbers), every level is square")
+    parser.add_argument("--densities", type=float, nargs="+", default=DEFAULT_DENSITIES,
+                        help="chances of placing each possible wall")
+    parser.add_argument("--algos", nargs="+", default=None,
+                        help="pathfinding algorithms to run (all of Level.pathfinding_algos by default)")
+    parser.add_argument("--pairs", type=int, default=50, help="start/goal pairs per level")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--output", help="file to write the results to (stdout by default)")
+    parser.add_argument("--baseline", help="earlier JSON results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="median latency ratio over the baseline that counts as a regression")
+    args = parser.parse_args()
+    if args.algos is None:
+        args.algos = list(make_level(9, 0.15, 0).pathfinding_algos)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    results = run(args.sizes, args.densities, args.algos, args.pairs, args.seed, log)
+    write_results(results, metadata(args), args.output, args.format)
+    if args.baseline:
+        regressions = find_regressions(results, args.baseline, args.tolerance)
+        for row, old_row in regressions:
+            log(f"REGRESSION {row['size']}x{row['size']} density {row['density']} {row['algo']}: "
+                f"p50 {old_row['latency_p50_ns'] / 1e6:.3f} ms -> {row['latency_p50_ns'] / 1e6:.3f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+# run the main function only if this module is executed as the main script
+if __name__ == "__main__":
+    main()
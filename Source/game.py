@@ -1,14 +1,26 @@
 import os
+import bisect
+import heapq
+import math
 import numpy as np
 import random
-import pygame
+import threading
 import time
-from datetime import datetime
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from Source.pathfinding import DIRECTIONS, CorridorGraph, DistanceTable, JunctionGraph, wavefront_distances
 
 TILE_SIZE = 60
 PACMAN_MOVE_FRAMES = 20
 PACMAN_AI_DEPTH = 8
+PACMAN_MAX_AI_DEPTH = 24  # deepest look-ahead when deepening within a time budget
+MCTS_ITERATIONS = 30  # iterations of a Monte Carlo tree search decision without a time budget (PACMAN_AI_DEPTH deep)
 GHOST_AI_DEPTH = 20
+# sizes of the pacman and ghost sprites, characters collide by the centers of their sprites
+PACMAN_SIZE = (51, 60)
+GHOST_SIZE = (50, 60)
 
 # parameters that dictate how hard the game becomes at each difficulty level
 difficulty_settings = {
@@ -23,64 +35,110 @@ difficulty_settings = {
 }
 
 
-class Tile(pygame.sprite.Sprite):
-    def __init__(self, type, grid_x, grid_y):
-        # Call the parent's constructor
-        pygame.sprite.Sprite.__init__(self)
-        # load image based on tile type
-        filename = None
-        if type == 0:
-            filename = "Assets/Images/Star_Back.png"
-        elif type == 1:
-            filename = "Assets/Images/Star_Wall.png"
-        self.image = pygame.image.load(filename).convert()
-        # move tile to the proper location on the grid
-        self.rect = self.image.get_rect()
-        self.rect.top = TILE_SIZE * grid_y
-        self.rect.left = TILE_SIZE * grid_x
-
-
 class Level:
     # width, height should be odd
-    def __init__(self, width, height, difficulty=0, ghosts_n_coins=True):
+    def __init__(self, width, height, difficulty=0, ghosts_n_coins=True, wall_chance=0.15,
+                 tile_map=None, seed=None, settings=None):
+        # everything random about the level and the game played on it follows from the seed
+        # (a random one if there is none, it's kept so that the game can be replayed)
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(1 << 63)
+        self.rng = random.Random(self.seed)  # draws of the level's generation
+        self.random = GameRandom(self.rng.getrandbits(64))  # draws of the game (the ghosts')
+        # draws of pacman's decisions, kept apart so that how many he makes (which depends on how deep he gets
+        # to look within a time budget) doesn't change the ghosts' ones, replays record the decisions instead
+        self.pacman_random = GameRandom(self.rng.getrandbits(64))
         self.width = width
         self.height = height
         self.player_spawn_point = (height // 2, width // 2)
         self.difficulty = difficulty
-        self.tile_map = None
-        self.generate_tile_map()
-        self.ghosts = pygame.sprite.RenderPlain()
-        self.coins = pygame.sprite.RenderPlain()
+        # the difficulty_settings entry the ghosts are made with (a copy of the difficulty's if there is none)
+        self.settings = dict(settings if settings is not None else difficulty_settings.get(difficulty, {}))
+        self.wall_chance = wall_chance  # how likely each possible wall is to be placed
+        self.map_version = 0  # bumped every time the tile map changes
+        self.distance_table = None  # shortest distances between corridors, built on demand
+        self.corridor_graph = None  # empty tiles and their neighbours
+        self.junction_graph = None  # corridor graph contracted to its junctions, built on demand
+        # an existing tile map to use instead of generating one (a copy, it's frozen along with the level's)
+        self.tile_map = tile_map.copy() if tile_map is not None else None
+        if tile_map is None:
+            self.generate_tile_map()
+        self.finalize_tile_map()
+        self.ghosts = []
+        self.coins = {}  # coin id -> Coin still on the map
+        # coin index: id of the coin on every tile (-1 for none) and a bitmask of the coins still there
+        self.coin_grid = np.full((height, width), -1, dtype=np.int32)
+        self.coins_placed = 0  # the id of the next coin
+        self.coin_mask = 0
         if ghosts_n_coins:
             self.add_ghosts()
             self.place_coins()
         self.score = 0
         #  pathfinding
-        self.pathfinding_algos = ['bfs', 'dfs', 'a-star', 'greedy']
+        self.pathfinding_algos = ['bfs', 'dfs', 'a-star', 'greedy', 'wavefront', 'junction']
         self.pathfinding_algo_id = 0
+        self.search_stats = None  # optional SearchStats that the AI decisions report into
+        self.executor = None  # optional concurrent.futures executor to plan the AI decisions ahead on
+        self.search_pool = None  # optional SearchPool for the "parallel" planner
+        self.pacman_field = (None, None)  # (pacman's x, y and map version, chase_field)
+
+    @property
+    def tile_map(self):
+        return self._tile_map
+
+    @tile_map.setter
+    def tile_map(self, tile_map):
+        self._tile_map = tile_map
+        self.map_changed()
+
+    # drop everything that was derived from the old tile map
+    def map_changed(self):
+        self.map_version += 1
+        self.distance_table = None
+        self.corridor_graph = None
+        self.junction_graph = None
+
+    # lock the generated map against accidental changes (use set_tile instead) and precompute distances
+    def finalize_tile_map(self):
+        self.tile_map.setflags(write=False)
+        self.map_changed()
+        self.get_distance_table()
+
+    def set_tile(self, tile_x, tile_y, tile_type):
+        tile_map = self.tile_map.copy()
+        tile_map[tile_y, tile_x] = tile_type
+        tile_map.setflags(write=False)
+        self.tile_map = tile_map
 
-    def update(self):
-        self.coins.update()
+    def get_corridor_graph(self):
+        if self.corridor_graph is None:
+            self.corridor_graph = CorridorGraph(self.tile_map)
+        return self.corridor_graph
+
+    def get_junction_graph(self):
+        if self.junction_graph is None:
+            self.junction_graph = JunctionGraph(self.get_corridor_graph())
+        return self.junction_graph
+
+    def get_distance_table(self):
+        if self.distance_table is None:
+            self.distance_table = DistanceTable(self.get_corridor_graph())
+        return self.distance_table
 
     # generates a tile map in-place
     def generate_tile_map(self):
         width, height = self.width, self.height
         tile_map = np.zeros((height, width), dtype=int)
         # surround map with impassable wall border
-        for x in range(width):
-            tile_map[0, x] = 1
-            tile_map[-1, x] = 1
-        for y in range(height):
-            tile_map[y, 0] = 1
-            tile_map[y, -1] = 1
+        tile_map[0, :] = 1
+        tile_map[-1, :] = 1
+        tile_map[:, 0] = 1
+        tile_map[:, -1] = 1
         # generate pillars
-        for x in range(0, width, 2):
-            for y in range(0, height, 2):
-                tile_map[y, x] = 1
+        tile_map[::2, ::2] = 1
         # save map
         self.tile_map = tile_map
         # fill with walls randomly
-        self.add_random_walls()
+        self.add_random_walls(self.wall_chance)
         # make a hole for a spawn point
         self.poke_hole_in_tile_map(tile_map, self.player_spawn_point[1],
                                    self.player_spawn_point[0], 1)
@@ -100,53 +158,32 @@ class Level:
         for x in range(1, self.width - 1, 2):
             for y in range(2, self.height - 1, 2):
                 points.append((y, x))
-        random.shuffle(points)
+        self.rng.shuffle(points)
+        # every wall joins the pillars at its ends, and it cuts the maze in two exactly when they are joined
+        # already (it closes a ring of walls around part of the maze), so the pillars that walls join are kept
+        # in a union-find by tile index, with the whole border as one pillar (the one at 0)
+        width, height = self.width, self.height
+        leaders = list(range(width * height))
+        for y in range(0, height, 2):
+            leaders[y * width] = leaders[y * width + width - 1] = 0
+        for x in range(0, width, 2):
+            leaders[x] = leaders[(height - 1) * width + x] = 0
+
+        def find(i):
+            while leaders[i] != i:
+                leaders[i] = leaders[leaders[i]]
+                i = leaders[i]
+            return i
+
         for y, x in points:
+            wall = y * width + x
+            side = width if x % 2 == 0 else 1  # towards the pillars at the ends of this wall
+            end1, end2 = find(wall - side), find(wall + side)
             # add wall if it doesn't obstruct movement
-            if self.can_place_wall(y, x):
-                if np.random.random_sample() < chance:  # not always
+            if end1 != end2:
+                if self.rng.random() < chance:  # not always
                     self.tile_map[y, x] = 1
-
-    # a wall can be placed if it doesn't block passage between any 2 points in the maze
-    def can_place_wall(self, wall_y, wall_x):
-        if self.tile_map[wall_y, wall_x] == 1:  # wall is already there
-            return True
-        self.tile_map[wall_y, wall_x] = 1  # imagine there is a wall
-        get_adjacent = lambda y, x: [(y, x + 1), (y, x - 1), (y - 1, x), (y + 1, x)]  # right, left, up, down
-        # BFS search from any of the adjacent empty tiles
-        visited = np.zeros(self.tile_map.shape, dtype=int)
-        tile_y, tile_x = None, None
-        for t_y, t_x in get_adjacent(wall_y, wall_x):  # find first adjacent empty cell
-            if self.tile_map[t_y, t_x] == 0:
-                tile_y, tile_x = t_y, t_x
-                break
-        visited[tile_y, tile_x] = 1
-        queue = [(tile_y, tile_x)]
-        while queue:
-            y, x = queue.pop(0)
-            directions = get_adjacent(y, x)
-            for dir_y, dir_x in directions:
-                if not visited[dir_y, dir_x] and self.tile_map[dir_y, dir_x] == 0:
-                    visited[dir_y, dir_x] = 1
-                    queue.append((dir_y, dir_x))
-        # if any empty tile on the map wasn't visited by BFS, then the wall prevents passage
-        answer = True
-        for x in range(self.width):
-            for y in range(self.height):
-                if self.tile_map[y, x] == 0 and not visited[y, x]:
-                    answer = False
-                    break
-        self.tile_map[wall_y, wall_x] = 0  # remove the hypothetical wall
-        return answer
-
-    # get a list of sprites for rendering
-    def set_up_tile_sprites(self):
-        tile_list = pygame.sprite.RenderPlain()
-        for x in range(self.width):
-            for y in range(self.height):
-                tile_type = self.tile_map[y, x]
-                tile_list.add(Tile(tile_type, x, y))
-        return tile_list
+                    leaders[end2] = end1
 
     def toggle_pathfinding_algo(self):  # select next pathfinding algo in the list
         self.pathfinding_algo_id += 1
@@ -154,15 +191,63 @@ class Level:
             self.pathfinding_algo_id = 0
 
     def shortest_path_length(self, x1, y1, x2, y2):
-        path = self.find_shortest_path(x1, y1, x2, y2, {})
-        return len(path)
+        if self.search_stats:
+            self.search_stats.path_query()
+        return self.get_distance_table().distance(x1, y1, x2, y2)
+
+    # first move of a shortest path between two points (None if there is nowhere to go)
+    def next_move(self, x1, y1, x2, y2):
+        if self.search_stats:
+            self.search_stats.path_query()
+        return self.get_distance_table().next_move(x1, y1, x2, y2)
+
+    # distances from every corridor to (x, y), indexed by corridor id (a single reverse search)
+    def distance_field_from(self, x, y):
+        if self.search_stats:
+            self.search_stats.path_query()
+        table = self.get_distance_table()
+        return table.row(table.graph.corridor_id(x, y))
+
+    # distances from every corridor to pacman's tile as a list, searched once for all of the ghosts
+    # (and again only when pacman gets to another tile or the map changes)
+    def chase_field(self, pacman_x, pacman_y):
+        key, field = self.pacman_field
+        if key != (pacman_x, pacman_y, self.map_version):
+            key, field = (pacman_x, pacman_y, self.map_version), self.distance_field_from(pacman_x, pacman_y).tolist()
+            self.pacman_field = (key, field)  # swapped at once, the planning threads may read it too
+        return field
+
+    # distances from every corridor to the closest of the (x, y) targets, indexed by corridor id
+    def distance_field_from_many(self, targets):
+        if self.search_stats:
+            self.search_stats.path_query()
+        graph = self.get_corridor_graph()
+        return graph.distances_from([graph.corridor_id(x, y) for x, y in targets])
+
+    # first move from (x, y) along a distance field (None once the field's source is reached)
+    def next_move_in_field(self, field, x, y):
+        graph = self.get_corridor_graph()
+        return graph.first_move(graph.corridor_id(x, y), field)
+
+    # shortest paths from several (x, y) sources to the same target, all read from one search
+    def find_shortest_paths(self, sources, x, y):
+        graph = self.get_corridor_graph()
+        field = self.distance_field_from(x, y)
+        return [graph.descend(graph.corridor_id(source_x, source_y), field) for source_x, source_y in sources]
+
+    # shortest path from (x, y) to whichever of the (x, y) targets is the closest
+    def find_path_to_nearest(self, x, y, targets):
+        graph = self.get_corridor_graph()
+        return graph.descend(graph.corridor_id(x, y), self.distance_field_from_many(targets))
 
     # find shortest path between two points and return a sequence of moves
     def find_shortest_path(self, x1, y1, x2, y2, pathfinding_stats):
         pathfinding_algo = self.pathfinding_algos[self.pathfinding_algo_id]
+        if self.search_stats:
+            self.search_stats.path_query()
         if pathfinding_stats:
             pathfinding_stats["algo"] = pathfinding_algo
-        startTime = datetime.now()
+        start_time = time.perf_counter_ns()
         shortest_path = []
         if pathfinding_algo == "bfs":
             shortest_path = self.shortest_path_bfs(x1, y1, x2, y2, pathfinding_stats)
@@ -172,9 +257,14 @@ class Level:
             shortest_path = self.shortest_path_a_star(x1, y1, x2, y2, pathfinding_stats)
         elif pathfinding_algo == "greedy":
             shortest_path = self.shortest_path_greedy(x1, y1, x2, y2, pathfinding_stats)
-        timeElapsed = datetime.now() - startTime
+        elif pathfinding_algo == "wavefront":
+            shortest_path = self.shortest_path_wavefront(x1, y1, x2, y2, pathfinding_stats)
+        elif pathfinding_algo == "junction":
+            shortest_path = self.shortest_path_junction(x1, y1, x2, y2, pathfinding_stats)
+        time_elapsed = time.perf_counter_ns() - start_time
         if pathfinding_stats:
-            pathfinding_stats["time"] = timeElapsed
+            pathfinding_stats["time"] = timedelta(microseconds=time_elapsed / 1000)
+            pathfinding_stats["time_ns"] = time_elapsed
         return shortest_path
 
     # return moves that need to be taken to reach a point based on a distance matrix
@@ -197,118 +287,147 @@ class Level:
         return moves
 
     def shortest_path_bfs(self, x1, y1, x2, y2, pathfinding_stats):
-        get_adjacent = lambda y, x: [(y, x + 1), (y, x - 1), (y - 1, x), (y + 1, x)]  # right, left, up, down
-        distance_matrix = np.ones(self.tile_map.shape, dtype=int) * -1
+        graph = self.get_corridor_graph()
+        neighbour_lists = graph.neighbour_lists
+        start, target = graph.corridor_id(x1, y1), graph.corridor_id(x2, y2)
+        distances = [-1] * graph.size  # -1 marks corridors that were never reached
         # fill distance matrix
-        distance_matrix[y1, x1] = 0
-        queue = [(y1, x1)]
+        distances[start] = 0
+        queue = deque([start])
         steps_taken = 0
         max_memory = 1
         while queue:
             if len(queue) > max_memory:
                 max_memory = len(queue)
-            y, x = queue.pop(0)
+            cell = queue.popleft()
             steps_taken += 1
-            if y == y2 and x == x2:
+            if cell == target:
                 break  # target reached: early stop
-            directions = get_adjacent(y, x)
-            for dir_y, dir_x in directions:
-                if self.tile_map[dir_y, dir_x] == 0:
-                    dist = distance_matrix[y, x] + 1
-                    if distance_matrix[dir_y, dir_x] == -1 or dist < distance_matrix[dir_y, dir_x]:
-                        distance_matrix[dir_y, dir_x] = dist
-                        queue.append((dir_y, dir_x))
+            dist = distances[cell] + 1
+            for next_cell in neighbour_lists[cell]:
+                if distances[next_cell] == -1:
+                    distances[next_cell] = dist
+                    queue.append(next_cell)
         if pathfinding_stats:
             pathfinding_stats['steps'] = steps_taken
             pathfinding_stats['memory'] = max_memory * 8
-        return Level.moves_from_distance_matrix(x1, y1, x2, y2, distance_matrix)
+        return graph.moves_from_distances(start, target, distances)
 
+    # depth-first search that goes through a tile again whenever it finds a shorter path to it, so the path is
+    # a shortest one; it heads towards the target first and leaves out the tiles that are too far from the start
+    # and the target together (by the manhattan distance) to be on a path to it within a limit, which is deepened
+    # until the target is reached, and then on a path shorter than the one to the target so far
     def shortest_path_dfs(self, x1, y1, x2, y2, pathfinding_stats):
-        get_adjacent = lambda y, x: [(y, x + 1), (y, x - 1), (y - 1, x), (y + 1, x)]  # right, left, up, down
-        distance_matrix = np.ones(self.tile_map.shape, dtype=int) * -1
-        # fill distance matrix
-        distance_matrix[y1, x1] = 0
-        stack = [(y1, x1)]
+        graph = self.get_corridor_graph()
+        neighbour_lists, xs, ys = graph.neighbour_lists, graph.xs, graph.ys
+        start, target = graph.corridor_id(x1, y1), graph.corridor_id(x2, y2)
+        limit = abs(x2 - x1) + abs(y2 - y1)  # no path to the target is any shorter
         steps_taken = 0
         max_memory = 1
-        while stack:
-            if len(stack) > max_memory:
-                max_memory = len(stack)
-            y, x = stack.pop()
-            steps_taken += 1
-            directions = get_adjacent(y, x)
-            for dir_y, dir_x in directions:
-                if self.tile_map[dir_y, dir_x] == 0:
-                    dist = distance_matrix[y, x] + 1
-                    if distance_matrix[dir_y, dir_x] == -1 or dist < distance_matrix[dir_y, dir_x]:
-                        distance_matrix[dir_y, dir_x] = dist
-                        stack.append((dir_y, dir_x))
+        while True:
+            # fill distances
+            distances = [-1] * graph.size
+            distances[start] = 0
+            stack = [start]
+            next_limit = None  # the shortest of the paths left out
+            while stack:
+                if len(stack) > max_memory:
+                    max_memory = len(stack)
+                cell = stack.pop()
+                steps_taken += 1
+                dist = distances[cell] + 1
+                bound = limit if distances[target] == -1 else distances[target]
+                children = []
+                for next_cell in neighbour_lists[cell]:
+                    if distances[next_cell] == -1 or dist < distances[next_cell]:
+                        length = dist + abs(xs[next_cell] - x2) + abs(ys[next_cell] - y2)
+                        if length <= bound:
+                            children.append((length, next_cell))
+                        elif next_limit is None or length < next_limit:
+                            next_limit = length
+                children.sort(reverse=True)  # the one closest to the target is searched first
+                for length, next_cell in children:
+                    distances[next_cell] = dist
+                    stack.append(next_cell)
+            if distances[target] != -1 or next_limit is None:
+                break  # reached the target, or everything that can be reached
+            limit = max(next_limit, limit + limit // 4)
         if pathfinding_stats:
             pathfinding_stats['steps'] = steps_taken
             pathfinding_stats['memory'] = max_memory * 8
-        return Level.moves_from_distance_matrix(x1, y1, x2, y2, distance_matrix)
+        return graph.moves_from_distances(start, target, distances)
 
     def shortest_path_a_star(self, x1, y1, x2, y2, pathfinding_stats):
-        get_adjacent = lambda y, x: [(y, x + 1), (y, x - 1), (y - 1, x), (y + 1, x)]  # right, left, up, down
-        distance_matrix = np.ones(self.tile_map.shape, dtype=int) * -1
+        return self.shortest_path_best_first(x1, y1, x2, y2, pathfinding_stats, Level.manhattan_distance)
+
+    def shortest_path_greedy(self, x1, y1, x2, y2, pathfinding_stats):
+        return self.shortest_path_best_first(x1, y1, x2, y2, pathfinding_stats, Level.euclidean_distance)
+
+    # expand tiles in order of distance travelled + heuristic, using a binary heap;
+    # outdated heap entries are skipped when popped instead of being removed
+    def shortest_path_best_first(self, x1, y1, x2, y2, pathfinding_stats, heuristic):
+        graph = self.get_corridor_graph()
+        neighbour_lists, xs, ys = graph.neighbour_lists, graph.xs, graph.ys
+        start, target = graph.corridor_id(x1, y1), graph.corridor_id(x2, y2)
+        distances = [-1] * graph.size
+        closed = bytearray(graph.size)
         # fill distance matrix
-        distance_matrix[y1, x1] = 0
-        tile_list = [(Level.manhattan_distance(self, x1, y1, x2, y2), y1, x1)]
+        distances[start] = 0
+        tile_heap = [(heuristic(self, x1, y1, x2, y2), start)]  # ids keep the (y, x) tie order
+        heappush, heappop = heapq.heappush, heapq.heappop
         steps_taken = 0
         max_memory = 1
-        while tile_list:
-            if len(tile_list) > max_memory:
-                max_memory = len(tile_list)
-            tile_list.sort()  # should be a priority queue
-            f, y, x = tile_list.pop(0)
+        while tile_heap:
+            if len(tile_heap) > max_memory:
+                max_memory = len(tile_heap)
+            f, cell = heappop(tile_heap)
+            if closed[cell]:
+                continue  # outdated entry
+            closed[cell] = 1
             steps_taken += 1
-            if y == y2 and x == x2:
+            if cell == target:
                 break  # target reached: early stop
             # look at neigbours
-            directions = get_adjacent(y, x)
-            for dir_y, dir_x in directions:
-                if self.tile_map[dir_y, dir_x] == 0:  # check corridor
-                    dist = distance_matrix[y, x] + 1
-                    heur = Level.manhattan_distance(self, dir_x, dir_y, x2, y2)
-                    curr_f = dist + heur
-                    if distance_matrix[dir_y, dir_x] == -1 or dist < distance_matrix[dir_y, dir_x]:
-                        distance_matrix[dir_y, dir_x] = dist
-                        tile_list.append((curr_f, dir_y, dir_x))
+            dist = distances[cell] + 1
+            for next_cell in neighbour_lists[cell]:
+                if closed[next_cell]:
+                    continue
+                next_dist = distances[next_cell]
+                if next_dist == -1 or dist < next_dist:
+                    distances[next_cell] = dist
+                    heur = heuristic(self, xs[next_cell], ys[next_cell], x2, y2)
+                    heappush(tile_heap, (dist + heur, next_cell))
         if pathfinding_stats:  # record pathfinding stats
             pathfinding_stats['steps'] = steps_taken
             pathfinding_stats['memory'] = max_memory * 8
+        return graph.moves_from_distances(start, target, distances)
+
+    # expand the whole frontier at once with array operations, then backtrack from the target
+    def shortest_path_wavefront(self, x1, y1, x2, y2, pathfinding_stats):
+        distance_matrix, layers, peak_frontier = wavefront_distances(self.tile_map, x1, y1, x2, y2)
+        if pathfinding_stats:  # record pathfinding stats
+            pathfinding_stats['steps'] = layers
+            pathfinding_stats['memory'] = peak_frontier * 8
+        if distance_matrix[y2, x2] < 0:
+            return []  # target can't be reached
         return Level.moves_from_distance_matrix(x1, y1, x2, y2, distance_matrix)
 
-    def shortest_path_greedy(self, x1, y1, x2, y2, pathfinding_stats):
-        get_adjacent = lambda y, x: [(y, x + 1), (y, x - 1), (y - 1, x), (y + 1, x)]  # right, left, up, down
-        distance_matrix = np.ones(self.tile_map.shape, dtype=int) * -1
-        # fill distance matrix
-        distance_matrix[y1, x1] = 0
-        tile_list = [(Level.euclidean_distance(self, x1, y1, x2, y2), y1, x1)]
-        steps_taken = 0
-        max_memory = 1
-        while tile_list:
-            if len(tile_list) > max_memory:
-                max_memory = len(tile_list)
-            tile_list.sort()  # should be a priority queue
-            f, y, x = tile_list.pop(0)
-            steps_taken += 1
-            if y == y2 and x == x2:
-                break  # target reached: early stop
-            # look at neigbours
-            directions = get_adjacent(y, x)
-            for dir_y, dir_x in directions:
-                if self.tile_map[dir_y, dir_x] == 0:  # check corridor
-                    dist = distance_matrix[y, x] + 1
-                    heur = Level.euclidean_distance(self, dir_x, dir_y, x2, y2)
-                    curr_f = dist + heur
-                    if distance_matrix[dir_y, dir_x] == -1 or dist < distance_matrix[dir_y, dir_x]:
-                        distance_matrix[dir_y, dir_x] = dist
-                        tile_list.append((curr_f, dir_y, dir_x))
+    # search the graph of junctions and dead ends instead of single tiles, whole corridors
+    # are crossed in one step and only turned back into tile moves at the end
+    def shortest_path_junction(self, x1, y1, x2, y2, pathfinding_stats):
+        junction_graph = self.get_junction_graph()
+        graph = junction_graph.graph
+        path, steps_taken, max_memory = junction_graph.shortest_path(graph.corridor_id(x1, y1),
+                                                                     graph.corridor_id(x2, y2))
         if pathfinding_stats:  # record pathfinding stats
             pathfinding_stats['steps'] = steps_taken
             pathfinding_stats['memory'] = max_memory * 8
-        return Level.moves_from_distance_matrix(x1, y1, x2, y2, distance_matrix)
+        return junction_graph.moves_along(path)
+
+    # distances from a point to every tile of the map (-1 for unreachable tiles);
+    # paths to any number of targets can be read from it with moves_from_distance_matrix
+    def distance_field(self, x, y):
+        return wavefront_distances(self.tile_map, x, y)[0]
 
     @staticmethod
     def manhattan_distance(self, x1, y1, x2, y2):
@@ -319,7 +438,7 @@ class Level:
         return ((x1-x2)**2 + (y1-y2)**2)**0.5
 
     def add_ghosts(self):
-        params = difficulty_settings[self.difficulty]
+        params = self.settings
         ghost_frames_per_tile = params["ghost_frames_per_tile"]
         ghost_amount = params["ghost_amount"]
         random_move_chance = params["random_move_chance"]
@@ -327,7 +446,7 @@ class Level:
         spawn_points = self.get_random_locations_in_corners(ghost_amount)
         for spawn_y, spawn_x in spawn_points:
             ghost = Ghost(spawn_x, spawn_y, ghost_frames_per_tile, random_move_chance)
-            self.ghosts.add(ghost)
+            self.ghosts.append(ghost)
 
     # get up to 4 random locations in different corners of the map
     def get_random_locations_in_corners(self, points_amount=4):
@@ -339,9 +458,9 @@ class Level:
         for qy, qx in quadrant_topleft_points:
             point = 0, 0
             while self.tile_map[point[0], point[1]] != 0:  # find a random empty tile in quadrant
-                point = qy + random.randint(0, quadrant_h-1), qx + random.randint(0, quadrant_w-1)
+                point = qy + self.rng.randint(0, quadrant_h-1), qx + self.rng.randint(0, quadrant_w-1)
             points.append(point)
-        random.shuffle(points)
+        self.rng.shuffle(points)
         return points[:points_amount]
 
     # places coins all over the map, except for the spawn point
@@ -355,21 +474,101 @@ class Level:
                     #    self.coins.add(Coin(x, y))
 
     def add_coin(self, tile_x, tile_y):
-        if self.tile_map[tile_y, tile_x] == 0:  # place coins in empty corridors
-            # check that the new coin does not intersect with other coins
-            intersect = False
-            for coin in self.coins:
-                if coin.tile_y == tile_y and coin.tile_x == tile_x:
-                    intersect = True
-                    break
-            if not intersect:
-                self.coins.add(Coin(tile_x, tile_y))
-
-
-class Character(pygame.sprite.Sprite):
-    def __init__(self, tile_x, tile_y):
-        # Call the parent's constructor
-        pygame.sprite.Sprite.__init__(self)
+        # place coins in empty corridors, without intersecting other coins
+        if self.tile_map[tile_y, tile_x] == 0 and self.coin_grid[tile_y, tile_x] < 0:
+            coin = Coin(tile_x, tile_y, self.coins_placed)
+            self.coin_grid[tile_y, tile_x] = coin.coin_id
+            self.coins_placed += 1
+            self.coin_mask |= 1 << coin.coin_id
+            self.coins[coin.coin_id] = coin
+
+    # id of the coin on a tile, -1 if there is none
+    def coin_id_at(self, tile_x, tile_y):
+        return int(self.coin_grid[tile_y, tile_x])
+
+    # remove the coin on a tile, returns whether there was one
+    def pick_up_coin(self, tile_x, tile_y):
+        coin_id = self.coin_id_at(tile_x, tile_y)
+        if coin_id < 0:
+            return False
+        del self.coins[coin_id]
+        self.coin_grid[tile_y, tile_x] = -1
+        self.coin_mask &= ~(1 << coin_id)
+        return True
+
+
+# the random draws of a game once it's under way (ghosts moving randomly, pacman picking a random leaf),
+# every draw goes through draw() so that replays can record them or check them against a recording
+class GameRandom:
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.frame = 0  # frame of the game the draws are made in
+        self.on_draw = None  # optional function of (frame, value) of every draw, returns the value to use
+
+    # a float in [0, 1)
+    def random(self):
+        return self.draw(self.rng.random())
+
+    # an int in [0, n)
+    def below(self, n):
+        return self.draw(self.rng.randrange(n))
+
+    def choice(self, seq):
+        return seq[self.below(len(seq))]
+
+    def draw(self, value):
+        if self.on_draw:
+            return self.on_draw(self.frame, value)
+        return value
+
+
+# the game without a display: a level (with its ghosts and coins) and pacman, advanced a frame at a time
+# by step() as fast as the AI can think, the game's window only draws it (see Source.sprites)
+class Simulation:
+    def __init__(self, level, pacman, game_mode="Game"):
+        self.level = level
+        self.pacman = pacman
+        self.game_mode = game_mode  # "Game" or "Pathfinding" (pacman walks to the coins, nothing chases him)
+        self.pathfinding_stats = {"algo": "bfs", "time": timedelta(microseconds=0),
+                                  "steps": 0, "memory": 0}  # stats about pathfinding algorithms
+        self.frame = 0
+        self.state = "running"  # "victory" once all of the coins are eaten, "defeat" once pacman is caught
+
+    # a new level with pacman in the middle of it (settings replace the difficulty's difficulty_settings entry)
+    @staticmethod
+    def create(width, height, difficulty=0, game_mode="Game", seed=None, settings=None):
+        if game_mode == "Pathfinding":
+            level = Level(width, height, difficulty=0, ghosts_n_coins=False, seed=seed, settings=settings)
+        else:
+            level = Level(width, height, difficulty=difficulty, ghosts_n_coins=True, seed=seed, settings=settings)
+        return Simulation(level, PacMan(width // 2, height // 2), game_mode)
+
+    # update the game for 1 frame, returns its state
+    def step(self):
+        if self.state != "running":
+            return self.state
+        level, pacman = self.level, self.pacman
+        level.random.frame = level.pacman_random.frame = self.frame
+        pacman.update(level, self.game_mode, self.pathfinding_stats)
+        for ghost in level.ghosts:
+            ghost.update(level, pacman)
+        self.frame += 1
+        if not level.coins and self.game_mode == "Game":  # win the game once all of the coins have been eaten
+            self.state = "victory"
+        elif pacman.dead:
+            self.state = "defeat"
+        return self.state
+
+    # step until the game is over or max_frames frames have passed, returns its state
+    def run(self, max_frames=None):
+        while self.state == "running" and (max_frames is None or self.frame < max_frames):
+            self.step()
+        return self.state
+
+
+# a character of the game without any graphics, the sprites of the game view only draw it
+class Character:
+    def __init__(self, tile_x, tile_y, size):
         # movement
         self.curr_tile_x, self.curr_tile_y = tile_x, tile_y
         self.move_frame = 0
@@ -377,7 +576,9 @@ class Character(pygame.sprite.Sprite):
         self.planned_moves = []
         self.sprite_offset_x = 0  # move a sprite a bit to the right to center it
         self.move_frames = None
-        self.rect = None
+        # top left corner of the character's sprite in pixels and its size
+        self.left, self.top = tile_x * TILE_SIZE, tile_y * TILE_SIZE
+        self.width, self.height = size
 
     # updates movement for 1 frame, following and executing planned_moves
     def move(self):
@@ -390,70 +591,171 @@ class Character(pygame.sprite.Sprite):
         if self.curr_move:
             self.move_frame += 1
             movement_percent = self.move_frame / self.move_frames
-            self.rect.left = int((self.curr_tile_x + self.curr_move[1] * movement_percent) * TILE_SIZE)
-            self.rect.left = self.rect.left + self.sprite_offset_x
-            self.rect.top = int((self.curr_tile_y + self.curr_move[0] * movement_percent) * TILE_SIZE)
+            self.left = int((self.curr_tile_x + self.curr_move[1] * movement_percent) * TILE_SIZE)
+            self.left = self.left + self.sprite_offset_x
+            self.top = int((self.curr_tile_y + self.curr_move[0] * movement_percent) * TILE_SIZE)
             if self.move_frame >= self.move_frames:  # finish move
                 self.curr_tile_x += self.curr_move[1]
                 self.curr_tile_y += self.curr_move[0]
                 self.curr_move = None
 
+    # center of the character's sprite in pixels
+    def center(self):
+        return self.left + self.width // 2, self.top + self.height // 2
+
 
 class PacMan(Character):
     def __init__(self, tile_x, tile_y):
         # Call the parent's constructor
-        super(PacMan, self).__init__(tile_x, tile_y)
-        # load image
-        self.pacman_image = pygame.image.load("Assets/Images/pacman.png").convert_alpha()
-        self.scared_image = pygame.image.load("Assets/Images/pacman_scared.png").convert_alpha()
-        self.current_image = self.pacman_image
-        self.dead_image = pygame.image.load("Assets/Images/pacman_dead.png").convert_alpha()
-        self.image = self.pacman_image
-        self.rect = self.image.get_rect()
-        self.rect.left = tile_x * TILE_SIZE
-        self.rect.top = tile_y * TILE_SIZE
+        super(PacMan, self).__init__(tile_x, tile_y, PACMAN_SIZE)
+        self.scared = False  # whether pacman sees no way out
         # movement
         self.move_frames = PACMAN_MOVE_FRAMES  # how many frames it takes to move one cell
         # being eaten by ghosts
         self.dead = False
+        # look-ahead used in game mode: "transposition" (TranspositionSearch), "array" (ArraySearch),
+        # "alphabeta" (AlphaBetaSearch), "expectimax" (ExpectimaxSearch), "mcts" (MonteCarloSearch),
+        # "parallel" (RootParallelSearch, on the level's search_pool) or "tree" (GameState objects)
+        self.planner = "transposition"
+        self.time_budget = None  # seconds per decision to deepen the search in, None for PACMAN_AI_DEPTH
+        self.mcts_iterations = MCTS_ITERATIONS  # iterations per decision of "mcts" without a time budget
+        self.search_depth = 0  # how many moves ahead the last decision looked
+        self.last_search = None  # search of the last decision, the next one can build on it
+        # (predicted WorldSnapshot, future of its plan, threading.Event that stops the plan) while planning ahead
+        self.speculation = None
+        self.on_decision = None  # optional function of every move pacman decides on, returns the move to make
 
     def update(self, level, game_mode, pathfinding_stats):
         if self.dead:  # dead men tell no tales
             return
+        starting = not self.curr_move and bool(self.planned_moves)
         self.move()
-        if self.curr_move:  # rotate sprite towards movement
-            self.rotate_towards_direction(self.curr_move)
+        if starting and game_mode == "Game" and level.executor and self.planner != "tree":
+            self.plan_ahead(level)  # think about the next move while this one plays out
         # movement finished: search for new targets
         if not self.curr_move and not self.planned_moves and level.coins:
-            for coin in level.coins:
-                # if pacman is on top of the coin, consume it immediately
-                if self.curr_tile_x == coin.tile_x and self.curr_tile_y == coin.tile_y:
-                    coin.kill()  # devour the coin
-                    level.score += 10  # claim some points
+            # if pacman is on top of a coin, consume it immediately
+            if level.pick_up_coin(self.curr_tile_x, self.curr_tile_y):
+                level.score += 10  # claim some points
             if level.coins:
                 if game_mode == "Game":  # move while avoiding ghosts
-                    self.planned_moves = [self.choose_best_move(level)]
+                    move = self.choose_best_move(level)
+                    if self.on_decision:
+                        move = self.on_decision(move)
+                    self.planned_moves = [move]
                 elif game_mode == "Pathfinding":  # just move towards coins
                     coin = None
-                    for c in level.coins:  # choose first coin as target
+                    for c in level.coins.values():  # choose first coin as target
                         coin = c
                         break
                     self.planned_moves = level.find_shortest_path(self.curr_tile_x, self.curr_tile_y,
                                                                   coin.tile_x, coin.tile_y, pathfinding_stats)
 
-    def rotate_towards_direction(self, direction):
-        angles = {(0, 1): 0, (0, -1): 180, (-1, 0): 90, (1, 0): 270}
-        self.image = pygame.transform.rotate(self.current_image, angles[direction])
-
     def die(self):
         self.dead = True
-        self.image = self.dead_image
 
     def choose_best_move(self, level):
-        # fetch current game state
-        curr_state = self.fetch_game_state(level)
-        # find a strategy that lets pacman eat the most coins
-        return curr_state.pick_best_move(level, self)
+        if level.search_stats:
+            level.search_stats.begin("pacman")
+        self.search_depth = PACMAN_AI_DEPTH
+        if self.planner == "tree":
+            # fetch current game state
+            curr_state = self.fetch_game_state(level)
+            # find a strategy that lets pacman eat the most coins
+            move = curr_state.pick_best_move(level, self)
+        else:
+            outcome = self.speculative_outcome(level)
+            if outcome is None:
+                outcome, self.search_depth, self.last_search = self.plan(level, WorldSnapshot.observe(level, self),
+                                                                         self.last_search)
+            move = ArraySearch.choose_move(level, self, outcome)
+        if level.search_stats:
+            level.search_stats.reached_depth(self.search_depth)
+            level.search_stats.end()
+        return move
+
+    # search a world with the selected planner, returns the outcome, how deep the search went and
+    # the search itself when the next one can build on it (previous is the last such search)
+    # (safe to run on another thread, nothing but the level's caches is touched, previous is only read;
+    # setting the stop event makes the searches raise SearchTimeout)
+    def plan(self, level, world, previous=None, stop=None):
+        engines = {"transposition": TranspositionSearch, "array": ArraySearch, "alphabeta": AlphaBetaSearch,
+                   "expectimax": ExpectimaxSearch, "mcts": MonteCarloSearch, "parallel": RootParallelSearch}
+        engine = engines[self.planner]
+        if type(previous) is not engine or previous.level is not level:
+            previous = None
+        if engine is MonteCarloSearch:  # it keeps to the budget by itself, no need to deepen
+            if self.time_budget is None:
+                search = MonteCarloSearch(level, PACMAN_AI_DEPTH, iterations=self.mcts_iterations)
+            else:
+                search = MonteCarloSearch(level, deadline=time.perf_counter() + self.time_budget, iterations=None)
+            search.stop = stop
+            outcome = search.search(world, previous)
+            return outcome, search.tree_depth, search
+        if self.time_budget is None:
+            search = engine(level)
+            search.stop = stop
+            outcome = search.search(world, previous)
+            return outcome, PACMAN_AI_DEPTH, search
+        return self.search_within_budget(level, engine, world, previous, stop)
+
+    # iterative deepening: search 1, 2, 3... moves ahead until the time budget runs out
+    # and take the outcome of the deepest search that finished (the first one always does),
+    # a reusable previous tree is only extended, so the deepening starts at its depth
+    def search_within_budget(self, level, engine, world, previous=None, stop=None):
+        deadline = time.perf_counter() + self.time_budget
+        outcome, depth, search = None, 0, None
+        extending = previous is not None and previous.reusable_child(world) is not None
+        if extending:
+            depth = min(previous.depth, PACMAN_MAX_AI_DEPTH) - 1
+        last_elapsed, growth = 0.0, 1.0
+        while depth < PACMAN_MAX_AI_DEPTH:
+            start_time = time.perf_counter()
+            try:
+                # the first depth gets no deadline (unless it extends the previous tree), so there is an outcome
+                engine_search = engine(level, depth + 1, deadline if outcome or extending else None)
+                engine_search.stop = stop
+                result = engine_search.search(world, previous)
+            except SearchTimeout:
+                if stop is not None and stop.is_set():
+                    break
+                if outcome is None:  # even extending the previous tree took too long, start over
+                    depth, previous, extending = 0, None, False
+                    continue
+                break
+            outcome, depth, search = result, depth + 1, engine_search
+            elapsed = time.perf_counter() - start_time
+            if last_elapsed:
+                growth = max(1.0, elapsed / last_elapsed)
+            last_elapsed = elapsed
+            if time.perf_counter() + elapsed * growth > deadline:
+                break  # the next depth wouldn't finish in time anyway
+        return outcome, depth, search
+
+    # start planning the next decision on the level's executor as soon as a move starts,
+    # from where pacman, the ghosts and the coins are expected to be once the move is over
+    def plan_ahead(self, level):
+        arrival_x, arrival_y = self.curr_tile_x + self.curr_move[1], self.curr_tile_y + self.curr_move[0]
+        frames = self.move_frames - self.move_frame  # ghost updates until pacman decides again
+        ghosts = [g.predict_position(level, self.curr_tile_x, self.curr_tile_y, frames) for g in level.ghosts]
+        coins = [(coin.tile_x, coin.tile_y, coin.coin_id) for coin in level.coins.values()
+                 if coin.tile_x != arrival_x or coin.tile_y != arrival_y]  # the coin there gets eaten
+        world = WorldSnapshot(arrival_x, arrival_y, ghosts, coins, level.map_version)
+        stop = threading.Event()
+        self.speculation = (world, level.executor.submit(self.plan, level, world, self.last_search, stop), stop)
+
+    # outcome of the speculative plan, None if there is none or the world turned out differently
+    def speculative_outcome(self, level):
+        if self.speculation is None:
+            return None
+        world, future, stop = self.speculation
+        self.speculation = None
+        if world != WorldSnapshot.observe(level, self):
+            future.cancel()
+            stop.set()  # cancel doesn't stop a plan that is already running
+            return None
+        outcome, self.search_depth, self.last_search = future.result()
+        return outcome
 
     def fetch_game_state(self, level):
         # save pacman location
@@ -474,6 +776,7 @@ class GhostPosition:
         self.move_dir = None
         self.move_progress = 0
         self.move_frames = 0  # how many frames it takes to move one cell
+        self.random_move_chance = 0.0
 
     def get_from_ghost(self, ghost):
         self.tile_x = ghost.curr_tile_x
@@ -481,6 +784,7 @@ class GhostPosition:
         self.move_dir = ghost.curr_move
         self.move_progress = ghost.move_frame
         self.move_frames = ghost.move_frames
+        self.random_move_chance = ghost.random_move_chance
 
     def copy_from_other(self, other):
         self.tile_x = other.tile_x
@@ -488,16 +792,97 @@ class GhostPosition:
         self.move_dir = other.move_dir
         self.move_progress = other.move_progress
         self.move_frames = other.move_frames
+        self.random_move_chance = other.random_move_chance
+
+
+# counts the work done by AI decisions: search tree nodes, children pruned as deadly
+# and path queries, both for the last decision and summed up over the level
+# opt in by setting level.search_stats = SearchStats(), everything is skipped otherwise
+# (work done on other threads, like speculative planning, isn't counted)
+class SearchStats:
+    counters = ("nodes", "expanded", "children", "pruned", "path_queries", "time_ns")
+
+    def __init__(self):
+        self.last = {agent: self.empty_counters() for agent in ("pacman", "ghost")}
+        self.totals = {agent: dict(dict.fromkeys(SearchStats.counters, 0), decisions=0, peak_nodes=0, max_depth=0)
+                       for agent in ("pacman", "ghost")}
+        self.agent = None  # agent whose decision is being counted
+        self.current = None
+        self.thread = None  # only the thread making the decision reports into it
+        self.start_time = 0
+
+    @staticmethod
+    def empty_counters():
+        return {"nodes": 1, "expanded": 0, "children": 0, "pruned": 0, "path_queries": 0, "time_ns": 0,
+                "depth": 0}
+
+    def begin(self, agent):
+        self.agent = agent
+        self.current = self.empty_counters()  # the root node of the tree
+        self.thread = threading.get_ident()
+        self.start_time = time.perf_counter_ns()
+
+    def end(self):
+        current = self.current
+        current["time_ns"] = time.perf_counter_ns() - self.start_time
+        self.last[self.agent] = current
+        totals = self.totals[self.agent]
+        for counter in SearchStats.counters:
+            totals[counter] += current[counter]
+        totals["decisions"] += 1
+        # the whole tree is kept until the decision is made, so its size is the peak
+        totals["peak_nodes"] = max(totals["peak_nodes"], current["nodes"])
+        totals["max_depth"] = max(totals["max_depth"], current["depth"])
+        self.agent = self.current = None
+
+    # a state got its children evaluated
+    # (or that many states at once)
+    def expanded(self, children, pruned=0, states=1):
+        if self.current and self.thread == threading.get_ident():
+            self.current["expanded"] += states
+            self.current["children"] += children
+            self.current["nodes"] += children
+            self.current["pruned"] += pruned
+
+    # counters of work done for the decision in another process
+    def add(self, counters):
+        if self.current and self.thread == threading.get_ident():
+            for counter in ("expanded", "children", "pruned", "path_queries"):
+                self.current[counter] += counters[counter]
+            self.current["nodes"] += counters["children"]
+
+    # how many moves ahead the decision looked
+    def reached_depth(self, depth):
+        if self.current and self.thread == threading.get_ident():
+            self.current["depth"] = depth
+
+    def path_query(self, count=1):
+        if self.current and self.thread == threading.get_ident():
+            self.current["path_queries"] += count
+
+    # average number of children of an expanded state
+    @staticmethod
+    def branching_factor(counters):
+        return counters["children"] / counters["expanded"] if counters["expanded"] else 0.0
+
+    def as_dict(self):
+        result = {}
+        for agent in ("pacman", "ghost"):
+            last, totals = dict(self.last[agent]), dict(self.totals[agent])
+            last["branching"] = SearchStats.branching_factor(last)
+            totals["branching"] = SearchStats.branching_factor(totals)
+            result[agent] = {"last": last, "level": totals}
+        return result
 
 
 class GameState:
-    def __init__(self, parent, pacman_x, pacman_y, depth=0, ghosts=None, picked_coins=[], move_here=None):
+    def __init__(self, parent, pacman_x, pacman_y, depth=0, ghosts=None, picked_coins=0, move_here=None):
         self.parent = parent
         self.children = []
         self.pacman_x, self.pacman_y = pacman_x, pacman_y
         self.ghosts = ghosts  # list of ghost positions
         self.depth = depth
-        self.picked_coins = picked_coins  # coordinates of coins picked up by pacman on the way
+        self.picked_coins = picked_coins  # bitmask of the ids of coins picked up by pacman on the way
         self.picked_coin_now = False  # whether pacman just picked a coin by his (last) move here
         self.move_here = move_here  # a last move that lead pacman into this state
 
@@ -512,6 +897,7 @@ class GameState:
         new_ghosts = self.simulate_ghosts_movement(level)
         # find valid moves
         directions = [(0, 1), (0, -1), (-1, 0), (1, 0)]
+        pruned = 0
         for direction in directions: 
             # don't allow backtracking
             if self.move_here:
@@ -522,11 +908,15 @@ class GameState:
             target_x = self.pacman_x + direction[1]
             if level.tile_map[target_y, target_x] == 0:  # move only through corridors
                 new_state = GameState(self, target_x, target_y, self.depth+1,
-                                      new_ghosts, self.picked_coins.copy(), direction)
+                                      new_ghosts, self.picked_coins, direction)
                 if not new_state.is_deadly():
                     new_state.pick_coin(level)
                     new_state.evaluate_children(level)  # evaluate a new state recursively
                     self.children.append(new_state)
+                else:
+                    pruned += 1
+        if level.search_stats:
+            level.search_stats.expanded(len(self.children), pruned)
 
     def pick_random_move(self, level):
         directions = [(0, 1), (0, -1), (-1, 0), (1, 0)]
@@ -536,24 +926,24 @@ class GameState:
             target_x = self.pacman_x + direction[1]
             if level.tile_map[target_y, target_x] == 0:  # move only through corridors
                 possible_moves.append(direction)
-        return random.choice(possible_moves)
+        return level.pacman_random.choice(possible_moves)
 
     def pick_best_move(self, level, pacman):
         self.evaluate_children(level)
         #richest_leaf = self.get_richest_leaf()
         #return self.get_first_move_towards(richest_leaf)
         # search for the closest coin
-        closest_coin_state = self.get_closest_coin_state()
+        closest_coin_state = self.get_closest_coin_state(level.pacman_random)
         if closest_coin_state:
-            pacman.current_image = pacman.pacman_image
+            pacman.scared = False
             return self.get_first_move_towards(closest_coin_state)
         else:  # the situation is hopeless at this point, just panic
-            pacman.current_image = pacman.scared_image  # be frightened
+            pacman.scared = True  # be frightened
             return self.pick_random_move(level)
 
     # find game state that yields a coin in a smallest amount of moves
     # if no such state exists, move randomly
-    def get_closest_coin_state(self):
+    def get_closest_coin_state(self, rng):
         queue = [self]
         leaves = []
         while queue:  # breadth-first search
@@ -570,7 +960,7 @@ class GameState:
                 leaves.append(curr_state)
         # if no path within the field of vision yields a coin, move randomly
         if leaves:
-            return random.choice(leaves)
+            return rng.choice(leaves)
 
     # check whether a state has at least one descendant at max depth that is not deadly
     def has_surviving_leaves(self):
@@ -590,7 +980,7 @@ class GameState:
             return self
         richest_leaves = [child.get_richest_leaf() for child in self.children]
         # TODO: choose closest max value
-        coins_amount = [len(leaf.picked_coins) for leaf in richest_leaves]
+        coins_amount = [bin(leaf.picked_coins).count("1") for leaf in richest_leaves]
         richest_leaf = richest_leaves[np.argmax(np.array(coins_amount))]
         return richest_leaf
 
@@ -610,68 +1000,1413 @@ class GameState:
 
     # check if a ghost is in range of pacman
     def check_collision(self, ghost, clear_range=1.2):
-        ghost_y = ghost.tile_y + ghost.move_dir[0] * ghost.move_progress / ghost.move_frames
-        ghost_x = ghost.tile_x + ghost.move_dir[1] * ghost.move_progress / ghost.move_frames
+        move_dir = ghost.move_dir or (0, 0)  # a ghost that caught up with pacman stands still
+        ghost_y = ghost.tile_y + move_dir[0] * ghost.move_progress / ghost.move_frames
+        ghost_x = ghost.tile_x + move_dir[1] * ghost.move_progress / ghost.move_frames
         px, py = self.pacman_x, self.pacman_y
         # try to maintain at least clear_range tiles from a ghost
         return ((ghost_y-py)**2 + (ghost_x-px)**2)**0.5 < clear_range
 
     # pick a coin if it is located in the same tile as pacman
     def pick_coin(self, level):
-        pac_pos = self.pacman_y, self.pacman_x
-        if pac_pos in self.picked_coins:  # check if the coin is already picked
+        coin_id = level.coin_id_at(self.pacman_x, self.pacman_y)
+        if coin_id < 0 or self.picked_coins >> coin_id & 1:  # no coin here or it is already picked
             return
-        for coin in level.coins:  # check if pacman is currently standing on a coin
-            if coin.tile_x == self.pacman_x and coin.tile_y == self.pacman_y:
-                self.picked_coins.append((coin.tile_y, coin.tile_x))  # pick up a coin
-                self.picked_coin_now = True
+        self.picked_coins |= 1 << coin_id  # pick up a coin
+        self.picked_coin_now = True
 
     # simulate movement for a list of ghost positions and return a new list
     def simulate_ghosts_movement(self, level):
-        return [self.simulate_ghost_movement(g, level) for g in self.ghosts]
+        # a single search from pacman tells every ghost where to go
+        field = level.distance_field_from(self.pacman_x, self.pacman_y)
+        return [self.simulate_ghost_movement(g, level, field) for g in self.ghosts]
 
-    def simulate_ghost_movement(self, old_ghost, level):
+    def simulate_ghost_movement(self, old_ghost, level, field):
         ghost = GhostPosition()  # create a copy of the ghost
         ghost.copy_from_other(old_ghost)
         if not ghost.move_dir:  # pick a good move
-            ghost.move_dir = self.pick_good_ghost_move(ghost, level)
+            ghost.move_dir = self.pick_good_ghost_move(ghost, level, field)
         ghost.move_progress += PACMAN_MOVE_FRAMES
-        while ghost.move_progress >= ghost.move_frames:  # move as time passes
+        while ghost.move_dir and ghost.move_progress >= ghost.move_frames:  # move as time passes
             ghost.tile_y += ghost.move_dir[0]
             ghost.tile_x += ghost.move_dir[1]
             # pick a good move
-            ghost.move_dir = self.pick_good_ghost_move(ghost, level)
+            ghost.move_dir = self.pick_good_ghost_move(ghost, level, field)
             ghost.move_progress -= ghost.move_frames
+        if not ghost.move_dir:  # the ghost is standing on pacman's tile
+            ghost.move_progress = 0
         return ghost
 
-    def pick_good_ghost_move(self, ghost, level):
-        path_moves = level.find_shortest_path(ghost.tile_x, ghost.tile_y,
-                                              self.pacman_x, self.pacman_y, None)
-        return path_moves[0]
+    # ghosts take the first move (right, left, up, down) that gets them closer to pacman
+    def pick_good_ghost_move(self, ghost, level, field):
+        return level.next_move_in_field(field, ghost.tile_x, ghost.tile_y)
+
+
+# raised by the look-ahead searches when their deadline passes
+class SearchTimeout(Exception):
+    pass
+
+
+# what the look-ahead needs to know about the world, copied so that it can be searched on another thread
+class WorldSnapshot:
+    def __init__(self, pacman_x, pacman_y, ghosts, coins, map_version):
+        self.pacman_x, self.pacman_y = pacman_x, pacman_y
+        self.ghosts = ghosts  # list of GhostPosition
+        self.coins = coins  # list of (tile_x, tile_y, coin id)
+        self.map_version = map_version
+
+    @staticmethod
+    def observe(level, pacman):
+        ghosts = []
+        for g in level.ghosts:
+            ghost = GhostPosition()
+            ghost.get_from_ghost(g)
+            ghosts.append(ghost)
+        coins = [(coin.tile_x, coin.tile_y, coin.coin_id) for coin in level.coins.values()]
+        return WorldSnapshot(pacman.curr_tile_x, pacman.curr_tile_y, ghosts, coins, level.map_version)
+
+    def key(self):
+        ghosts = tuple((g.tile_x, g.tile_y, g.move_dir, g.move_progress, g.move_frames) for g in self.ghosts)
+        return self.pacman_x, self.pacman_y, ghosts, tuple(self.coins), self.map_version
+
+    def __eq__(self, other):
+        return isinstance(other, WorldSnapshot) and self.key() == other.key()
+
+
+# the same look-ahead as GameState.pick_best_move, with the tree kept in flat arrays instead of objects:
+# node i has its parent, corridor, last move, coins picked so far (a bitmask) and ghost state at index i
+# the tree is built one depth layer at a time, so node order is the breadth-first order
+# that get_closest_coin_state visits the states in and every random draw stays the same
+class ArraySearch:
+    GHOST_PROGRESS_BITS = 16
+    NO_MOVE = 4  # direction index of a ghost standing still
+    OPPOSITE = [1, 0, 3, 2]  # direction index -> index of the opposite direction
+    BATCH_SIZE = 16  # smaller batches of ghost states are simulated one by one
+
+    def __init__(self, level, depth=PACMAN_AI_DEPTH, deadline=None):
+        self.level = level
+        self.depth = depth
+        self.deadline = deadline  # time.perf_counter value to give up at
+        self.stop = None  # threading.Event to give up at once it's set (a speculation that isn't needed any more)
+        self.graph = level.get_corridor_graph()
+        self.layers = [0]  # index of the first node of each depth
+        self.parent = array('i')
+        self.cell = array('i')  # corridor id of pacman's tile
+        self.move = array('b')  # direction index of the move into the node (-1 for the root)
+        self.first_move = array('b')  # direction index of the root move that leads to the node
+        self.picked_now = bytearray()  # whether the move into the node picked a coin
+        self.coins = []  # bitmask of the ids of the coins picked on the way
+        self.ghosts = array('i')  # id of the ghost state in ghost_states
+        self.ghost_states = []  # tuples of ghosts packed as ints: (cell * 5 + move) << 16 | progress
+        self.ghost_ids = {}  # packed ghosts -> id in ghost_states
+        self.ghost_centers = []  # ghost state id -> (y, x) of every ghost, including progress
+        self.center_array = np.empty((0, 0, 2))  # ghost_centers as an array, extended per layer
+        self.cell_ys, self.cell_xs = self.graph.cells // self.graph.width, self.graph.cells % self.graph.width
+        self.ghost_frames = []  # how many frames each ghost takes to move one cell
+        self.simulated = {}  # (ghost state id, pacman corridor) -> ghost state id a move later
+        self.fields = {}  # pacman corridor -> distances to it as a list
+        self.coin_bits = {}  # corridor id -> bit of the coin on it
+        self.map_version = None
+
+    def pick_best_move(self, pacman):
+        return ArraySearch.choose_move(self.level, pacman, self.search(WorldSnapshot.observe(self.level, pacman)))
+
+    # the outcome of a search: the direction index of the first move towards the closest coin
+    # (None if there is none) and how many leaves lie behind every first move, in breadth-first order
+    # the subtree of a previous search that pacman followed is reused if the world went as predicted
+    def search(self, world, previous=None):
+        self.build(world, previous)
+        node = self.closest_coin_node()
+        if node is not None:
+            return self.first_move[node], []
+        leaves = []
+        depth = self.depth
+        if depth + 1 < len(self.layers):
+            # the leaves are sorted by their first move, so count the runs
+            for node in range(self.layers[depth], self.layers[depth + 1]):
+                if leaves and leaves[-1][0] == self.first_move[node]:
+                    leaves[-1][1] += 1
+                else:
+                    leaves.append([self.first_move[node], 1])
+        return None, leaves
+
+    # the move a search outcome stands for, a random leaf is drawn the same way
+    # as the choice over the leaves of GameState.get_closest_coin_state
+    @staticmethod
+    def choose_move(level, pacman, outcome):
+        move, leaves = outcome
+        if move is None:  # no coin in reach: move towards a random surviving leaf
+            total = sum(count for first_move, count in leaves)
+            if total:
+                leaf = level.pacman_random.below(total)
+                for first_move, count in leaves:
+                    if leaf < count:
+                        move = first_move
+                        break
+                    leaf -= count
+            else:  # the situation is hopeless at this point, just panic
+                pacman.scared = True  # be frightened
+                return GameState(None, pacman.curr_tile_x, pacman.curr_tile_y).pick_random_move(level)
+        pacman.scared = False
+        return DIRECTIONS[move]
+
+    # ghost positions packed like in ghost_states, also notes how fast every ghost is
+    def pack_ghosts(self, ghosts):
+        self.ghost_frames.extend(ghost.move_frames for ghost in ghosts)
+        return self.packed_ghosts(ghosts)
+
+    def packed_ghosts(self, ghosts):
+        graph = self.graph
+        packed = []
+        for ghost in ghosts:
+            move = DIRECTIONS.index(ghost.move_dir) if ghost.move_dir else ArraySearch.NO_MOVE
+            cell = graph.corridor_id(ghost.tile_x, ghost.tile_y)
+            packed.append(((cell * 5 + move) << ArraySearch.GHOST_PROGRESS_BITS) | ghost.move_progress)
+        return tuple(packed)
+
+    # stop the search by raising SearchTimeout once the deadline (a time.perf_counter value) passes
+    # or the stop event is set
+    def check_deadline(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline or \
+                self.stop is not None and self.stop.is_set():
+            raise SearchTimeout()
+
+    # [function(*arguments) for arguments in zip(*lists)], checking the deadline every 256 calls
+    def map_checked(self, function, *lists):
+        results = []
+        for index, arguments in enumerate(zip(*lists)):
+            if not index & 0xFF:
+                self.check_deadline()
+            results.append(function(*arguments))
+        return results
+
+    # coin id bits of (tile_x, tile_y, coin id) coins, by corridor id
+    def coin_bits_by_corridor(self, coins):
+        graph = self.graph
+        return {graph.corridor_id(tile_x, tile_y): 1 << coin_id for tile_x, tile_y, coin_id in coins}
+
+    def add_node(self, parent, cell, move, first_move, picked_now, coins, ghosts):
+        self.parent.append(parent)
+        self.cell.append(cell)
+        self.move.append(move)
+        self.first_move.append(first_move)
+        self.picked_now.append(picked_now)
+        self.coins.append(coins)
+        self.ghosts.append(ghosts)
+
+    def intern_ghosts(self, ghosts):
+        ghost_id = self.ghost_ids.get(ghosts)
+        if ghost_id is None:
+            ghost_id = len(self.ghost_states)
+            self.ghost_ids[ghosts] = ghost_id
+            self.ghost_states.append(ghosts)
+            # ghost centers the same way as GameState.check_collision computes them
+            xs, ys = self.graph.xs, self.graph.ys
+            centers = []
+            for ghost, frames in zip(ghosts, self.ghost_frames):
+                progress = ghost & 0xFFFF
+                rest = ghost >> ArraySearch.GHOST_PROGRESS_BITS
+                cell, move = rest // 5, rest % 5
+                move_dir = DIRECTIONS[move] if move != ArraySearch.NO_MOVE else (0, 0)
+                centers.append((ys[cell] + move_dir[0] * progress / frames,
+                                xs[cell] + move_dir[1] * progress / frames))
+            self.ghost_centers.append(centers)
+        return ghost_id
+
+    def build(self, world, previous=None):
+        graph, stats = self.graph, self.level.search_stats
+        self.map_version = world.map_version
+        coin_bits = self.coin_bits = self.coin_bits_by_corridor(world.coins)
+        root_ghosts = self.intern_ghosts(self.pack_ghosts(world.ghosts))
+        self.add_node(-1, graph.corridor_id(world.pacman_x, world.pacman_y), -1, -1, 0, 0, root_ghosts)
+        self.layers.append(1)
+        # the old node every node stands for (-1 for new ones) while a previous tree is reused
+        source = previous.reusable_child(world) if previous else None
+        origin = array('i', [source]) if source is not None else None
+        for depth in range(self.depth):
+            self.check_deadline()
+            start, end = self.layers[depth], self.layers[depth + 1]
+            if origin is None:
+                to_expand = range(start, end)
+            else:  # the root is expanded again for its backtracking move, the old leaves for the new layer
+                to_expand = [node for node in range(start, end)
+                             if node == 0 or origin[node] < 0 or depth + 1 >= previous.depth]
+            ghost_ids = self.simulate_layer([(self.ghosts[node], self.cell[node]) for node in to_expand])
+            deadly_moves = self.deadly_moves([self.cell[node] for node in to_expand], ghost_ids)
+            node, index = start, 0
+            while node < end:
+                if index < len(to_expand) and to_expand[index] == node:
+                    children, pruned = self.expand(node, depth, ghost_ids[index], deadly_moves[index], coin_bits,
+                                                   origin, previous)
+                    if stats:
+                        stats.expanded(children, pruned)
+                    if not node & 0xFF:
+                        self.check_deadline()
+                    node, index = node + 1, index + 1
+                else:  # the nodes up to the next one to expand stand for a run of old nodes
+                    run_end = to_expand[index] if index < len(to_expand) else end
+                    self.copy_children(node, run_end, origin, previous)
+                    node = run_end
+                    self.check_deadline()
+            self.layers.append(len(self.cell))
+
+    # add the children of a node that aren't deadly, returns how many were added and pruned
+    def expand(self, node, depth, ghost_id, deadly, coin_bits, origin, previous):
+        cell, came_from, coins = self.cell[node], self.move[node], self.coins[node]
+        # don't allow backtracking, unless a coin was just picked
+        backtrack = ArraySearch.OPPOSITE[came_from] if came_from >= 0 and not self.picked_now[node] else -1
+        # the old children of the root, the rest of the new nodes have no old counterpart
+        old_children = {}
+        if origin is not None and node == 0:
+            old_children = {previous.move[child]: child for child in previous.children_of(origin[0])}
+        children = pruned = 0
+        for move, next_cell in enumerate(self.graph.neighbour_rows[cell]):
+            if next_cell < 0 or move == backtrack:
+                continue
+            if deadly[move]:
+                pruned += 1
+                continue
+            bit = coin_bits.get(next_cell, 0)
+            picked_now = 1 if bit and not coins & bit else 0
+            self.add_node(node, next_cell, move, move if depth == 0 else self.first_move[node],
+                          picked_now, coins | bit, ghost_id)
+            if origin is not None:
+                origin.append(old_children.get(move, -1))
+            children += 1
+        return children, pruned
+
+    # copy the children of the old nodes that nodes start...end - 1 stand for, leaving out the coin eaten since
+    # (nodes next to each other stand for old nodes next to each other, so their children are copied at once)
+    def copy_children(self, start, end, origin, previous):
+        first = bisect.bisect_left(previous.parent, origin[start], 1)
+        last = bisect.bisect_right(previous.parent, origin[end - 1], 1)
+        shift = start - origin[start]
+        parents = [parent + shift for parent in previous.parent[first:last]]
+        self.parent.extend(parents)
+        self.cell.extend(previous.cell[first:last])
+        self.move.extend(previous.move[first:last])
+        self.first_move.extend([self.first_move[parent] for parent in parents])
+        self.picked_now.extend(previous.picked_now[first:last])
+        eaten = ~previous.coin_bits.get(previous.cell[origin[0]], 0)
+        self.coins.extend([coins & eaten for coins in previous.coins[first:last]])
+        ghost_ids = {}
+        for old_ghosts in set(previous.ghosts[first:last]):
+            ghost_ids[old_ghosts] = self.intern_ghosts(previous.ghost_states[old_ghosts])
+        self.ghosts.extend([ghost_ids[old_ghosts] for old_ghosts in previous.ghosts[first:last]])
+        origin.extend(range(first, last))
+
+    # range of the children of a node (they are stored next to each other, in the order of their parents)
+    def children_of(self, node):
+        return range(bisect.bisect_left(self.parent, node, 1), bisect.bisect_right(self.parent, node, 1))
+
+    # root child of this search that a search of a world can start from, that is, pacman took its move,
+    # the coins are the same but the one eaten there and the ghosts move on the same way as predicted
+    # (a random ghost move makes a difference), None if there is no such child
+    def reusable_child(self, world):
+        if world.map_version != self.map_version or len(self.layers) < 4:
+            return None
+        cell = self.graph.corridor_id(world.pacman_x, world.pacman_y)
+        child = next((node for node in range(self.layers[1], self.layers[2]) if self.cell[node] == cell), None)
+        if child is None:
+            return None
+        coin_bits = dict(self.coin_bits)
+        coin_bits.pop(cell, None)
+        if coin_bits != self.coin_bits_by_corridor(world.coins):
+            return None
+        if [ghost.move_frames for ghost in world.ghosts] != self.ghost_frames:
+            return None
+        # the grandchildren hold the ghosts a move after the child (and without them there is nothing to reuse)
+        grandchildren = self.children_of(child)
+        if not grandchildren:
+            return None
+        predicted = self.ghost_states[self.ghosts[grandchildren[0]]]
+        if self.step_ghosts(self.packed_ghosts(world.ghosts), cell) != predicted:
+            return None
+        return child
+
+    # ghost state ids a pacman move later for the (ghost state id, pacman corridor) pairs of a layer,
+    # the ones that weren't simulated yet are stepped forward all at once
+    def simulate_layer(self, keys):
+        missing = list({key for key in keys if key not in self.simulated})
+        if len(missing) < ArraySearch.BATCH_SIZE or not self.ghost_frames:
+            for ghost_id, pacman_cell in missing:
+                self.simulate_ghosts(ghost_id, pacman_cell)
+        else:
+            self.simulate_batch(missing)
+        return [self.simulated[key] for key in keys]
+
+    # simulate_ghosts for many (ghost state id, pacman corridor) pairs with array operations,
+    # the ghosts' next moves are read from the distance table rows of the pacman corridors
+    def simulate_batch(self, keys):
+        table, neighbours = self.level.get_distance_table(), self.graph.neighbours
+        no_move, progress_bits = ArraySearch.NO_MOVE, ArraySearch.GHOST_PROGRESS_BITS
+        ghosts = np.array([self.ghost_states[ghost_id] for ghost_id, pacman_cell in keys], dtype=np.int64)
+        targets = np.repeat(np.array([pacman_cell for ghost_id, pacman_cell in keys]), ghosts.shape[1])
+        ghosts = ghosts.ravel()
+        frames = np.tile(np.array(self.ghost_frames, dtype=np.int64), len(keys))
+        progress, cell, move = ghosts & 0xFFFF, (ghosts >> progress_bits) // 5, (ghosts >> progress_bits) % 5
+        if self.level.search_stats:
+            self.level.search_stats.path_query(len(np.unique(targets)))
+        standing = move == no_move
+        move[standing] = table.next_moves(targets[standing], cell[standing])
+        progress += PACMAN_MOVE_FRAMES
+        moving = np.flatnonzero((move != no_move) & (progress >= frames))
+        while len(moving):  # move as time passes
+            cell[moving] = neighbours[cell[moving], move[moving]]
+            move[moving] = table.next_moves(targets[moving], cell[moving])
+            progress[moving] -= frames[moving]
+            moving = moving[(move[moving] != no_move) & (progress[moving] >= frames[moving])]
+        progress[move == no_move] = 0  # the ghosts standing on pacman's tile
+        packed = (((cell * 5 + move) << progress_bits) | progress).reshape(len(keys), -1)
+        for index, (key, ghosts) in enumerate(zip(keys, packed.tolist())):
+            if not index & 0xFF:
+                self.check_deadline()
+            self.simulated[key] = self.intern_ghosts(tuple(ghosts))
+
+    # which of the 4 moves from every pacman corridor of a layer run into the ghosts of the matching ghost
+    # state (walls included), GameState.check_collision for all of them at once
+    def deadly_moves(self, cells, ghost_ids):
+        if not self.ghost_frames or not cells:
+            return [[False] * 4] * len(cells)
+        if len(cells) < ArraySearch.BATCH_SIZE:
+            return [self.deadly_moves_of(cell, ghost_id) for cell, ghost_id in zip(cells, ghost_ids)]
+        if len(self.center_array) < len(self.ghost_centers):
+            self.center_array = np.array(self.ghost_centers)
+        graph = self.graph
+        targets = graph.neighbours[cells]  # (cells, 4)
+        target_y, target_x = self.cell_ys[targets], self.cell_xs[targets]
+        centers = self.center_array[ghost_ids]  # (cells, ghosts, 2)
+        squared = ((centers[:, None, :, 0] - target_y[:, :, None]) ** 2 +
+                   (centers[:, None, :, 1] - target_x[:, :, None]) ** 2)  # (cells, 4, ghosts)
+        deadly = squared < 1.44 - 1e-9
+        # right at the edge of the range, decide with the exact expression of check_collision
+        for index, move, ghost in zip(*np.nonzero(np.abs(squared - 1.44) <= 1e-9)):
+            ghost_y, ghost_x = self.ghost_centers[ghost_ids[index]][ghost]
+            py, px = int(target_y[index, move]), int(target_x[index, move])
+            deadly[index, move, ghost] = ((ghost_y-py)**2 + (ghost_x-px)**2)**0.5 < 1.2
+        return deadly.any(axis=2).tolist()
+
+    # deadly_moves for a single pacman corridor
+    def deadly_moves_of(self, cell, ghost_id):
+        xs, ys, centers = self.graph.xs, self.graph.ys, self.ghost_centers[ghost_id]
+        deadly = []
+        for next_cell in self.graph.neighbour_rows[cell]:
+            px, py = xs[next_cell], ys[next_cell]
+            # same distance test as GameState.check_collision
+            deadly.append(any(((ghost_y-py)**2 + (ghost_x-px)**2)**0.5 < 1.2 for ghost_y, ghost_x in centers))
+        return deadly
+
+    # ghost state a pacman move later, the ghosts take the first move that gets them closer to pacman
+    def simulate_ghosts(self, ghost_id, pacman_cell):
+        key = (ghost_id, pacman_cell)
+        simulated = self.simulated.get(key)
+        if simulated is not None:
+            return simulated
+        simulated = self.intern_ghosts(self.step_ghosts(self.ghost_states[ghost_id], pacman_cell))
+        self.simulated[key] = simulated
+        return simulated
+
+    # packed ghosts a pacman move later
+    def step_ghosts(self, ghosts, pacman_cell):
+        field = self.field_of(pacman_cell)
+        neighbour_rows = self.graph.neighbour_rows
+        no_move, progress_bits = ArraySearch.NO_MOVE, ArraySearch.GHOST_PROGRESS_BITS
+        packed = []
+        for ghost, frames in zip(ghosts, self.ghost_frames):
+            progress = ghost & 0xFFFF
+            rest = ghost >> progress_bits
+            cell, move = rest // 5, rest % 5
+            if move == no_move:
+                move = self.move_towards(field, cell)
+            progress += PACMAN_MOVE_FRAMES
+            while move != no_move and progress >= frames:  # move as time passes
+                cell = neighbour_rows[cell][move]
+                move = self.move_towards(field, cell)
+                progress -= frames
+            if move == no_move:  # the ghost is standing on pacman's tile
+                progress = 0
+            packed.append(((cell * 5 + move) << progress_bits) | progress)
+        return tuple(packed)
+
+    # distances to a pacman corridor as a list
+    def field_of(self, pacman_cell):
+        field = self.fields.get(pacman_cell)
+        if field is None:
+            graph = self.graph
+            field = self.level.distance_field_from(graph.xs[pacman_cell], graph.ys[pacman_cell]).tolist()
+            self.fields[pacman_cell] = field
+        return field
+
+    # first direction index (right, left, up, down) that gets closer along a distance field
+    def move_towards(self, field, cell):
+        dist = field[cell] - 1
+        for move, neighbour in enumerate(self.graph.neighbour_rows[cell]):
+            if neighbour >= 0 and field[neighbour] == dist:
+                return move
+        return ArraySearch.NO_MOVE
+
+    # first node in breadth-first order that picked a coin and still reaches depth - 1,
+    # like GameState.get_closest_coin_state with has_surviving_leaves
+    def closest_coin_node(self):
+        layers, target_depth = self.layers, self.depth - 1
+        # deepest layer below every node, filled from the leaves up (children come after parents)
+        subtree_depth = array('b', bytes(len(self.cell)))
+        for depth in range(1, len(layers) - 1):
+            for node in range(layers[depth], layers[depth + 1]):
+                subtree_depth[node] = depth
+        parent = self.parent
+        for node in range(len(self.cell) - 1, 0, -1):
+            if subtree_depth[node] > subtree_depth[parent[node]]:
+                subtree_depth[parent[node]] = subtree_depth[node]
+        coins = self.coins
+        for depth in range(1, min(target_depth, len(layers) - 2) + 1):
+            for node in range(layers[depth], layers[depth + 1]):
+                if coins[node] and subtree_depth[node] >= target_depth:
+                    return node
+        return None
+
+
+# ArraySearch without the tree: states reached by different move orders (same pacman tile, ghosts,
+# picked coins, depth and backtracking rule) are evaluated once
+# a state is summed up by the deepest layer it reaches, the shallowest coin state below it that
+# survives to depth - 1 and the number of paths to the deepest layer, which is enough to pick
+# the same move as the breadth-first search over the whole tree, random leaf included
+# the distinct states of every depth make up a layer, which is expanded at once and summed up from the bottom,
+# big layers with array operations: their ghosts are stepped forward and the collisions tested once per
+# distinct (ghost state, pacman corridor) pair and the children are merged into the states of the next layer
+# the layers are kept for the next decision, which takes over the moves of the states under the move pacman took
+class TranspositionSearch(ArraySearch):
+    LAYER_BATCH = 32  # smaller layers are expanded and summed up one state at a time
+
+    def __init__(self, level, depth=PACMAN_AI_DEPTH, deadline=None, max_entries=1 << 18):
+        super(TranspositionSearch, self).__init__(level, depth, deadline)
+        self.max_entries = max_entries
+        self.table = {}  # (corridor, ghost state id, coins, depth, forbidden move) -> summary of summarize's states
+        self.coin_sets = [0]  # coin bitmasks picked on the way, the layers refer to them by index
+        self.coin_set_ids = {0: 0}
+        self.picked = {}  # (coin set id, corridor) -> (coin set id after stepping there, whether a coin was picked)
+        self.coin_cells = None  # whether there is a coin on every corridor as a bool array
+        self.root_children = None  # (move, summary) of the root children of the last search
+        self.tree = None  # (layers, edges) of the last search, the next decision can carry them over
+        self.carried = None  # (previous search, bit of the coin eaten since) while carrying its layers over
+        self.carried_coins = {}  # coin set id of the previous search -> coin set id without the eaten coin
+        self.carried_ghosts = {}  # ghost state id of the previous search -> ghost state id
+
+    # the layers of a previous search under the root child pacman followed are carried over if the world went
+    # as predicted: their states are a move deeper there and their moves are taken over instead of expanded
+    def search(self, world, previous=None):
+        self.map_version = world.map_version
+        self.set_coins(world.coins)
+        child = previous.reusable_child(world) if isinstance(previous, TranspositionSearch) else None
+        if child is not None:
+            eaten = previous.coin_bits.get(self.graph.corridor_id(world.pacman_x, world.pacman_y), 0)
+            self.carried = (previous, eaten)
+        ghost_id = self.intern_ghosts(self.pack_ghosts(world.ghosts))
+        root = ([self.graph.corridor_id(world.pacman_x, world.pacman_y)], [ghost_id], [0], [-1])
+        try:
+            self.summarize_layer(root, 0, [child] if child is not None else None)
+        finally:
+            self.carried = None
+        return self.root_outcome(self.root_children)
+
+    # root child of the last search that a search of a world can start from, like ArraySearch.reusable_child
+    def reusable_child(self, world):
+        if self.tree is None or world.map_version != self.map_version or len(self.tree[1]) < 2:
+            return None
+        layers, edges = self.tree
+        cell = self.graph.corridor_id(world.pacman_x, world.pacman_y)
+        child = next((index for index, child_cell in enumerate(layers[1][0]) if child_cell == cell), None)
+        if child is None:
+            return None
+        coin_bits = dict(self.coin_bits)
+        coin_bits.pop(cell, None)
+        if coin_bits != self.coin_bits_by_corridor(world.coins):
+            return None
+        if [ghost.move_frames for ghost in world.ghosts] != self.ghost_frames:
+            return None
+        # the grandchildren hold the ghosts a move after the child (and without them there is nothing to reuse)
+        parents, moves, children = edges[1]
+        grandchild = next((grandchild for parent, grandchild in zip(parents, children) if parent == child), None)
+        if grandchild is None:
+            return None
+        predicted = self.ghost_states[layers[2][1][grandchild]]
+        if self.step_ghosts(self.packed_ghosts(world.ghosts), cell) != predicted:
+            return None
+        return child
+
+    # search outcome from the summaries of the root children
+    def root_outcome(self, root_children):
+        # the closest coin, ties go to the first root move like in breadth-first order
+        closest = min([summary[1] for move, summary in root_children], default=None)
+        if closest is not None and closest <= self.depth:
+            return next(move for move, summary in root_children if summary[1] == closest), []
+        return None, [(move, summary[2]) for move, summary in root_children if summary[2]]
+
+    # the (tile_x, tile_y, coin id) coins to search with
+    def set_coins(self, coins):
+        self.coin_bits = self.coin_bits_by_corridor(coins)
+        self.coin_cells = np.zeros(self.graph.size, dtype=bool)
+        self.coin_cells[list(self.coin_bits)] = True
+
+    # summaries (deepest layer, closest coin depth, leaves) of (corridor, ghost state id, coins, depth,
+    # forbidden move) states, the first max_entries of them are kept in the table for the next calls
+    def summarize(self, states):
+        summaries = {}
+        for depth in sorted({state[3] for state in states}):
+            todo = list({state for state in states if state[3] == depth and state not in self.table})
+            if not todo:
+                continue
+            cells, ghosts, coins, _, backtracks = (list(part) for part in zip(*todo))
+            layer = (cells, ghosts, [self.coin_set_id(mask) for mask in coins], backtracks)
+            for state, summary in zip(todo, zip(*self.summarize_layer(layer, depth))):
+                summaries[state] = summary
+                if len(self.table) < self.max_entries:
+                    self.table[state] = summary
+        return [summaries[state] if state in summaries else self.table[state] for state in states]
+
+    def coin_set_id(self, coins):
+        coin_set = self.coin_set_ids.get(coins)
+        if coin_set is None:
+            coin_set = self.coin_set_ids[coins] = len(self.coin_sets)
+            self.coin_sets.append(coins)
+        return coin_set
+
+    # summaries of a layer of distinct states of the same depth, layers are (corridors, ghost state ids,
+    # coin set ids, forbidden moves) and summaries (deepest layers, closest coin depths, leaves) as lists
+    # (origins are the indices of the states a layer above in the search being carried over, -1 for new ones)
+    def summarize_layer(self, layer, depth, origins=None):
+        layers = [layer]
+        edges = []  # (parent indices, moves, child indices) of the moves from every layer but the last
+        summed = None  # summaries of the deepest layer if split made them
+        state_time = None  # seconds it took to expand a state of the last big layer
+        while depth + len(edges) < self.depth:
+            self.check_deadline()
+            summed = self.split(depth + len(edges), layers[-1])
+            if summed is not None or not layers[-1][0]:
+                break
+            count = len(layers[-1][0])
+            # give up on a big layer that won't be expanded in time anyway (about as fast per state as the last one)
+            if self.deadline is not None and state_time is not None and \
+                    time.perf_counter() + state_time * count > self.deadline:
+                raise SearchTimeout()
+            start_time = time.perf_counter()
+            if origins is None:
+                next_layer, layer_edges = self.expand_layer(layers[-1])
+            else:
+                next_layer, layer_edges, origins = self.carry_layer(layers[-1], depth + len(edges), origins)
+            if count >= TranspositionSearch.LAYER_BATCH:
+                state_time = (time.perf_counter() - start_time) / count
+            layers.append(next_layer)
+            edges.append(layer_edges)
+        if depth == 0:
+            self.tree = (layers, edges)
+        bottom = depth + len(edges)
+        if summed is None:  # the leaves at the full depth (or an empty layer above it)
+            count = len(layers[-1][0])
+            summed = ([bottom] * count, [self.depth + 1] * count, [1 if bottom >= self.depth else 0] * count)
+        for layer_depth in range(bottom - 1, depth - 1, -1):
+            self.check_deadline()
+            parents, moves, children = edges[layer_depth - depth]
+            if layer_depth == 0:
+                self.root_children = [(move, (summed[0][child], summed[1][child], summed[2][child]))
+                                      for move, child in zip(moves, children)]
+            if len(parents) < TranspositionSearch.LAYER_BATCH:
+                summed = self.sum_up_states(layers[layer_depth - depth], layer_depth, parents, children, summed)
+            else:
+                summed = self.sum_up_layer(layers[layer_depth - depth], layer_depth, parents, children, summed)
+        return summed
+
+    # summaries of a layer made by other means than expanding it, None to expand it (see RootParallelSearch)
+    def split(self, depth, layer):
+        return None
+
+    # expand_layer for a layer of states with origins in the search being carried over: the moves of the states
+    # that have one are taken over from there, the others are expanded, also returns the origins of the next layer
+    # (None once there are none)
+    def carry_layer(self, layer, depth, origins):
+        previous, eaten = self.carried
+        old_layers, old_edges = previous.tree
+        if depth + 1 >= len(old_edges):  # the states of the layer weren't expanded there
+            next_layer, layer_edges = self.expand_layer(layer)
+            return next_layer, layer_edges, None
+        if depth == 0:  # the root is expanded again for its backtracking move, its children match by move
+            next_layer, layer_edges = self.expand_layer(layer)
+            old_children = {move: child for parent, move, child in zip(*old_edges[1]) if parent == origins[0]}
+            next_origins = [-1] * len(next_layer[0])
+            for move, child in zip(layer_edges[1], layer_edges[2]):
+                next_origins[child] = old_children.get(move, -1)
+            return next_layer, layer_edges, next_origins
+        if len(layer[0]) < TranspositionSearch.LAYER_BATCH:
+            return self.carry_states(layer, origins, old_layers[depth + 2], old_edges[depth + 1])
+        fresh = [index for index, origin in enumerate(origins) if origin < 0]
+        fresh_layer, (fresh_parents, fresh_moves, fresh_children) = \
+            self.expand_layer(tuple([part[index] for index in fresh] for part in layer))
+        # the moves of the carried states, their parents are sorted in the old edges
+        origins = np.array(origins)
+        carried = np.flatnonzero(origins >= 0)
+        old_parents, old_moves, old_children = (np.array(part, dtype=np.int64) for part in old_edges[depth + 1])
+        starts = np.searchsorted(old_parents, origins[carried], "left")
+        counts = np.searchsorted(old_parents, origins[carried], "right") - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        moved = np.repeat(starts, counts) + offsets
+        old_next, old_index = np.unique(old_children[moved], return_inverse=True)
+        carried_parts = []
+        for part, carry in zip(old_layers[depth + 2], (None, self.carry_ghost, self.carry_coin_set, None)):
+            values = np.array(part, dtype=np.int64)[old_next]
+            if carry is not None:  # ids of the previous search
+                ids, index = np.unique(values, return_inverse=True)
+                values = np.array(self.map_checked(carry, ids.tolist()), dtype=np.int64)[index.reshape(-1)]
+            carried_parts.append(values)
+        # merge the new children and the carried ones that reach the same state
+        states = tuple(np.concatenate((np.array(fresh_part, dtype=np.int64), carried_part))
+                       for fresh_part, carried_part in zip(fresh_layer, carried_parts))
+        cells, ghosts, coin_sets, backtracks = states
+        keys = ((ghosts * len(self.coin_sets) + coin_sets) * self.graph.size + cells) * 5 + backtracks + 1
+        _, first, merged = np.unique(keys, return_index=True, return_inverse=True)
+        merged = merged.reshape(-1)
+        next_origins = np.full(len(first), -1, dtype=np.int64)
+        np.maximum.at(next_origins, merged[len(fresh_layer[0]):], old_next)
+        parents = np.concatenate((np.array(fresh, dtype=np.int64)[np.array(fresh_parents, dtype=np.int64)],
+                                  np.repeat(carried, counts)))
+        moves = np.concatenate((np.array(fresh_moves, dtype=np.int64), old_moves[moved]))
+        children = np.concatenate((merged[np.array(fresh_children, dtype=np.int64)],
+                                   merged[len(fresh_layer[0]):][old_index.reshape(-1)]))
+        order = np.argsort(parents, kind="stable")  # by parent, then in DIRECTIONS order, like expand_layer
+        next_layer = tuple(part[first].tolist() for part in states)
+        layer_edges = (parents[order].tolist(), moves[order].tolist(), children[order].tolist())
+        return next_layer, layer_edges, next_origins.tolist() if (next_origins >= 0).any() else None
+
+    # carry_layer one state at a time
+    def carry_states(self, layer, origins, old_next, old_edges):
+        old_parents, old_moves, old_children = old_edges
+        next_layer = ([], [], [], [])
+        child_index = {}  # state of the next layer -> its index there
+        next_origins = []
+        parents, moves, children = [], [], []
+        fresh = [index for index, origin in enumerate(origins) if origin < 0]
+        fresh_layer, fresh_edges = self.expand_layer(tuple([part[index] for index in fresh] for part in layer))
+        fresh_states = list(zip(*fresh_layer))
+        for parent, move, child in zip(*fresh_edges):
+            state = fresh_states[child]
+            if state not in child_index:
+                child_index[state] = len(child_index)
+                next_origins.append(-1)
+            parents.append(fresh[parent])
+            moves.append(move)
+            children.append(child_index[state])
+        for parent, origin in enumerate(origins):
+            if origin < 0:
+                continue
+            for edge in range(bisect.bisect_left(old_parents, origin), bisect.bisect_right(old_parents, origin)):
+                old_child = old_children[edge]
+                state = (old_next[0][old_child], self.carry_ghost(old_next[1][old_child]),
+                         self.carry_coin_set(old_next[2][old_child]), old_next[3][old_child])
+                child = child_index.get(state)
+                if child is None:
+                    child = child_index[state] = len(child_index)
+                    next_origins.append(old_child)
+                else:
+                    next_origins[child] = old_child
+                parents.append(parent)
+                moves.append(old_moves[edge])
+                children.append(child)
+        for state in child_index:
+            for part, value in zip(next_layer, state):
+                part.append(value)
+        order = sorted(range(len(parents)), key=parents.__getitem__)  # by parent, then in DIRECTIONS order
+        layer_edges = ([parents[edge] for edge in order], [moves[edge] for edge in order],
+                       [children[edge] for edge in order])
+        return next_layer, layer_edges, next_origins if any(origin >= 0 for origin in next_origins) else None
+
+    # coin set id of a coin set of the search being carried over, without the coin eaten since
+    def carry_coin_set(self, coin_set):
+        carried = self.carried_coins.get(coin_set)
+        if carried is None:
+            previous, eaten = self.carried
+            carried = self.carried_coins[coin_set] = self.coin_set_id(previous.coin_sets[coin_set] & ~eaten)
+        return carried
+
+    # ghost state id of a ghost state of the search being carried over
+    def carry_ghost(self, ghost_id):
+        carried = self.carried_ghosts.get(ghost_id)
+        if carried is None:
+            carried = self.carried_ghosts[ghost_id] = self.intern_ghosts(self.carried[0].ghost_states[ghost_id])
+        return carried
+
+    # the next layer and the (parent indices, moves, child indices) of the moves into it
+    def expand_layer(self, layer):
+        if len(layer[0]) < TranspositionSearch.LAYER_BATCH:
+            return self.expand_states(layer)
+        cells, ghosts, coin_sets, backtracks = (np.array(part, dtype=np.int64) for part in layer)
+        size, stats = self.graph.size, self.level.search_stats
+        # the ghosts a move later and the deadly moves of every distinct (ghost state, pacman corridor) pair
+        pairs, pair_index = np.unique(ghosts * size + cells, return_inverse=True)
+        pair_ghosts, pair_cells = (pairs // size).tolist(), (pairs % size).tolist()
+        stepped = np.array(self.simulate_layer(list(zip(pair_ghosts, pair_cells))), dtype=np.int64)
+        deadly = np.array(self.deadly_moves(pair_cells, stepped.tolist()), dtype=bool).reshape(-1, 4)
+        targets = self.graph.neighbours[cells]  # (states, 4)
+        open_moves = (targets >= 0) & (np.arange(4) != backtracks[:, None])
+        parents, moves = np.nonzero(open_moves & ~deadly[pair_index])  # by parent, then in DIRECTIONS order
+        if stats:
+            stats.expanded(len(parents), int(open_moves.sum()) - len(parents), len(cells))
+        child_cells, child_ghosts = targets[parents, moves], stepped[pair_index[parents]]
+        child_coins, child_backtracks = coin_sets[parents], np.array(ArraySearch.OPPOSITE)[moves]
+        on_coin = np.flatnonzero(self.coin_cells[child_cells])
+        if len(on_coin):
+            pairs, pair_index = np.unique(child_coins[on_coin] * size + child_cells[on_coin], return_inverse=True)
+            picks = self.map_checked(self.pick_coin, (pairs // size).tolist(), (pairs % size).tolist())
+            child_coins[on_coin] = np.array([coin_set for coin_set, picked_now in picks])[pair_index]
+            # don't allow backtracking, unless a coin was just picked
+            picked_now = np.array([picked_now for coin_set, picked_now in picks], dtype=bool)[pair_index]
+            child_backtracks[on_coin[picked_now]] = -1
+        # merge the children that reach the same state
+        keys = ((child_ghosts * len(self.coin_sets) + child_coins) * size + child_cells) * 5 + child_backtracks + 1
+        _, first, children = np.unique(keys, return_index=True, return_inverse=True)
+        next_layer = tuple(part[first].tolist() for part in (child_cells, child_ghosts, child_coins, child_backtracks))
+        return next_layer, (parents.tolist(), moves.tolist(), children.tolist())
+
+    # expand_layer one state at a time
+    def expand_states(self, layer):
+        stats, coin_bits, neighbour_rows = self.level.search_stats, self.coin_bits, self.graph.neighbour_rows
+        xs, ys = self.graph.xs, self.graph.ys
+        next_layer = ([], [], [], [])
+        child_index = {}  # state of the next layer -> its index there
+        parents, moves, children = [], [], []
+        pruned = 0
+        for parent, (cell, ghost_id, coin_set, backtrack) in enumerate(zip(*layer)):
+            ghost_id = self.simulate_ghosts(ghost_id, cell)
+            centers = self.ghost_centers[ghost_id]
+            for move, next_cell in enumerate(neighbour_rows[cell]):
+                if next_cell < 0 or move == backtrack:
+                    continue
+                px, py = xs[next_cell], ys[next_cell]
+                # same distance test as GameState.check_collision
+                if any(((ghost_y-py)**2 + (ghost_x-px)**2)**0.5 < 1.2 for ghost_y, ghost_x in centers):
+                    pruned += 1
+                    continue
+                next_coins, next_backtrack = coin_set, ArraySearch.OPPOSITE[move]
+                if next_cell in coin_bits:
+                    next_coins, picked_now = self.pick_coin(coin_set, next_cell)
+                    if picked_now:  # don't allow backtracking, unless a coin was just picked
+                        next_backtrack = -1
+                state = (next_cell, ghost_id, next_coins, next_backtrack)
+                child = child_index.get(state)
+                if child is None:
+                    child = child_index[state] = len(child_index)
+                    for part, value in zip(next_layer, state):
+                        part.append(value)
+                parents.append(parent)
+                moves.append(move)
+                children.append(child)
+        if stats:
+            stats.expanded(len(parents), pruned, len(layer[0]))
+        return next_layer, (parents, moves, children)
+
+    # coin set id after stepping from a coin set onto a corridor with a coin and whether the coin was picked there
+    def pick_coin(self, coin_set, cell):
+        pick = self.picked.get((coin_set, cell))
+        if pick is None:
+            coins, bit = self.coin_sets[coin_set], self.coin_bits[cell]
+            pick = self.picked[(coin_set, cell)] = (self.coin_set_id(coins | bit), not coins & bit)
+        return pick
+
+    # summaries of a layer from those of the next one, the states that picked a coin and survive long enough
+    # are coin states at their depth
+    def sum_up_layer(self, layer, depth, parents, children, summed):
+        count = len(layer[0])
+        parents, children = np.array(parents), np.array(children)
+        deepest, closest = np.full(count, depth), np.full(count, self.depth + 1)
+        leaves = np.zeros(count, dtype=np.int64)
+        np.maximum.at(deepest, parents, np.array(summed[0])[children])
+        np.minimum.at(closest, parents, np.array(summed[1])[children])
+        np.add.at(leaves, parents, np.array(summed[2], dtype=np.int64)[children])
+        if depth <= self.depth - 1:
+            closest[(np.array(layer[2]) != 0) & (deepest >= self.depth - 1)] = depth
+        return deepest.tolist(), closest.tolist(), leaves.tolist()
+
+    # sum_up_layer one state at a time
+    def sum_up_states(self, layer, depth, parents, children, summed):
+        count = len(layer[0])
+        deepest, closest, leaves = [depth] * count, [self.depth + 1] * count, [0] * count
+        child_deepest, child_closest, child_leaves = summed
+        for parent, child in zip(parents, children):
+            if child_deepest[child] > deepest[parent]:
+                deepest[parent] = child_deepest[child]
+            if child_closest[child] < closest[parent]:
+                closest[parent] = child_closest[child]
+            leaves[parent] += child_leaves[child]
+        if depth <= self.depth - 1:
+            for index, coin_set in enumerate(layer[2]):
+                if coin_set and deepest[index] >= self.depth - 1:
+                    closest[index] = depth
+        return deepest, closest, leaves
+
+
+# TranspositionSearch with the bottom of the tree searched by the worker processes of the level's SearchPool:
+# the layers are expanded down to the first one (below the root) that has a couple of states for every
+# worker, those states are summarized by the workers and the layers above are summed up on top of their
+# summaries, so the outcome is the same as that of TranspositionSearch
+# (states reached in the subtrees of different workers are searched more than once)
+class RootParallelSearch(TranspositionSearch):
+    STATES_PER_WORKER = 2  # split the tree where there are at least this many states for every worker
+    MIN_DEPTH = 6  # shallower searches are over sooner than the states would get to the workers and back
+
+    def __init__(self, level, depth=PACMAN_AI_DEPTH, deadline=None, max_entries=1 << 18):
+        super(RootParallelSearch, self).__init__(level, depth, deadline, max_entries)
+        self.pool = None  # the level's search pool while a search is split between its workers
+        self.world_coins = None
+
+    def search(self, world, previous=None):
+        pool = self.level.search_pool
+        if pool is not None and pool.serves(self.level) and self.depth >= RootParallelSearch.MIN_DEPTH:
+            self.pool, self.world_coins = pool, world.coins
+        try:
+            return super(RootParallelSearch, self).search(world, previous)
+        finally:
+            self.pool = self.world_coins = None
+
+    def split(self, depth, layer):
+        if self.pool is None or depth == 0 or \
+                (len(layer[0]) < self.pool.workers * RootParallelSearch.STATES_PER_WORKER and depth + 1 < self.depth):
+            return None
+        tasks = [(cell, self.ghost_states[ghost_id], self.coin_sets[coin_set], depth, backtrack)
+                 for cell, ghost_id, coin_set, backtrack in zip(*layer)]
+        summaries = self.pool.summarize(tasks, self.world_coins, self.ghost_frames, self.depth, self.deadline)
+        return tuple(list(values) for values in zip(*summaries))
+
+
+# worker processes of a SearchPool, initialized with a level rebuilt from the tile map (its corridor graph
+# and distance table included) and the search of the last task, kept for as long as the tasks are about
+# the same coins, ghost speeds and depth since its table stays valid for them
+search_worker = {}
+
+
+def init_search_worker(tile_map):
+    level = Level(tile_map.shape[1], tile_map.shape[0], ghosts_n_coins=False, tile_map=tile_map)
+    level.search_stats = SearchStats()
+    search_worker["level"] = level
+
+
+# TranspositionSearch summaries of (pacman corridor, packed ghosts, coins, depth, forbidden move) states,
+# along with the SearchStats counters of the work
+def summarize_states(states, coins, ghost_frames, depth, deadline):
+    level = search_worker["level"]
+    key = (tuple(coins), tuple(ghost_frames), depth)
+    search = search_worker.get("search")
+    if search is None or search_worker["key"] != key:
+        search = TranspositionSearch(level, depth)
+        search.set_coins(coins)
+        search.ghost_frames = list(ghost_frames)
+        search_worker["search"], search_worker["key"] = search, key
+    search.deadline = deadline
+    stats = level.search_stats
+    stats.begin("pacman")
+    try:
+        summaries = search.summarize([(cell, search.intern_ghosts(ghosts), picked, state_depth, backtrack)
+                                      for cell, ghosts, picked, state_depth, backtrack in states])
+    finally:
+        stats.end()
+    return summaries, stats.last["pacman"]
+
+
+# persistent worker processes for RootParallelSearch on one level, they hold the level's tile map and tables
+# from the start, so a decision only sends them the states to search (shut it down once the level is over)
+class SearchPool:
+    def __init__(self, level, workers=None):
+        self.level = level
+        self.map_version = level.map_version
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.workers, initializer=init_search_worker,
+                                            initargs=(level.tile_map,))
+
+    # whether the workers hold the tile map of a level
+    def serves(self, level):
+        return level is self.level and level.map_version == self.map_version
+
+    # summaries of the states, a state per task for the workers to balance the load
+    # (the deadline is a time.perf_counter value, which every process reads from the same clock)
+    def summarize(self, states, coins, ghost_frames, depth, deadline):
+        futures = [self.executor.submit(summarize_states, [state], coins, ghost_frames, depth, deadline)
+                   for state in states]
+        try:
+            results = [future.result() for future in futures]
+        except SearchTimeout:
+            for future in futures:
+                future.cancel()
+            raise
+        summaries = []
+        for task_summaries, counters in results:
+            summaries.extend(task_summaries)
+            if self.level.search_stats:
+                self.level.search_stats.add(counters)
+        return summaries
+
+    # (without waiting for the workers to exit, unless the game is about to exit too)
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# pacman against the ghosts, scored while searching instead of building the whole tree first:
+# a state is worth the coins picked from there on (sooner is worth more) or being caught (later is less bad),
+# plus, at the last depth, how far away the ghosts and the closest coin are
+# pacman makes his move while the ghosts step forward, and every ghost that reaches a tile either chases
+# pacman or, by its random_move_chance, takes any open move; the worst outcome counts (only those at least
+# MIN_PROBABILITY likely along the way are looked at, besides all of the ghosts chasing pacman)
+# moves that can't beat the best move found so far are cut off (alpha-beta, bounded by the coins
+# that could still be picked), states reached again by other move orders are looked up like in
+# TranspositionSearch and the best moves of the previous search are tried first
+class AlphaBetaSearch(ArraySearch):
+    COIN_SCORE = 100  # a coin picked at depth d is worth COIN_SCORE - d
+    DEATH_SCORE = -10000  # being caught at depth d is worth DEATH_SCORE + d
+    GHOST_DISTANCE_CAP = 8  # ghosts further away than this don't make a state any better
+    COIN_DISTANCE_CAP = 50  # neither does being further away than this from the closest coin
+    MIN_PROBABILITY = 0.01
+    EXACT, UPPER, LOWER = 0, -1, 1  # what a value in the table is for the state
+
+    def __init__(self, level, depth=PACMAN_AI_DEPTH, deadline=None, max_entries=1 << 18):
+        super(AlphaBetaSearch, self).__init__(level, depth, deadline)
+        self.max_entries = max_entries
+        self.table = {}  # (corridor, ghost state id, coins, depth, forbidden move, likelihood) -> (move, value, bound)
+        self.best_moves = {}  # (pacman corridor, packed ghosts) -> direction index of the best move
+        self.outcomes = {}  # (ghost state id, pacman corridor) -> [(ghost state id, probability)], the chase first
+        self.ghost_chances = []  # random_move_chance of every ghost
+        self.max_chance = 0.0
+        self.coin_field = []  # distances to the closest coin by corridor id
+        self.bonus = []  # the most the coins picked after each depth can be worth
+
+    # the outcome like ArraySearch.search: the direction index of the best move (None if pacman can't move)
+    # and no leaves to draw from, the best moves of a previous search are shared to order the moves by
+    def search(self, world, previous=None):
+        if isinstance(previous, AlphaBetaSearch):  # a copy, a speculation may still be using the previous one
+            self.best_moves = dict(previous.best_moves)
+        if len(self.best_moves) > self.max_entries:
+            self.best_moves.clear()
+        self.coin_bits = self.coin_bits_by_corridor(world.coins)
+        self.ghost_chances = [ghost.random_move_chance for ghost in world.ghosts]
+        self.max_chance = max(self.ghost_chances, default=0.0)
+        ghost_id = self.intern_ghosts(self.pack_ghosts(world.ghosts))
+        self.coin_field = self.level.distance_field_from_many([(x, y) for x, y, coin_id in world.coins])
+        for depth in range(self.depth + 1):
+            last = min(self.depth, depth + len(world.coins))
+            self.bonus.append(sum(AlphaBetaSearch.COIN_SCORE - later for later in range(depth + 1, last + 1)))
+        cell = self.graph.corridor_id(world.pacman_x, world.pacman_y)
+        move, value = self.best_move(cell, ghost_id, 0, 0, -1, 1.0, float("-inf"), float("inf"))
+        return move, []
+
+    # pacman's best move from a state reached with some likelihood of the ghost outcomes, and its value
+    # (a value at most alpha only means that the state isn't better than alpha, one at least beta isn't worse)
+    def best_move(self, cell, ghost_id, coins, depth, backtrack, likelihood, alpha, beta):
+        self.check_deadline()
+        if depth >= self.depth:
+            return None, self.leaf_value(cell, ghost_id)
+        if likelihood * self.max_chance < AlphaBetaSearch.MIN_PROBABILITY:
+            likelihood = 0.0  # the ghosts only chase from here on, however unlikely the state is
+        key = (cell, ghost_id, coins, depth, backtrack, likelihood)
+        entry = self.table.get(key)
+        if entry is not None:
+            move, value, bound = entry
+            if (bound == AlphaBetaSearch.EXACT or bound == AlphaBetaSearch.LOWER and value >= beta or
+                    bound == AlphaBetaSearch.UPPER and value <= alpha):
+                return move, value
+        outcomes = self.likely_outcomes(ghost_id, cell, likelihood)
+        neighbours, coin_bits = self.graph.neighbour_rows[cell], self.coin_bits
+        # don't allow backtracking, unless a coin was just picked or there is no other way
+        moves = [move for move, next_cell in enumerate(neighbours) if next_cell >= 0 and move != backtrack]
+        if not moves:
+            if backtrack < 0 or neighbours[backtrack] < 0:  # walled in
+                return None, self.leaf_value(cell, ghost_id)
+            moves = [backtrack]
+        order_key = (cell, self.ghost_states[ghost_id])
+        preferred = entry[0] if entry is not None else self.best_moves.get(order_key)
+        moves.sort(key=lambda move: (move != preferred, neighbours[move] not in coin_bits))
+        best, best_value = None, alpha
+        children = pruned = 0
+        for move in moves:
+            next_cell = neighbours[move]
+            bit = coin_bits.get(next_cell, 0)
+            picked = bit and not coins & bit
+            gain = AlphaBetaSearch.COIN_SCORE - (depth + 1) if picked else 0
+            if gain + self.bonus[depth + 1] + AlphaBetaSearch.GHOST_DISTANCE_CAP <= best_value:
+                pruned += 1  # can't get any better than the best move so far
+                continue
+            children += 1
+            value = gain + self.outcome_value(next_cell, outcomes, coins | bit, depth + 1,
+                                              -1 if picked else ArraySearch.OPPOSITE[move],
+                                              best_value - gain, beta - gain)
+            if value > best_value:
+                best, best_value = move, value
+                if best_value >= beta:
+                    break
+        if self.level.search_stats:
+            self.level.search_stats.expanded(children, pruned)
+        if best is not None:
+            self.best_moves[order_key] = best
+        if len(self.table) < self.max_entries:
+            bound = AlphaBetaSearch.UPPER if best is None else AlphaBetaSearch.LOWER if best_value >= beta else \
+                AlphaBetaSearch.EXACT
+            self.table[key] = (best, best_value, bound)
+        return best, best_value
+
+    # value of pacman arriving at a corridor in every likely ghost outcome: the worst of them
+    def outcome_value(self, cell, outcomes, coins, depth, backtrack, alpha, beta):
+        value = float("inf")
+        for ghost_id, probability, likelihood in outcomes:
+            if self.caught(cell, ghost_id):
+                outcome = AlphaBetaSearch.DEATH_SCORE + depth
+            else:
+                outcome = self.best_move(cell, ghost_id, coins, depth, backtrack, likelihood,
+                                         alpha, min(beta, value))[1]
+            value = min(value, outcome)
+            if value <= alpha:
+                break
+        return value
+
+    # whether pacman on a corridor is in range of the ghosts, the same distance test as GameState.check_collision
+    def caught(self, cell, ghost_id):
+        px, py = self.graph.xs[cell], self.graph.ys[cell]
+        return any(((ghost_y-py)**2 + (ghost_x-px)**2)**0.5 < 1.2 for ghost_y, ghost_x in self.ghost_centers[ghost_id])
+
+    # how good a state at the last depth is apart from the coins picked: ghosts far away, a coin close by
+    def leaf_value(self, cell, ghost_id):
+        field, progress_bits = self.field_of(cell), ArraySearch.GHOST_PROGRESS_BITS
+        ghost_distance = min([field[(ghost >> progress_bits) // 5] for ghost in self.ghost_states[ghost_id]] +
+                             [AlphaBetaSearch.GHOST_DISTANCE_CAP])
+        coin_distance = self.coin_field[cell]
+        if coin_distance < 0:  # no coin can be reached
+            coin_distance = AlphaBetaSearch.COIN_DISTANCE_CAP
+        return ghost_distance - min(coin_distance, AlphaBetaSearch.COIN_DISTANCE_CAP)
+
+    # ghost outcomes a pacman move later that are likely enough, as (ghost state id, probability, likelihood),
+    # the probability of the ones left out is added to the chase
+    def likely_outcomes(self, ghost_id, pacman_cell, likelihood):
+        if likelihood * max(self.ghost_chances, default=0.0) < AlphaBetaSearch.MIN_PROBABILITY:
+            # any other outcome takes at least one random move
+            return [(self.simulate_ghosts(ghost_id, pacman_cell), 1.0, likelihood)]
+        outcomes = self.ghost_outcomes(ghost_id, pacman_cell)
+        likely = [(ghost_id, probability, likelihood * probability) for ghost_id, probability in outcomes[1:]
+                  if likelihood * probability >= AlphaBetaSearch.MIN_PROBABILITY]
+        probability = 1.0 - sum(outcome[1] for outcome in likely)
+        return [(outcomes[0][0], probability, likelihood * probability)] + likely
+
+    # the ghost states a pacman move later that are at least MIN_PROBABILITY likely with their probabilities,
+    # all of the ghosts chasing pacman first (whatever its probability) and the rest likeliest first
+    def ghost_outcomes(self, ghost_id, pacman_cell):
+        key = (ghost_id, pacman_cell)
+        outcomes = self.outcomes.get(key)
+        if outcomes is not None:
+            return outcomes
+        field = self.field_of(pacman_cell)
+        joint = {(): 1.0}
+        for ghost, frames, chance in zip(self.ghost_states[ghost_id], self.ghost_frames, self.ghost_chances):
+            steps = self.ghost_steps(ghost, frames, chance, field)
+            combined = {}
+            for ghosts, probability in joint.items():
+                for step, step_probability in steps:
+                    combined_ghosts = ghosts + (step,)
+                    combined[combined_ghosts] = combined.get(combined_ghosts, 0.0) + probability * step_probability
+            # outcomes that are too unlikely never get looked at
+            joint = {ghosts: probability for ghosts, probability in combined.items()
+                     if probability >= AlphaBetaSearch.MIN_PROBABILITY}
+        chase = self.simulate_ghosts(ghost_id, pacman_cell)
+        chase_probability, others = 0.0, []
+        for ghosts, probability in joint.items():
+            outcome = self.intern_ghosts(ghosts)
+            if outcome == chase:
+                chase_probability = probability
+            else:
+                others.append((outcome, probability))
+        others.sort(key=lambda outcome: -outcome[1])
+        outcomes = [(chase, chase_probability)] + others
+        self.outcomes[key] = outcomes
+        return outcomes
+
+    # the packed states a ghost can be in a pacman move later with their probabilities,
+    # ArraySearch.step_ghosts with every choice of a move branching out
+    def ghost_steps(self, ghost, frames, chance, field):
+        progress = ghost & 0xFFFF
+        rest = ghost >> ArraySearch.GHOST_PROGRESS_BITS
+        cell, move = rest // 5, rest % 5
+        if move == ArraySearch.NO_MOVE:
+            branches = self.ghost_choices(field, cell, chance)
+        else:
+            branches = [(move, 1.0)]
+        steps = {}
+        for move, probability in branches:
+            self.advance_ghost(cell, move, progress + PACMAN_MOVE_FRAMES, probability, frames, chance, field, steps)
+        return list(steps.items())
+
+    # move a ghost on as time passes, adding up the probabilities of where it ends up in steps
+    def advance_ghost(self, cell, move, progress, probability, frames, chance, field, steps):
+        if move != ArraySearch.NO_MOVE and progress >= frames:
+            cell = self.graph.neighbour_rows[cell][move]
+            for next_move, move_probability in self.ghost_choices(field, cell, chance):
+                self.advance_ghost(cell, next_move, progress - frames, probability * move_probability,
+                                   frames, chance, field, steps)
+            return
+        if move == ArraySearch.NO_MOVE:  # the ghost is standing on pacman's tile
+            progress = 0
+        packed = ((cell * 5 + move) << ArraySearch.GHOST_PROGRESS_BITS) | progress
+        steps[packed] = steps.get(packed, 0.0) + probability
+
+    # moves a ghost on a corridor can pick with their probabilities, like Ghost.pick_move: the chase first,
+    # every open move gets a share of the random move chance
+    def ghost_choices(self, field, cell, chance):
+        choices = {self.move_towards(field, cell): 1.0 - chance}
+        if chance:
+            moves = [move for move, neighbour in enumerate(self.graph.neighbour_rows[cell]) if neighbour >= 0]
+            for move in moves:
+                choices[move] = choices.get(move, 0.0) + chance / len(moves)
+        return [(move, probability) for move, probability in choices.items() if probability > 0.0]
+
+
+# AlphaBetaSearch that weighs the ghost outcomes by how likely they are instead of taking the worst one,
+# an outcome is cut off once even the best it could be worth can't lift the average above alpha
+class ExpectimaxSearch(AlphaBetaSearch):
+    def outcome_value(self, cell, outcomes, coins, depth, backtrack, alpha, beta):
+        if len(outcomes) == 1:  # nothing to average
+            return super(ExpectimaxSearch, self).outcome_value(cell, outcomes, coins, depth, backtrack, alpha, beta)
+        most = self.bonus[depth] + AlphaBetaSearch.GHOST_DISTANCE_CAP  # the most any outcome can be worth
+        value, rest = 0.0, 1.0
+        for ghost_id, probability, likelihood in outcomes:
+            if probability <= 0.0:  # the chase can be all but impossible
+                continue
+            rest -= probability
+            if self.caught(cell, ghost_id):
+                outcome = AlphaBetaSearch.DEATH_SCORE + depth
+            else:  # the least the outcome has to be worth for the average to get above alpha
+                outcome = self.best_move(cell, ghost_id, coins, depth, backtrack, likelihood,
+                                         (alpha - value - rest * most) / probability, float("inf"))[1]
+            value += probability * outcome
+            if value + rest * most <= alpha:
+                return alpha
+        return value
+
+
+# Monte Carlo tree search over pacman's moves: every iteration walks down the tree of move sequences
+# picking moves by UCT, adds a node for the first move not tried yet and plays on with a cheap rollout
+# (towards the closest coin, away from moves that get pacman caught) up to depth moves ahead
+# the ghosts move like Ghost.pick_move, chasing pacman or moving randomly by their random_move_chance,
+# drawn anew every iteration, so a node sums up all the ways the ghosts may react to its move sequence
+# moves are scored like in AlphaBetaSearch; the search stops after a number of iterations or at a deadline
+# and the statistics under the move pacman takes carry over to the next decision
+class MonteCarloSearch(AlphaBetaSearch):
+    EXPLORATION = 100.0  # weight of the UCT exploration term, about a coin
+    ROLLOUT_RANDOMNESS = 0.2  # chance of a random rollout move instead of one towards the closest coin
+
+    def __init__(self, level, depth=PACMAN_MAX_AI_DEPTH, deadline=None, iterations=MCTS_ITERATIONS):
+        super(MonteCarloSearch, self).__init__(level, depth, deadline)
+        self.iterations = iterations  # None to search until the deadline
+        self.node_move = []  # direction index of the move into the node (-1 for the root)
+        self.node_cell = []  # corridor id of pacman's tile after the move
+        self.node_children = []  # node index of the child for every direction index, -1 if not added yet
+        self.visits = []
+        self.total = []  # sum of the scores from the move into the node on
+        self.tree_depth = 0  # how deep the tree got
+        # (ghost state id, pacman corridor) -> [(packed ghost, probability)] for every ghost,
+        # or the ghost state id a move later if there is nothing to draw
+        self.steps = {}
+        self.legal = {}  # (corridor, forbidden move) -> legal_moves
+        self.rng = random.Random()
+
+    # the outcome like ArraySearch.search: the direction index of the most visited root move
+    # (None if pacman can't move) and no leaves to draw from
+    def search(self, world, previous=None):
+        self.map_version = world.map_version
+        self.rng.seed(repr(world.key()))  # the same world always gets the same draws
+        self.coin_bits = self.coin_bits_by_corridor(world.coins)
+        self.ghost_chances = [ghost.random_move_chance for ghost in world.ghosts]
+        self.max_chance = max(self.ghost_chances, default=0.0)
+        root_ghosts = self.intern_ghosts(self.pack_ghosts(world.ghosts))
+        self.coin_field = self.level.distance_field_from_many([(x, y) for x, y, coin_id in world.coins])
+        cell = self.graph.corridor_id(world.pacman_x, world.pacman_y)
+        self.add_tree_node(-1, cell)
+        if isinstance(previous, MonteCarloSearch) and previous.map_version == world.map_version:
+            self.reuse(previous, cell)
+        iteration = 0
+        while self.iterations is None or iteration < self.iterations:
+            if self.stop is not None and self.stop.is_set():
+                raise SearchTimeout()
+            self.iterate(cell, root_ghosts)
+            iteration += 1
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                break
+        children = [child for child in self.node_children[0] if child >= 0]
+        if not children:
+            return None, []
+        return self.node_move[max(children, key=lambda child: self.visits[child])], []
+
+    def add_tree_node(self, move, cell):
+        self.node_move.append(move)
+        self.node_cell.append(cell)
+        self.node_children.append([-1] * 4)
+        self.visits.append(0)
+        self.total.append(0.0)
+        return len(self.node_move) - 1
+
+    # one iteration: select down the tree, add a node, roll out and add the scores up the path
+    def iterate(self, cell, ghost_id):
+        neighbour_rows, coin_bits = self.graph.neighbour_rows, self.coin_bits
+        node, backtrack, coins, depth = 0, -1, 0, 0
+        path, rewards = [0], []
+        ending = None  # score of the end of the iteration
+        while depth < self.depth:
+            moves = self.legal_moves(cell, backtrack)
+            if not moves:
+                break
+            children = self.node_children[node]
+            untried = [move for move in moves if children[move] < 0]
+            if untried:
+                move = untried[0]
+                children[move] = self.add_tree_node(move, neighbour_rows[cell][move])
+                if self.level.search_stats:
+                    self.level.search_stats.expanded(1, 0)
+            else:
+                move = self.select(node, moves)
+            node = children[move]
+            path.append(node)
+            ghost_id = self.sample_ghosts(ghost_id, cell)
+            cell, depth = neighbour_rows[cell][move], depth + 1
+            if self.caught(cell, ghost_id):
+                rewards.append(AlphaBetaSearch.DEATH_SCORE + depth)
+                ending = 0
+                break
+            bit = coin_bits.get(cell, 0)
+            picked = bit and not coins & bit
+            rewards.append(AlphaBetaSearch.COIN_SCORE - depth if picked else 0)
+            coins, backtrack = coins | bit, -1 if picked else ArraySearch.OPPOSITE[move]
+            if untried:
+                break
+        self.tree_depth = max(self.tree_depth, depth)
+        if ending is None:
+            ending = self.rollout(cell, ghost_id, coins, depth, backtrack)
+        # every node gets the scores from its own move on
+        score = ending
+        for node, reward in zip(reversed(path[1:]), reversed(rewards)):
+            score += reward
+            self.visits[node] += 1
+            self.total[node] += score
+        self.visits[0] += 1
+        self.total[0] += score
+
+    # the child with the best upper confidence bound
+    def select(self, node, moves):
+        if len(moves) == 1:
+            return moves[0]
+        log_visits = math.log(self.visits[node])
+        best, best_bound = None, float("-inf")
+        for move in moves:
+            child = self.node_children[node][move]
+            visits = self.visits[child]
+            bound = self.total[child] / visits + MonteCarloSearch.EXPLORATION * math.sqrt(log_visits / visits)
+            if bound > best_bound:
+                best, best_bound = move, bound
+        return best
+
+    # play on from a state until depth moves ahead, returns the score picked up on the way
+    def rollout(self, cell, ghost_id, coins, depth, backtrack):
+        rng, neighbour_rows, coin_bits = self.rng, self.graph.neighbour_rows, self.coin_bits
+        score = 0
+        while depth < self.depth:
+            moves = self.legal_moves(cell, backtrack)
+            if not moves:
+                break
+            ghost_id = self.sample_ghosts(ghost_id, cell)
+            depth += 1
+            safe = [move for move in moves if not self.caught(neighbour_rows[cell][move], ghost_id)]
+            if not safe:
+                return score + AlphaBetaSearch.DEATH_SCORE + depth
+            if rng.random() < MonteCarloSearch.ROLLOUT_RANDOMNESS:
+                move = rng.choice(safe)
+            else:
+                move = min(safe, key=lambda move: self.coin_distance(neighbour_rows[cell][move]))
+            cell = neighbour_rows[cell][move]
+            bit = coin_bits.get(cell, 0)
+            picked = bit and not coins & bit
+            if picked:
+                score += AlphaBetaSearch.COIN_SCORE - depth
+            coins, backtrack = coins | bit, -1 if picked else ArraySearch.OPPOSITE[move]
+        return score + self.leaf_value(cell, ghost_id)
+
+    # distance from a corridor to the closest coin, no coin in reach counts as far away
+    def coin_distance(self, cell):
+        distance = self.coin_field[cell]
+        return distance if distance >= 0 else len(self.coin_field)
+
+    # directions pacman can move in: no backtracking, unless a coin was just picked or there is no other way
+    def legal_moves(self, cell, backtrack):
+        moves = self.legal.get((cell, backtrack))
+        if moves is None:
+            neighbours = self.graph.neighbour_rows[cell]
+            moves = [move for move, next_cell in enumerate(neighbours) if next_cell >= 0 and move != backtrack]
+            if not moves and backtrack >= 0 and neighbours[backtrack] >= 0:
+                moves = [backtrack]
+            self.legal[(cell, backtrack)] = moves
+        return moves
+
+    # a ghost state a pacman move later, every ghost that reaches a tile draws its next move like Ghost.pick_move
+    def sample_ghosts(self, ghost_id, pacman_cell):
+        key = (ghost_id, pacman_cell)
+        steps = self.steps.get(key)
+        if steps is None:
+            if not self.max_chance:  # the ghosts only chase
+                steps = self.simulate_ghosts(ghost_id, pacman_cell)
+            else:
+                field = self.field_of(pacman_cell)
+                steps = [self.ghost_steps(ghost, frames, chance, field) for ghost, frames, chance
+                         in zip(self.ghost_states[ghost_id], self.ghost_frames, self.ghost_chances)]
+                if all(len(ghost_steps) == 1 for ghost_steps in steps):  # no ghost reaches a tile
+                    steps = self.intern_ghosts(tuple(ghost_steps[0][0] for ghost_steps in steps))
+            self.steps[key] = steps
+        if isinstance(steps, int):
+            return steps
+        packed = []
+        for ghost_steps in steps:
+            draw = self.rng.random()
+            for step, probability in ghost_steps:
+                draw -= probability
+                if draw < 0:
+                    break
+            packed.append(step)
+        return self.intern_ghosts(tuple(packed))
+
+    # take over the statistics under the root move to a corridor from a previous search,
+    # False if it has no such move
+    def reuse(self, previous, cell):
+        start = next((child for child in previous.node_children[0]
+                      if child >= 0 and previous.node_cell[child] == cell), None)
+        if start is None:
+            return False
+        self.visits[0], self.total[0] = previous.visits[start], previous.total[start]
+        queue, new_nodes = [start], {start: 0}
+        for old_node in queue:  # breadth-first, the queue grows while it is walked
+            for move, child in enumerate(previous.node_children[old_node]):
+                if child >= 0:
+                    new_child = self.add_tree_node(move, previous.node_cell[child])
+                    self.visits[new_child], self.total[new_child] = previous.visits[child], previous.total[child]
+                    self.node_children[new_nodes[old_node]][move] = new_child
+                    new_nodes[child] = new_child
+                    queue.append(child)
+        return True
 
 
 class Ghost(Character):
     def __init__(self, tile_x, tile_y, move_frames, random_move_chance):
         # Call the parent's constructor
-        super(Ghost, self).__init__(tile_x, tile_y)
-        # load image
-        self.spooky_image = pygame.image.load("Assets/Images/spooky.png").convert_alpha()
-        self.image = self.spooky_image
-        self.rect = self.image.get_rect()
-        self.rect.left = tile_x * TILE_SIZE
-        self.rect.top = tile_y * TILE_SIZE
+        super(Ghost, self).__init__(tile_x, tile_y, GHOST_SIZE)
         self.sprite_offset_x = 5
         # movement
         self.move_frames = move_frames  # how many frames it takes to move one cell
         self.random_move_chance = random_move_chance  # chance of moving randomly
+        self.speculation = None  # (situation, future of the chase move) while planning ahead
 
     def update(self, level, pacman):
+        starting = not self.curr_move and bool(self.planned_moves)
         self.move()
-        if self.curr_move:  # flip sprite towards movement
-            self.flip_towards_direction(self.curr_move)
+        if starting and level.executor:
+            self.plan_ahead(level, pacman)
         # check for collision with pacman
-        px, py = pacman.rect.centerx, pacman.rect.centery
-        gx, gy = self.rect.centerx, self.rect.centery
+        px, py = pacman.center()
+        gx, gy = self.center()
         pacman_dist = ((px-gx)**2 + (py-gy)**2) ** 0.5
         if pacman_dist < TILE_SIZE * 0.9:  # pacman in range
             pacman.die()  # murder pacman
@@ -681,13 +2416,8 @@ class Ghost(Character):
             if picked_move:
                 self.planned_moves = [picked_move]  # take only the first move
 
-    # make the ghost face the direction of movement
-    def flip_towards_direction(self, direction):
-        if direction == (0, 1) or direction == (0, -1):  # update image when moving sideways
-            self.image = pygame.transform.flip(self.spooky_image, direction == (0, 1), 0)
-
     def pick_move(self, level, pacman):
-        if np.random.random_sample() < self.random_move_chance:
+        if level.random.random() < self.random_move_chance:
             # pick random move
             directions = [(0, 1), (0, -1), (-1, 0), (1, 0)]
             possible_moves = []
@@ -696,7 +2426,7 @@ class Ghost(Character):
                 target_x = self.curr_tile_x + direction[1]
                 if level.tile_map[target_y, target_x] == 0:
                     possible_moves.append(direction)
-            return random.choice(possible_moves)
+            return level.random.choice(possible_moves)
         else:  # pursue pacman
             pacman_x, pacman_y = pacman.curr_tile_x, pacman.curr_tile_y
             #moves_to_pacman = level.find_shortest_path(self.curr_tile_x, self.curr_tile_y,
@@ -706,74 +2436,101 @@ class Ghost(Character):
             return self.choose_best_move(level, pacman)
 
     def choose_best_move(self, level, pacman):
-        # fetch current game state
-        dist_to_pacman = level.shortest_path_length(pacman.curr_tile_x, pacman.curr_tile_y,
-                                                    self.curr_tile_x, self.curr_tile_y)
-        curr_state = GhostGameState(dist_to_pacman, None, pacman.curr_tile_x, pacman.curr_tile_y,
-                                    self.curr_tile_x, self.curr_tile_y, 0)
-        return curr_state.get_best_move(level)
+        if level.search_stats:
+            level.search_stats.begin("ghost")
+        move = self.speculative_move(level, pacman)
+        if move is False:
+            move = Ghost.chase(level, pacman.curr_tile_x, pacman.curr_tile_y, self.curr_tile_x, self.curr_tile_y)
+        if level.search_stats:
+            level.search_stats.end()
+        return move
+
+    # first move of the ghost's search towards pacman (safe to run on another thread)
+    @staticmethod
+    def chase(level, pacman_x, pacman_y, ghost_x, ghost_y):
+        field = level.chase_field(pacman_x, pacman_y)
+        dist_to_pacman = field[level.get_corridor_graph().corridor_id(ghost_x, ghost_y)]
+        curr_state = GhostGameState(dist_to_pacman, None, ghost_x, ghost_y, 0)
+        return curr_state.get_best_move(level, field)
+
+    # start searching on the level's executor as soon as a move starts, from the tile the ghost moves to
+    # towards the tile pacman is expected to be on by then (whether to chase is still drawn later)
+    def plan_ahead(self, level, pacman):
+        frames = self.move_frames - self.move_frame  # updates until the move is over
+        pacman_x, pacman_y = pacman.curr_tile_x, pacman.curr_tile_y
+        if pacman.curr_move and pacman.move_frames - pacman.move_frame < frames:
+            pacman_x, pacman_y = pacman_x + pacman.curr_move[1], pacman_y + pacman.curr_move[0]
+        ghost_x, ghost_y = self.curr_tile_x + self.curr_move[1], self.curr_tile_y + self.curr_move[0]
+        key = (pacman_x, pacman_y, ghost_x, ghost_y, level.map_version)
+        self.speculation = (key, level.executor.submit(Ghost.chase, level, *key[:4]))
+
+    # move found by the search started in plan_ahead, False if it didn't search the same situation
+    def speculative_move(self, level, pacman):
+        if self.speculation is None:
+            return False
+        key, future = self.speculation
+        self.speculation = None
+        if key != (pacman.curr_tile_x, pacman.curr_tile_y, self.curr_tile_x, self.curr_tile_y, level.map_version):
+            future.cancel()
+            return False
+        return future.result()
+
+    # where the ghost will be after some frames of chasing pacman standing on (pacman_x, pacman_y),
+    # following Character.move and update (random moves can't be foreseen)
+    def predict_position(self, level, pacman_x, pacman_y, frames):
+        tile_x, tile_y, move, move_frame = self.curr_tile_x, self.curr_tile_y, self.curr_move, self.move_frame
+        planned = self.planned_moves[0] if self.planned_moves else None
+        for _ in range(frames):
+            if not move and planned:
+                move, planned, move_frame = planned, None, 0
+            if move:
+                move_frame += 1
+                if move_frame >= self.move_frames:  # finish move
+                    tile_x, tile_y, move = tile_x + move[1], tile_y + move[0], None
+            if not move and not planned:
+                planned = level.next_move_in_field(level.chase_field(pacman_x, pacman_y), tile_x, tile_y)
+        ghost = GhostPosition()
+        ghost.tile_x, ghost.tile_y, ghost.move_dir = tile_x, tile_y, move
+        ghost.move_progress, ghost.move_frames = move_frame, self.move_frames
+        ghost.random_move_chance = self.random_move_chance
+        return ghost
 
 
-class Coin(pygame.sprite.Sprite):
-    def __init__(self, tile_x, tile_y):
-        # Call the parent's constructor
-        pygame.sprite.Sprite.__init__(self)
-        # load image
-        path = "Assets/Images/coin"
-        self.images = []
-        for file_name in os.listdir(path):
-            image = pygame.image.load(path + os.sep + file_name).convert_alpha()
-            self.images.append(image)
-        # set up animation
-        self.index = random.randint(0, len(self.images)-1)  # random animation index
-        self.image = self.images[self.index]
-        self.animation_frames = 6  # how many frames each image in the animation will last
-        self.current_frame = 0
-        # place in the center of a tile
+class Coin:
+    def __init__(self, tile_x, tile_y, coin_id=0):
         self.tile_x, self.tile_y = tile_x, tile_y
-        self.rect = self.image.get_rect()
-        self.rect.left = tile_x * TILE_SIZE + TILE_SIZE // 2 - 6
-        self.rect.top = tile_y * TILE_SIZE + TILE_SIZE // 2 - 8
-
-    def update(self):
-        self.current_frame += 1
-        if self.current_frame >= self.animation_frames:  # update animation every few frames
-            self.current_frame = 0
-            self.index = (self.index + 1) % len(self.images)
-            self.image = self.images[self.index]
+        self.coin_id = coin_id  # index in the level's coin index
 
 
+# a ghost's chase along the distance field from pacman's tile: every state moves in the first direction
+# (right, left, up, down) that gets closer to pacman, the path the full search tree of improving moves
+# would put first, down to GHOST_AI_DEPTH moves
 class GhostGameState:
-    def __init__(self, dist_to_pacman, parent, pacman_x, pacman_y,
-                 ghost_x, ghost_y, depth=0, move_here=None):
+    def __init__(self, dist_to_pacman, parent, ghost_x, ghost_y, depth=0, move_here=None):
         self.dist_to_pacman = dist_to_pacman
         self.parent = parent
         self.children = []
-        self.pacman_x, self.pacman_y = pacman_x, pacman_y
         self.ghost_x, self.ghost_y = ghost_x, ghost_y
         self.depth = depth
         self.move_here = move_here
 
-    def evaluate_children(self, level):
+    def evaluate_children(self, level, field):
         if self.depth >= GHOST_AI_DEPTH:
             return
-        # find valid moves
-        directions = [(0, 1), (0, -1), (-1, 0), (1, 0)]
-        for direction in directions:
-            target_y = self.ghost_y + direction[0]
-            target_x = self.ghost_x + direction[1]
-            if level.tile_map[target_y, target_x] == 0:  # move only through corridors
-                # calculate distance to pacman
-                new_dist = level.shortest_path_length(target_x, target_y,
-                                                      self.pacman_x, self.pacman_y)
-                if new_dist < self.dist_to_pacman:
-                    new_state = GhostGameState(new_dist, self, self.pacman_x, self.pacman_y,
-                                               target_x, target_y, self.depth + 1, direction)
-                    new_state.evaluate_children(level)  # evaluate a new state recursively
-                    self.children.append(new_state)
+        graph = level.get_corridor_graph()
+        neighbours = graph.neighbour_rows[graph.corridor_id(self.ghost_x, self.ghost_y)]
+        for direction, neighbour in zip(DIRECTIONS, neighbours):
+            if neighbour >= 0 and field[neighbour] < self.dist_to_pacman:  # move only closer to pacman
+                new_state = GhostGameState(field[neighbour], self, self.ghost_x + direction[1],
+                                           self.ghost_y + direction[0], self.depth + 1, direction)
+                new_state.evaluate_children(level, field)  # descend the field from there
+                self.children.append(new_state)
+                break
+        if level.search_stats:
+            level.search_stats.expanded(len(self.children))
 
-    def get_best_move(self, level):
-        self.evaluate_children(level)
+    def get_best_move(self, level, field):
+        self.evaluate_children(level, field)
         # choose first child
         if self.children:
             return self.children[0].move_here
@@ -0,0 +1,370 @@
+import heapq
+import threading
+import numpy as np
+from collections import OrderedDict
+
+DIRECTIONS = [(0, 1), (0, -1), (-1, 0), (1, 0)]  # right, left, up, down
+
+
+# the empty tiles of a tile map as a graph, with corridor ids assigned row by row
+# (tile maps are expected to be surrounded by walls)
+class CorridorGraph:
+    def __init__(self, tile_map):
+        height, width = tile_map.shape
+        self.width = width
+        self.cells = np.flatnonzero(tile_map.ravel() == 0)
+        self.size = len(self.cells)
+        ids = np.full(height * width, -1, dtype=np.int32)
+        ids[self.cells] = np.arange(self.size, dtype=np.int32)
+        self.ids = ids.tolist()  # flat tile index -> corridor id, -1 for walls
+        self.ys, self.xs = (self.cells // width).tolist(), (self.cells % width).tolist()
+        # ids of the neighbouring corridors in right, left, up, down order, -1 for walls
+        steps = np.array([1, -1, -width, width])
+        self.neighbours = ids[self.cells[:, None] + steps[None, :]]
+        self.neighbour_rows = self.neighbours.tolist()
+        self.neighbour_lists = [[n for n in row if n >= 0] for row in self.neighbour_rows]
+
+    def corridor_id(self, x, y):
+        return self.ids[y * self.width + x]
+
+    # moves from start to target, backtracking from the target through tiles whose distance
+    # from the start is one less, in the same order as Level.moves_from_distance_matrix
+    def moves_from_distances(self, start, target, distances):
+        if target < 0 or distances[target] < 0:
+            return []  # target can't be reached
+        # the tile a move came from lies in the opposite direction of the move
+        backtrack = [(DIRECTIONS[0], 1), (DIRECTIONS[1], 0), (DIRECTIONS[2], 3), (DIRECTIONS[3], 2)]
+        moves = []
+        cell = target
+        while cell != start:
+            dist = distances[cell]
+            neighbours = self.neighbour_rows[cell]
+            for dir, index in backtrack:
+                previous = neighbours[index]
+                if previous >= 0 and distances[previous] == dist - 1:  # move is optimal
+                    moves.append(dir)
+                    cell = previous
+                    break
+        moves.reverse()
+        return moves
+
+    # BFS distances from the closest of the sources to every corridor (-1 where unreachable)
+    def distances_from(self, sources):
+        distances = [-1] * self.size
+        frontier = []
+        for source in sources:
+            if source >= 0 and distances[source] == -1:
+                distances[source] = 0
+                frontier.append(source)
+        neighbour_lists = self.neighbour_lists
+        dist = 0
+        while frontier:
+            dist += 1
+            next_frontier = []
+            for cell in frontier:
+                for neighbour in neighbour_lists[cell]:
+                    if distances[neighbour] == -1:
+                        distances[neighbour] = dist
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return distances
+
+    # first move from a corridor that gets closer to whatever the distances were measured from,
+    # trying right, left, up, down in that order (None if there is no such move)
+    def first_move(self, cell, distances):
+        dist = distances[cell]
+        if dist == 0:  # already there (and an unsigned distance table row can't go below 0)
+            return None
+        for direction, neighbour in zip(DIRECTIONS, self.neighbour_rows[cell]):
+            if neighbour >= 0 and distances[neighbour] == dist - 1:
+                return direction
+        return None
+
+    # moves that follow first_move all the way down to distance 0
+    def descend(self, cell, distances):
+        moves = []
+        if cell < 0:
+            return moves
+        dist = distances[cell]
+        while dist > 0:
+            neighbours = self.neighbour_rows[cell]
+            for index, direction in enumerate(DIRECTIONS):
+                neighbour = neighbours[index]
+                if neighbour >= 0 and distances[neighbour] == dist - 1:
+                    moves.append(direction)
+                    cell, dist = neighbour, dist - 1
+                    break
+            else:
+                break  # nowhere to go, the distances don't lead anywhere from here
+        return moves
+
+
+# CorridorGraph contracted to its junctions and dead ends (tiles with other than 2 neighbours),
+# joined by edges that stand for whole corridors, weighted by their length
+class JunctionGraph:
+    def __init__(self, graph):
+        self.graph = graph
+        neighbour_lists = graph.neighbour_lists
+        self.is_node = [len(neighbours) != 2 for neighbours in neighbour_lists]
+        # a loop of corridors without any junction still needs a node somewhere on it
+        seen = bytearray(graph.size)
+        for cell in range(graph.size):
+            if seen[cell]:
+                continue
+            component = [cell]
+            seen[cell] = 1
+            for current in component:
+                for neighbour in neighbour_lists[current]:
+                    if not seen[neighbour]:
+                        seen[neighbour] = 1
+                        component.append(neighbour)
+            if not any(self.is_node[current] for current in component):
+                self.is_node[cell] = True
+        self.nodes = [cell for cell in range(graph.size) if self.is_node[cell]]
+        # edges are lists of corridor ids from one node to another, both ends included
+        self.edges = []
+        self.adjacency = {node: [] for node in self.nodes}  # node -> [(edge id, other node, length)]
+        self.edge_of = [-1] * graph.size  # corridor -> edge it lies inside of (-1 for nodes)
+        self.offset = [0] * graph.size  # corridor -> its index in that edge
+        for node in self.nodes:
+            for first in neighbour_lists[node]:
+                cells = [node]
+                previous, cell = node, first
+                while not self.is_node[cell]:  # follow the corridor
+                    cells.append(cell)
+                    a, b = neighbour_lists[cell]
+                    previous, cell = cell, (b if a == previous else a)
+                cells.append(cell)
+                # every corridor is walked from both of its ends, keep only one of the walks
+                if (cells[0], cells[1]) > (cells[-1], cells[-2]):
+                    continue
+                edge = len(self.edges)
+                self.edges.append(cells)
+                for index in range(1, len(cells) - 1):
+                    self.edge_of[cells[index]] = edge
+                    self.offset[cells[index]] = index
+                self.adjacency[node].append((edge, cell, len(cells) - 1))
+                if cell != node:
+                    self.adjacency[cell].append((edge, node, len(cells) - 1))
+
+    # nodes that can be reached straight from a corridor, with their distances
+    # and the corridor ids on the way (from the corridor to the node)
+    def exits(self, cell):
+        if self.is_node[cell]:
+            return [(cell, 0, [cell])]
+        cells, index = self.edges[self.edge_of[cell]], self.offset[cell]
+        return [(cells[0], index, cells[index::-1]), (cells[-1], len(cells) - 1 - index, cells[index:])]
+
+    # A* over the junctions, returns the corridor ids of a shortest path from start to target
+    # together with the number of expanded nodes and the peak size of the open list
+    def shortest_path(self, start, target):
+        if start == target:
+            return [start], 0, 1
+        xs, ys = self.graph.xs, self.graph.ys
+        target_x, target_y = xs[target], ys[target]
+        # the path can stay inside the corridor both points are on
+        best_length, best_path = None, None
+        if not self.is_node[start] and self.edge_of[start] == self.edge_of[target]:
+            cells, i, j = self.edges[self.edge_of[start]], self.offset[start], self.offset[target]
+            best_length, best_path = abs(i - j), (cells[i:j + 1] if i < j else cells[j:i + 1][::-1])
+        # ways into the target from the nodes at the ends of its corridor
+        entrances = {}
+        for node, length, cells in self.exits(target):
+            if node not in entrances or length < entrances[node][0]:
+                entrances[node] = (length, cells[::-1])
+        distances, parents, heap = {}, {}, []
+        for node, length, cells in self.exits(start):
+            if node not in distances or length < distances[node]:
+                distances[node] = length
+                parents[node] = (None, cells)
+                heapq.heappush(heap, (length + abs(xs[node] - target_x) + abs(ys[node] - target_y), length, node))
+        expanded, peak = 0, len(heap)
+        closed = set()
+        while heap:
+            peak = max(peak, len(heap))
+            f, length, node = heapq.heappop(heap)
+            if node in closed:
+                continue  # outdated entry
+            if best_length is not None and f >= best_length:
+                break  # nothing left can beat the best path found so far
+            closed.add(node)
+            expanded += 1
+            if node in entrances and (best_length is None or length + entrances[node][0] < best_length):
+                best_length = length + entrances[node][0]
+                best_path = self.path_to(node, parents) + entrances[node][1][1:]
+            for edge, other, edge_length in self.adjacency[node]:
+                other_length = length + edge_length
+                if other not in closed and (other not in distances or other_length < distances[other]):
+                    distances[other] = other_length
+                    parents[other] = (node, edge)
+                    heapq.heappush(heap, (other_length + abs(xs[other] - target_x) + abs(ys[other] - target_y),
+                                          other_length, other))
+        return best_path or [], expanded, peak
+
+    # corridor ids from the start to a node, following the parents found by the search
+    def path_to(self, node, parents):
+        pieces = []
+        while True:
+            previous, edge_or_cells = parents[node]
+            if previous is None:  # first stretch, from the start to a node
+                pieces.append(edge_or_cells)
+                break
+            cells = self.edges[edge_or_cells]
+            pieces.append(cells if cells[0] == previous and cells[-1] == node else cells[::-1])
+            node = previous
+        path = list(pieces.pop())
+        while pieces:
+            path.extend(pieces.pop()[1:])
+        return path
+
+    # moves that walk along a list of neighbouring corridor ids
+    def moves_along(self, cells):
+        xs, ys = self.graph.xs, self.graph.ys
+        return [(ys[b] - ys[a], xs[b] - xs[a]) for a, b in zip(cells, cells[1:])]
+
+
+# shortest distances between the corridors of a CorridorGraph
+# rows of the table are filled with one BFS each, on demand (or right away for small maps),
+# and only as many rows as fit into max_bytes are kept, least recently used rows are dropped
+class DistanceTable:
+    def __init__(self, graph, max_bytes=64 * 1024 * 1024, eager_cells=1024):
+        self.graph = graph
+        self.size = graph.size
+        self.dtype = np.uint16 if self.size < 0xFFFF else np.uint32
+        self.unreachable = int(np.iinfo(self.dtype).max)
+        # bounded storage for the rows
+        row_bytes = max(1, self.size * np.dtype(self.dtype).itemsize)
+        self.max_rows = max(1, min(self.size, max_bytes // row_bytes))
+        self.rows = np.empty((self.max_rows, self.size), dtype=self.dtype)
+        self.slots = OrderedDict()  # corridor id -> row slot, least recently used first
+        self.lock = threading.RLock()  # rows may be looked up from planning threads too
+        if self.size <= eager_cells and self.max_rows == self.size:
+            for corridor_id in range(self.size):
+                self.row(corridor_id)
+
+    # distances from a corridor to every other corridor
+    # (a copy when rows get reused, so that another thread can't overwrite it)
+    def row(self, corridor_id):
+        with self.lock:
+            row = self.rows[self.slot(corridor_id)]
+            return row.copy() if self.max_rows < self.size else row
+
+    # index of a corridor's row in self.rows, filling the row first if needed
+    def slot(self, corridor_id):
+        with self.lock:
+            slot = self.slots.get(corridor_id)
+            if slot is not None:
+                self.slots.move_to_end(corridor_id)
+                return slot
+            if len(self.slots) < self.max_rows:
+                slot = len(self.slots)
+            else:  # reuse the least recently used row
+                _, slot = self.slots.popitem(last=False)
+            self.rows[slot] = self.bfs(corridor_id)
+            self.slots[corridor_id] = slot
+            return slot
+
+    # distances between matching elements of two arrays of corridor ids, as one array
+    # (as many rows as fit are loaded at a time, so any number of different targets works)
+    def gather(self, targets, cells):
+        result = np.empty(len(cells), dtype=self.dtype)
+        if not len(cells):
+            return result
+        unique, inverse = np.unique(targets, return_inverse=True)
+        for start in range(0, len(unique), self.max_rows):
+            chunk = unique[start:start + self.max_rows]
+            mask = (inverse >= start) & (inverse < start + len(chunk))
+            with self.lock:
+                slots = np.array([self.slot(int(target)) for target in chunk])
+                result[mask] = self.rows[slots[inverse[mask] - start], cells[mask]]
+        return result
+
+    # first moves (direction indices into DIRECTIONS, 4 for none) from cells towards the matching
+    # targets, trying right, left, up, down in that order like first_move
+    def next_moves(self, targets, cells):
+        dist = self.gather(targets, cells).astype(np.int64) - 1
+        neighbours = self.graph.neighbours[cells]
+        moves = np.full(len(cells), len(DIRECTIONS), dtype=np.int64)
+        for move in reversed(range(len(DIRECTIONS))):  # earlier directions overwrite later ones
+            neighbour = neighbours[:, move]
+            reachable = neighbour >= 0
+            closer = np.zeros(len(cells), dtype=bool)
+            closer[reachable] = self.gather(targets[reachable], neighbour[reachable]) == dist[reachable]
+            moves[closer] = move
+        return moves
+
+    def bfs(self, corridor_id):
+        distances = np.array(self.graph.distances_from([corridor_id]))
+        distances[distances < 0] = self.unreachable
+        return distances
+
+    # length of the shortest path between two tiles (unreachable if either is a wall)
+    def distance(self, x1, y1, x2, y2):
+        id1, id2 = self.graph.corridor_id(x1, y1), self.graph.corridor_id(x2, y2)
+        if id1 < 0 or id2 < 0:
+            return self.unreachable
+        with self.lock:
+            # the table is symmetric, so use whichever row is already there
+            if id1 not in self.slots and id2 in self.slots:
+                id1, id2 = id2, id1
+            return int(self.rows[self.slot(id1), id2])
+
+    # first move of a shortest path, trying right, left, up, down in that order
+    def next_move(self, x1, y1, x2, y2):
+        id1, id2 = self.graph.corridor_id(x1, y1), self.graph.corridor_id(x2, y2)
+        if id1 < 0 or id2 < 0 or id1 == id2:
+            return None
+        distances = self.row(id2)  # distances towards the target
+        if distances[id1] == self.unreachable:
+            return None
+        return self.graph.first_move(id1, distances)
+
+
+# distances from (x, y) to every tile, expanding the whole BFS frontier at once
+# (-1 for tiles that can't be reached), stops early once the target tile (if any) is reached
+# returns the distances, the number of expansion layers and the peak frontier size
+def wavefront_distances(tile_map, x, y, target_x=None, target_y=None):
+    height, width = tile_map.shape
+    # pad the map with walls and pack it into one big integer, a bit per tile, row by row:
+    # shifting by one bit or by one row then moves the whole frontier at once,
+    # and the padding makes sure nothing wraps around into an open tile
+    stride = width + 2
+    open_tiles = np.pad(tile_map == 0, 1)
+    unreached = pack_bits(open_tiles)
+    frontier = 1 << int((y + 1) * stride + x + 1)
+    target = 1 << int((target_y + 1) * stride + target_x + 1) if target_x is not None else 0
+    unreached &= ~frontier
+    # instead of one distance per tile, keep a bit mask per binary digit of the distance
+    digits = []
+    dist = 0
+    while not frontier & target:  # target reached: early stop
+        grown = (frontier << 1) | (frontier >> 1) | (frontier << stride) | (frontier >> stride)
+        frontier = grown & unreached
+        if not frontier:
+            break  # everything reachable has been reached
+        unreached ^= frontier
+        dist += 1
+        for digit in range(dist.bit_length()):
+            if dist >> digit & 1:
+                if digit == len(digits):
+                    digits.append(0)
+                digits[digit] |= frontier
+    # unpack the digits into a distance matrix
+    size = open_tiles.size
+    reached = open_tiles.ravel() & ~unpack_bits(unreached, size)
+    distances = np.zeros(size, dtype=np.int32)
+    for digit, mask in enumerate(digits):
+        distances[unpack_bits(mask, size)] += 1 << digit
+    peak_frontier = int(np.bincount(distances[reached]).max())  # largest layer
+    distances[~reached] = -1
+    return distances.reshape(open_tiles.shape)[1:-1, 1:-1], dist, peak_frontier
+
+
+# boolean array -> integer with bit i set for every true element i (in row-major order)
+def pack_bits(array):
+    return int.from_bytes(np.packbits(array.ravel(), bitorder='little').tobytes(), 'little')
+
+
+def unpack_bits(bits, size):
+    data = np.frombuffer(bits.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(data, bitorder='little')[:size].astype(bool)
@@ -0,0 +1,274 @@
+import argparse
+import math
+import struct
+import sys
+import time
+import zlib
+import Source.game as game
+from Source.pathfinding import DIRECTIONS
+
+# replays: a game is recorded as the seed of its level (which the map, the ghosts, the coins and every random
+# draw follow from), pacman's decisions and the ghosts' random draws made during the game, so that it can be played
+# back, headless or in the game's window (see REPLAY in main.py), with pacman thinking all of his moves over
+# again, which is the way to profile a slow decision after the fact:
+#   python -m Source.replay games/level-3.pkr  (play back and report the divergences and the slowest decisions)
+# a played back game follows the recording, a decision or draw that comes out differently is flagged and
+# replaced with the recorded one (decisions made within a time budget depend on how fast the machine is)
+
+MAGIC = b"PKRP"
+VERSION = 1
+GAME_MODES = ["Game", "Pathfinding"]
+OUTCOMES = ["running", "victory", "defeat"]
+HEADER = struct.Struct("<4sBqHHBBHHddIBI")  # see Replay.to_bytes
+FLOAT_DRAW, INT_DRAW = 0, 1
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class Replay:
+    def __init__(self, seed, width, height, difficulty=0, game_mode="Game", planner="transposition",
+                 time_budget=None, settings=None):
+        self.seed = seed
+        self.width, self.height = width, height
+        self.difficulty = difficulty
+        self.game_mode = game_mode
+        self.planner = planner
+        self.time_budget = time_budget
+        # the difficulty_settings entry the game was played with
+        self.settings = dict(settings or game.difficulty_settings[difficulty])
+        self.moves = []  # (frame, direction index) of every decision of pacman
+        self.draws = []  # (frame, value) of every draw of level.random, floats from random() and ints from below()
+        self.frames = 0  # how long the game went on
+        self.outcome = "running"
+        self.score = 0  # points scored in the game
+        self.start_score = 0  # score the level started with (carried over from the levels before)
+
+    # start recording a simulation, finish() once it's over
+    @staticmethod
+    def record(simulation):
+        level, pacman = simulation.level, simulation.pacman
+        replay = Replay(level.seed, level.width, level.height, level.difficulty, simulation.game_mode,
+                        pacman.planner, pacman.time_budget, level.settings)
+        replay.start_score = level.score
+
+        def on_decision(move):
+            replay.moves.append((simulation.frame, DIRECTIONS.index(move)))
+            return move
+
+        def on_draw(frame, value):
+            replay.draws.append((frame, value))
+            return value
+
+        pacman.on_decision = on_decision
+        level.random.on_draw = on_draw
+        return replay
+
+    def finish(self, simulation):
+        self.frames = simulation.frame
+        self.outcome = simulation.state
+        self.score = simulation.level.score - self.start_score
+
+    # header (magic, version, seed, width, height, difficulty, game mode, ghost frames per tile, ghost amount,
+    # random move chance, time budget (NaN for none), frames, outcome, score), planner and then the moves
+    # and draws compressed, every frame stored as the difference to the one before
+    def to_bytes(self):
+        time_budget = self.time_budget if self.time_budget is not None else math.nan
+        header = HEADER.pack(MAGIC, VERSION, self.seed, self.width, self.height, self.difficulty,
+                             GAME_MODES.index(self.game_mode), self.settings["ghost_frames_per_tile"],
+                             self.settings["ghost_amount"], self.settings["random_move_chance"], time_budget,
+                             self.frames, OUTCOMES.index(self.outcome), self.score)
+        planner = self.planner.encode()
+        body = bytearray()
+        write_varint(body, len(self.moves))
+        last_frame = 0
+        for frame, move in self.moves:
+            write_varint(body, frame - last_frame)
+            body.append(move)
+            last_frame = frame
+        write_varint(body, len(self.draws))
+        last_frame = 0
+        for frame, value in self.draws:
+            write_varint(body, frame - last_frame)
+            if isinstance(value, float):
+                body.append(FLOAT_DRAW)
+                body += struct.pack("<d", value)
+            else:
+                body.append(INT_DRAW)
+                write_varint(body, value)
+            last_frame = frame
+        return header + bytes([len(planner)]) + planner + zlib.compress(bytes(body), 9)
+
+    @staticmethod
+    def from_bytes(data):
+        (magic, version, seed, width, height, difficulty, game_mode, ghost_frames, ghost_amount, chance,
+         time_budget, frames, outcome, score) = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a replay of this version")
+        offset = HEADER.size
+        planner = data[offset + 1:offset + 1 + data[offset]].decode()
+        body = zlib.decompress(data[offset + 1 + data[offset]:])
+        settings = {"ghost_frames_per_tile": ghost_frames, "ghost_amount": ghost_amount,
+                    "random_move_chance": chance}
+        replay = Replay(seed, width, height, difficulty, GAME_MODES[game_mode], planner,
+                        None if math.isnan(time_budget) else time_budget, settings)
+        replay.frames, replay.outcome, replay.score = frames, OUTCOMES[outcome], score
+        count, offset = read_varint(body, 0)
+        frame = 0
+        for _ in range(count):
+            delta, offset = read_varint(body, offset)
+            frame += delta
+            replay.moves.append((frame, body[offset]))
+            offset += 1
+        count, offset = read_varint(body, offset)
+        frame = 0
+        for _ in range(count):
+            delta, offset = read_varint(body, offset)
+            frame += delta
+            kind = body[offset]
+            offset += 1
+            if kind == FLOAT_DRAW:
+                value = struct.unpack_from("<d", body, offset)[0]
+                offset += 8
+            else:
+                value, offset = read_varint(body, offset)
+            replay.draws.append((frame, value))
+        return replay
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as file:
+            return Replay.from_bytes(file.read())
+
+
+# a recorded game being played back: the simulation follows the recording and notes where it diverges
+class Playback:
+    def __init__(self, replay):
+        self.replay = replay
+        self.divergences = []  # (frame, what, recorded, played back)
+        self.move_index = self.draw_index = 0
+        self.ended = False  # whether the ending was checked
+        self.in_sync = True  # whether the decisions and draws come at the recorded frames, only then are they forced
+        # the game is played with the settings of the recording, whatever difficulty_settings holds now
+        self.simulation = game.Simulation.create(replay.width, replay.height, replay.difficulty, replay.game_mode,
+                                                 replay.seed, replay.settings)
+        level, pacman = self.simulation.level, self.simulation.pacman
+        pacman.planner = replay.planner
+        pacman.time_budget = replay.time_budget
+        pacman.on_decision = self.on_decision
+        level.random.on_draw = self.on_draw
+
+    def on_decision(self, move):
+        frame, move_index = self.simulation.frame, DIRECTIONS.index(move)
+        recorded = self.follow(self.replay.moves, self.move_index, "move", (frame, move_index))
+        if recorded is None:
+            return move
+        self.move_index += 1
+        if recorded[1] != move_index:
+            self.divergences.append((frame, "move", recorded, (frame, move_index)))
+        return DIRECTIONS[recorded[1]]
+
+    def on_draw(self, frame, value):
+        recorded = self.follow(self.replay.draws, self.draw_index, "draw", (frame, value))
+        if recorded is None:
+            return value
+        self.draw_index += 1
+        if recorded[1] != value:
+            self.divergences.append((frame, "draw", recorded, (frame, value)))
+        return recorded[1]
+
+    # the recorded (frame, value) at index of a stream if the played one comes at its frame (and the value is
+    # of the same kind), otherwise None
+    def follow(self, stream, index, what, played):
+        if not self.in_sync:
+            return None
+        recorded = stream[index] if index < len(stream) else None
+        if recorded is None or recorded[0] != played[0] or type(recorded[1]) is not type(played[1]):
+            self.lose_sync(played[0], what, recorded, played)
+            return None
+        return recorded
+
+    # a decision or draw at another frame than recorded (the game's logic changed since the recording):
+    # the recording can't be followed any more, the rest of the game plays out by itself
+    def lose_sync(self, frame, what, recorded, played):
+        self.in_sync = False
+        self.divergences.append((frame, what, recorded, played))
+
+    # update the game for 1 frame, returns its state, once it's over the ending is checked too
+    def step(self):
+        simulation = self.simulation
+        state = simulation.step()
+        if not self.ended and (state != "running" or simulation.frame >= self.replay.frames):
+            self.check_ending()
+        return state
+
+    def check_ending(self):
+        simulation, replay = self.simulation, self.replay
+        self.ended = True
+        if simulation.frame != replay.frames or simulation.state != replay.outcome or \
+                simulation.level.score != replay.score:
+            self.divergences.append((simulation.frame, "ending", (replay.frames, replay.outcome, replay.score),
+                                     (simulation.frame, simulation.state, simulation.level.score)))
+
+    # play the rest of the game back as fast as possible (ending where the recording ended)
+    def run(self):
+        simulation = self.simulation
+        while simulation.state == "running" and simulation.frame < self.replay.frames:
+            simulation.step()
+        self.check_ending()
+        return self.divergences
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play back a recorded game headless")
+    parser.add_argument("replay", help="replay file")
+    parser.add_argument("--slowest", type=int, default=5, help="how many of the slowest decisions to list")
+    args = parser.parse_args()
+    replay = Replay.load(args.replay)
+    playback = Playback(replay)
+    level = playback.simulation.level
+    level.search_stats = game.SearchStats()
+    decisions = []  # (time in ns, frame) of every decision of pacman
+    on_decision = playback.on_decision
+
+    def timed_decision(move):
+        decisions.append((level.search_stats.last["pacman"]["time_ns"], playback.simulation.frame))
+        return on_decision(move)
+
+    playback.simulation.pacman.on_decision = timed_decision
+    start = time.perf_counter()
+    divergences = playback.run()
+    elapsed = time.perf_counter() - start
+    print(f"{replay.width}x{replay.height} difficulty {replay.difficulty}, seed {replay.seed}, "
+          f"{replay.planner} planner: {replay.outcome} after {replay.frames} frames with score {replay.score}, "
+          f"played back in {elapsed:.2f}s")
+    for time_ns, frame in sorted(decisions, reverse=True)[:args.slowest]:
+        print(f"decision at frame {frame}: {time_ns / 1e6:.2f} ms")
+    for frame, what, recorded, played in divergences:
+        print(f"DIVERGENCE at frame {frame} ({what}): recorded {recorded}, played back {played}")
+    if divergences:
+        sys.exit(1)
+
+
+# run the main function only if this module is executed as the main script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import Source.game as game
+from Source.benchmark import git_commit
+from Source.replay import Replay
+
+# headless self-play of many games per difficulty level on a process pool, run from the repository root:
+#   python -m Source.selfplay --difficulties 0 1 2 3 --games 200 --output selfplay.json
+#   python -m Source.selfplay --settings tuned.json --stream games.jsonl  (try out other difficulty_settings)
+# every game is seeded from --seed, its difficulty and its index, so the same arguments play the same games
+# (as long as pacman looks a fixed depth ahead, a time budget makes his decisions depend on the machine)
+#   python -m Source.selfplay --difficulties 5 --games 50 --replays games  (save every game to play back)
+
+DEFAULT_DIFFICULTIES = sorted(game.difficulty_settings)
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+# level seed of a game, hashed by a SeedSequence so that no two (seed, difficulty, index) share it
+# (63 bits like the seed of an unseeded Level)
+def game_seed(seed, difficulty, index):
+    return int(np.random.SeedSequence([seed, difficulty, index]).generate_state(1, np.uint64)[0]) >> 1
+
+
+# replace entries of difficulty_settings, settings maps difficulties to the parameters to change
+def apply_settings(settings):
+    for difficulty, params in settings.items():
+        game.difficulty_settings.setdefault(int(difficulty), {}).update(params)
+
+
+# play a game to the end (or max_ticks frames), returns its result and the pacman decision latencies in ns,
+# a replay of it is saved to the replays directory if there is one
+def play_game(difficulty, index, seed, size, max_ticks, planner, time_budget, replays=None):
+    simulation = game.Simulation.create(size, size, difficulty, seed=seed)
+    level, pacman = simulation.level, simulation.pacman
+    level.search_stats = game.SearchStats()
+    pacman.planner = planner
+    pacman.time_budget = time_budget
+    replay = Replay.record(simulation) if replays else None
+    coins = len(level.coins)
+    totals, latencies = level.search_stats.totals["pacman"], []
+    while simulation.state == "running" and simulation.frame < max_ticks:
+        decisions = totals["decisions"]
+        simulation.step()
+        if totals["decisions"] != decisions:
+            latencies.append(level.search_stats.last["pacman"]["time_ns"])
+    outcome = simulation.state if simulation.state != "running" else "timeout"
+    if replay:
+        replay.finish(simulation)
+        replay.save(os.path.join(replays, f"difficulty-{difficulty}-game-{index}.pkr"))
+    result = {"difficulty": difficulty, "game": index, "seed": seed, "outcome": outcome, "score": level.score,
+              "ticks": simulation.frame, "coins": coins, "coins_eaten": coins - len(level.coins),
+              "decisions": len(latencies), "max_depth": totals["max_depth"]}
+    return result, latencies
+
+
+def latency_stats(latencies):
+    row = {}
+    for percentile in LATENCY_PERCENTILES:
+        row[f"latency_p{percentile}_ns"] = int(np.percentile(latencies, percentile)) if latencies else 0
+    row["latency_mean_ns"] = int(np.mean(latencies)) if latencies else 0
+    row["latency_max_ns"] = int(np.max(latencies)) if latencies else 0
+    return row
+
+
+# sum up the games of every difficulty level
+def summarize(games, latencies):
+    levels = []
+    for difficulty in sorted({result["difficulty"] for result in games}):
+        results = [result for result in games if result["difficulty"] == difficulty]
+        outcomes = [result["outcome"] for result in results]
+        row = {"difficulty": difficulty, "settings": game.difficulty_settings[difficulty], "games": len(results),
+               "wins": outcomes.count("victory"), "deaths": outcomes.count("defeat"),
+               "timeouts": outcomes.count("timeout")}
+        row["win_rate"] = row["wins"] / len(results)
+        row["score_mean"] = float(np.mean([result["score"] for result in results]))
+        row["coins_eaten_mean"] = float(np.mean([result["coins_eaten"] / max(1, result["coins"])
+                                                 for result in results]))
+        survived = [result["ticks"] for result in results if result["outcome"] == "defeat"]
+        row["ticks_mean"] = float(np.mean([result["ticks"] for result in results]))
+        row["survival_ticks_mean"] = float(np.mean(survived)) if survived else None  # of the games lost
+        row["decisions"] = sum(result["decisions"] for result in results)
+        row.update(latency_stats(latencies[difficulty]))
+        levels.append(row)
+    return levels
+
+
+# play every game on a pool of processes, calling log and stream with every result as it comes in
+def run(difficulties, games, seed, size, max_ticks, planner, time_budget, workers=None, settings=None,
+        log=None, stream=None, replays=None):
+    results, latencies = [], {difficulty: [] for difficulty in difficulties}
+    if replays:
+        os.makedirs(replays, exist_ok=True)
+    with ProcessPoolExecutor(workers, initializer=apply_settings, initargs=(settings or {},)) as executor:
+        futures = [executor.submit(play_game, difficulty, index, game_seed(seed, difficulty, index), size,
+                                   max_ticks, planner, time_budget, replays)
+                   for difficulty in difficulties for index in range(games)]
+        for done, future in enumerate(as_completed(futures), 1):
+            result, game_latencies = future.result()
+            results.append(result)
+            latencies[result["difficulty"]].extend(game_latencies)
+            if stream:
+                stream(result)
+            if log:
+                log(f"[{done}/{len(futures)}] difficulty {result['difficulty']} game {result['game']}: "
+                    f"{result['outcome']}, score {result['score']}, {result['ticks']} ticks")
+    results.sort(key=lambda result: (result["difficulty"], result["game"]))
+    return results, latencies
+
+
+def metadata(args):
+    return {"commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.machine(), "processor": platform.processor(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "workers": args.workers or os.cpu_count(),
+            "difficulties": args.difficulties, "games": args.games, "seed": args.seed, "size": args.size,
+            "max_ticks": args.max_ticks, "planner": args.planner, "time_budget": args.time_budget}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless self-play over the difficulty levels")
+    parser.add_argument("--difficulties", type=int, nargs="+", default=DEFAULT_DIFFICULTIES)
+    parser.add_argument("--games", type=int, default=20, help="games per difficulty level")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, default=15, help="level size (an odd number), every level is square")
+    parser.add_argument("--max-ticks", type=int, default=20000, help="frames before a game counts as a timeout")
+    parser.add_argument("--planner", default="transposition", help="pacman's look-ahead (see PacMan.planner)")
+    parser.add_argument("--time-budget", type=float, default=None,
+                        help="seconds pacman may think per move (games are only reproducible without one)")
+    parser.add_argument("--workers", type=int, default=None, help="processes to play on (all cores by default)")
+    parser.add_argument("--settings", help="JSON file of difficulty_settings entries to play with instead")
+    parser.add_argument("--output", help="file to write the summary to (stdout by default)")
+    parser.add_argument("--stream", help="file to append every game's result to as a JSON line once it's over")
+    parser.add_argument("--replays", help="directory to save a replay of every game to (see Source.replay)")
+    args = parser.parse_args()
+    settings = None
+    if args.settings:
+        with open(args.settings) as file:
+            settings = json.load(file)
+        apply_settings(settings)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    stream_file = open(args.stream, "a") if args.stream else None
+
+    def stream(result):
+        stream_file.write(json.dumps(result) + "\n")
+        stream_file.flush()
+
+    try:
+        games, latencies = run(args.difficulties, args.games, args.seed, args.size, args.max_ticks, args.planner,
+                               args.time_budget, args.workers, settings, log, stream if stream_file else None,
+                               args.replays)
+    finally:
+        if stream_file:
+            stream_file.close()
+    summary = {"meta": metadata(args), "levels": summarize(games, latencies), "games": games}
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        json.dump(summary, output, indent=2)
+        output.write("\n")
+    finally:
+        if args.output:
+            output.close()
+
+
+# run the main function only if this module is executed as the main script
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import os
+import random
+import pygame
+from Source.game import TILE_SIZE
+
+# the game's graphics: sprites that draw the state of a Simulation (Source.game), which runs without them
+
+TILE_IMAGES = {0: "Assets/Images/Star_Back.png", 1: "Assets/Images/Star_Wall.png"}
+PACMAN_IMAGE = "Assets/Images/pacman.png"
+PACMAN_SCARED_IMAGE = "Assets/Images/pacman_scared.png"
+PACMAN_DEAD_IMAGE = "Assets/Images/pacman_dead.png"
+GHOST_IMAGE = "Assets/Images/spooky.png"
+COIN_FRAMES = "Assets/Images/coin"
+PACMAN_ANGLES = {(0, 1): 0, (0, -1): 180, (-1, 0): 90, (1, 0): 270}  # rotation of pacman's images per direction
+
+# every image is loaded (and converted for the display) once per process and shared by all of the sprites,
+# so it can only happen once the display is set up, preload() does it right away instead of on first use
+images = {}  # (path, alpha) -> Surface
+animations = {}  # directory -> Surfaces of its files ordered by name
+transformed = {}  # (path, rotation angle, flipped) -> Surface
+
+
+def load_image(path, alpha=True):
+    key = (path, alpha)
+    if key not in images:
+        image = pygame.image.load(path)
+        images[key] = image.convert_alpha() if alpha else image.convert()
+    return images[key]
+
+
+def load_animation(directory):
+    if directory not in animations:
+        animations[directory] = [load_image(os.path.join(directory, file_name))
+                                 for file_name in sorted(os.listdir(directory))]
+    return animations[directory]
+
+
+# an image rotated by angle degrees and/or flipped horizontally
+def transformed_image(path, angle=0, flip=False):
+    key = (path, angle, flip)
+    if key not in transformed:
+        image = load_image(path)
+        if flip:
+            image = pygame.transform.flip(image, True, False)
+        transformed[key] = pygame.transform.rotate(image, angle) if angle else image
+    return transformed[key]
+
+
+# load every image of the game (and its rotations), call after pygame.display.set_mode
+def preload():
+    for path in TILE_IMAGES.values():
+        load_image(path, alpha=False)
+    for path in [PACMAN_IMAGE, PACMAN_SCARED_IMAGE]:
+        for angle in PACMAN_ANGLES.values():
+            transformed_image(path, angle)
+    load_image(PACMAN_DEAD_IMAGE)
+    for flip in [False, True]:
+        transformed_image(GHOST_IMAGE, flip=flip)
+    load_animation(COIN_FRAMES)
+
+
+class Tile(pygame.sprite.Sprite):
+    def __init__(self, type, grid_x, grid_y):
+        # Call the parent's constructor
+        pygame.sprite.Sprite.__init__(self)
+        # image based on tile type
+        self.image = load_image(TILE_IMAGES[type], alpha=False)
+        # move tile to the proper location on the grid
+        self.rect = self.image.get_rect()
+        self.rect.top = TILE_SIZE * grid_y
+        self.rect.left = TILE_SIZE * grid_x
+
+
+class PacManSprite(pygame.sprite.Sprite):
+    def __init__(self, pacman):
+        # Call the parent's constructor
+        pygame.sprite.Sprite.__init__(self)
+        self.pacman = pacman
+        self.image = load_image(PACMAN_IMAGE)
+        self.rect = self.image.get_rect()
+        self.update()
+
+    def update(self):
+        pacman = self.pacman
+        self.rect.left, self.rect.top = pacman.left, pacman.top
+        if pacman.dead:
+            self.image = load_image(PACMAN_DEAD_IMAGE)
+        elif pacman.curr_move:  # rotate sprite towards movement
+            self.rotate_towards_direction(pacman.curr_move)
+
+    def rotate_towards_direction(self, direction):
+        path = PACMAN_SCARED_IMAGE if self.pacman.scared else PACMAN_IMAGE
+        self.image = transformed_image(path, PACMAN_ANGLES[direction])
+
+
+class GhostSprite(pygame.sprite.Sprite):
+    def __init__(self, ghost):
+        # Call the parent's constructor
+        pygame.sprite.Sprite.__init__(self)
+        self.ghost = ghost
+        self.image = load_image(GHOST_IMAGE)
+        self.rect = self.image.get_rect()
+        self.update()
+
+    def update(self):
+        ghost = self.ghost
+        self.rect.left, self.rect.top = ghost.left, ghost.top
+        if ghost.curr_move:  # flip sprite towards movement
+            self.flip_towards_direction(ghost.curr_move)
+
+    # make the ghost face the direction of movement
+    def flip_towards_direction(self, direction):
+        if direction == (0, 1) or direction == (0, -1):  # update image when moving sideways
+            self.image = transformed_image(GHOST_IMAGE, flip=direction == (0, 1))
+
+
+class CoinSprite(pygame.sprite.Sprite):
+    def __init__(self, coin):
+        # Call the parent's constructor
+        pygame.sprite.Sprite.__init__(self)
+        self.images = load_animation(COIN_FRAMES)
+        # set up animation
+        self.index = random.randint(0, len(self.images)-1)  # random animation index
+        self.image = self.images[self.index]
+        self.animation_frames = 6  # how many frames each image in the animation will last
+        self.current_frame = 0
+        # place in the center of a tile
+        self.rect = self.image.get_rect()
+        self.rect.left = coin.tile_x * TILE_SIZE + TILE_SIZE // 2 - 6
+        self.rect.top = coin.tile_y * TILE_SIZE + TILE_SIZE // 2 - 8
+
+    def update(self):
+        self.current_frame += 1
+        if self.current_frame >= self.animation_frames:  # update animation every few frames
+            self.current_frame = 0
+            self.index = (self.index + 1) % len(self.images)
+            self.image = self.images[self.index]
+
+
+# all of the sprites of a simulation, update() catches them up with it
+class GameView:
+    def __init__(self, simulation):
+        self.simulation = simulation
+        level = simulation.level
+        self.tiles = pygame.sprite.RenderPlain()
+        for x in range(level.width):
+            for y in range(level.height):
+                self.tiles.add(Tile(level.tile_map[y, x], x, y))
+        self.coins = pygame.sprite.RenderPlain()
+        self.coin_sprites = {}  # coin id -> CoinSprite
+        self.coins_placed = 0  # coins of the level that got a sprite so far
+        self.sync_coins()
+        self.pacman = pygame.sprite.RenderPlain(PacManSprite(simulation.pacman))
+        self.ghosts = pygame.sprite.RenderPlain([GhostSprite(ghost) for ghost in level.ghosts])
+
+    # add sprites for the coins placed since the last update and remove those of the coins eaten
+    def sync_coins(self):
+        level = self.simulation.level
+        for coin_id in range(self.coins_placed, level.coins_placed):
+            if coin_id in level.coins:
+                sprite = CoinSprite(level.coins[coin_id])
+                self.coin_sprites[coin_id] = sprite
+                self.coins.add(sprite)
+        self.coins_placed = level.coins_placed
+        if len(self.coin_sprites) != len(level.coins):
+            for coin_id in [coin_id for coin_id in self.coin_sprites if coin_id not in level.coins]:
+                self.coin_sprites.pop(coin_id).kill()
+
+    def update(self):
+        self.sync_coins()
+        self.coins.update()
+        self.pacman.update()
+        self.ghosts.update()
+
+    def draw(self, screen):
+        self.tiles.draw(screen)
+        self.coins.draw(screen)
+        self.pacman.draw(screen)
+        self.ghosts.draw(screen)
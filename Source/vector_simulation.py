@@ -0,0 +1,213 @@
+import numpy as np
+import Source.game as game
+from Source.pathfinding import DIRECTIONS
+
+# many games of the same size and difficulty stepped at once, with every game's state in stacked arrays:
+#   games = VectorSimulation(256, 15, difficulty=3, seed=0)
+#   observations = games.reset()
+#   observations, rewards, dones, states = games.step(actions)  # a direction index for every pacman
+# the levels come from game.Level and the rules are those of Simulation (Character.move, Ghost.update,
+# PacMan.update), except that pacman's moves come from the caller and random ghost moves are drawn
+# from the vector simulation's own generator
+# a step is a whole pacman move (PACMAN_MOVE_FRAMES frames), the next observation is the state pacman
+# decides his next move in; a move into a wall makes pacman wait for as long as a move takes
+
+RUNNING, VICTORY, DEFEAT = 0, 1, 2  # states of the games
+NO_MOVE = len(DIRECTIONS)  # direction index of a character standing still
+COIN_SCORE = 10
+COLLISION_RANGE = game.TILE_SIZE * 0.9  # ghosts catch pacman when their sprites' centers get this close
+GHOST_OFFSET_X = 5  # Ghost.sprite_offset_x
+
+
+class VectorSimulation:
+    def __init__(self, games, size, difficulty=0, seed=None):
+        self.games = games
+        self.size = size
+        self.difficulty = difficulty
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        params = game.difficulty_settings[difficulty]
+        ghosts = params["ghost_amount"]
+        self.levels = [None] * games
+        self.resets = 0  # levels generated so far, seeds the next ones
+        # the maps: tile maps, corridor ids of the tiles (-1 for walls) and the neighbouring corridor ids
+        # of every corridor in DIRECTIONS order (-1 for walls), distances come from the levels' DistanceTables
+        self.tile_maps = np.ones((games, size, size), dtype=np.int8)
+        self.ids = np.full((games, size, size), -1, dtype=np.int32)
+        self.neighbours = np.full((games, 0, 4), -1, dtype=np.int32)
+        self.coins = np.zeros((games, size, size), dtype=bool)
+        self.coin_counts = np.zeros(games, dtype=np.int32)
+        self.scores = np.zeros(games, dtype=np.int32)
+        self.states = np.zeros(games, dtype=np.int8)
+        self.frames = np.zeros(games, dtype=np.int64)
+        # pacman: tile, direction index of his move and the frames of it so far, sprite corner in pixels
+        self.pacman_x, self.pacman_y = np.zeros(games, dtype=np.int32), np.zeros(games, dtype=np.int32)
+        self.pacman_move = np.full(games, NO_MOVE, dtype=np.int8)
+        self.pacman_frame = np.zeros(games, dtype=np.int32)
+        self.pacman_left, self.pacman_top = np.zeros(games, dtype=np.int32), np.zeros(games, dtype=np.int32)
+        # ghosts the same way, along with the move each one picked next and how it moves
+        self.ghost_x = np.zeros((games, ghosts), dtype=np.int32)
+        self.ghost_y = np.zeros((games, ghosts), dtype=np.int32)
+        self.ghost_move = np.full((games, ghosts), NO_MOVE, dtype=np.int8)
+        self.ghost_planned = np.full((games, ghosts), NO_MOVE, dtype=np.int8)
+        self.ghost_frame = np.zeros((games, ghosts), dtype=np.int32)
+        self.ghost_left = np.zeros((games, ghosts), dtype=np.int32)
+        self.ghost_top = np.zeros((games, ghosts), dtype=np.int32)
+        self.ghost_frames = np.full((games, ghosts), params["ghost_frames_per_tile"], dtype=np.int32)
+        self.ghost_chance = np.full((games, ghosts), params["random_move_chance"])
+        self.steps_y = np.array([direction[0] for direction in DIRECTIONS] + [0], dtype=np.int32)
+        self.steps_x = np.array([direction[1] for direction in DIRECTIONS] + [0], dtype=np.int32)
+
+    # start new games (all of them, or those of the indices), returns the observations of every game
+    def reset(self, indices=None):
+        indices = range(self.games) if indices is None else indices
+        for index in indices:
+            self.reset_game(index)
+        return self.observe()
+
+    # a new level for a game, seeded from the vector simulation's seed and how many levels came before it
+    # (hashed by a SeedSequence, like the games of Source.selfplay, so that no two of them share a level)
+    def reset_game(self, index):
+        level_seed = None
+        if self.seed is not None:
+            level_seed = int(np.random.SeedSequence([self.seed, self.resets]).generate_state(1, np.uint64)[0]) >> 1
+        self.resets += 1
+        size = self.size
+        level = game.Level(size, size, difficulty=self.difficulty, seed=level_seed)
+        self.levels[index] = level
+        graph = level.get_corridor_graph()
+        if graph.size > self.neighbours.shape[1]:  # make room for the corridors of the new level
+            neighbours = np.full((self.games, graph.size, 4), -1, dtype=np.int32)
+            neighbours[:, :self.neighbours.shape[1]] = self.neighbours
+            self.neighbours = neighbours
+        self.tile_maps[index] = level.tile_map
+        self.ids[index] = np.array(graph.ids, dtype=np.int32).reshape(size, size)
+        self.neighbours[index] = -1
+        self.neighbours[index, :graph.size] = graph.neighbours
+        self.coins[index] = level.coin_grid >= 0
+        self.coin_counts[index] = len(level.coins)
+        self.scores[index] = 0
+        self.states[index] = RUNNING
+        self.frames[index] = 0
+        pacman_x, pacman_y = size // 2, size // 2
+        self.pacman_x[index], self.pacman_y[index] = pacman_x, pacman_y
+        self.pacman_move[index], self.pacman_frame[index] = NO_MOVE, 0
+        self.pacman_left[index], self.pacman_top[index] = pacman_x * game.TILE_SIZE, pacman_y * game.TILE_SIZE
+        for ghost_index, ghost in enumerate(level.ghosts):
+            self.ghost_x[index, ghost_index], self.ghost_y[index, ghost_index] = ghost.curr_tile_x, ghost.curr_tile_y
+            self.ghost_left[index, ghost_index], self.ghost_top[index, ghost_index] = ghost.left, ghost.top
+        self.ghost_move[index], self.ghost_planned[index], self.ghost_frame[index] = NO_MOVE, NO_MOVE, 0
+
+    # make a pacman move in every running game (actions are direction indices, NO_MOVE to wait),
+    # returns the observations, the points scored, which games are over and the states of the games
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int8)
+        running = self.states == RUNNING
+        scores = self.scores.copy()
+        # the move starts with the next frame, the ghosts still get this one
+        legal = self.legal_moves()[np.arange(self.games), np.minimum(actions, NO_MOVE - 1)] & (actions < NO_MOVE)
+        self.pacman_move[running] = np.where(legal, actions, NO_MOVE)[running]
+        self.pacman_frame[running] = 0
+        self.update_ghosts(running)
+        for frame in range(1, game.PACMAN_MOVE_FRAMES + 1):
+            running &= self.states == RUNNING
+            self.move_pacman(running)
+            if frame < game.PACMAN_MOVE_FRAMES:
+                self.update_ghosts(running)
+            self.frames[running] += 1
+        running &= self.states == RUNNING
+        self.pick_up_coins(running)
+        return self.observe(), self.scores - scores, self.states != RUNNING, self.states.copy()
+
+    # Character.move for pacman in the games given by a mask
+    def move_pacman(self, games):
+        moving = games & (self.pacman_move != NO_MOVE)
+        self.pacman_frame[moving] += 1
+        move, frame = self.pacman_move[moving], self.pacman_frame[moving]
+        percent = frame / game.PACMAN_MOVE_FRAMES
+        x, y = self.pacman_x[moving], self.pacman_y[moving]
+        self.pacman_left[moving] = ((x + self.steps_x[move] * percent) * game.TILE_SIZE).astype(np.int32)
+        self.pacman_top[moving] = ((y + self.steps_y[move] * percent) * game.TILE_SIZE).astype(np.int32)
+        finished = np.flatnonzero(moving)[frame >= game.PACMAN_MOVE_FRAMES]
+        move = self.pacman_move[finished]
+        self.pacman_x[finished] += self.steps_x[move]
+        self.pacman_y[finished] += self.steps_y[move]
+        self.pacman_move[finished] = NO_MOVE
+
+    # PacMan.update eating the coin pacman stands on, the games without coins left are won
+    def pick_up_coins(self, games):
+        index = np.flatnonzero(games)
+        x, y = self.pacman_x[index], self.pacman_y[index]
+        eaten = index[self.coins[index, y, x]]
+        self.coins[eaten, self.pacman_y[eaten], self.pacman_x[eaten]] = False
+        self.coin_counts[eaten] -= 1
+        self.scores[eaten] += COIN_SCORE
+        self.states[games & (self.coin_counts == 0)] = VICTORY
+
+    # Ghost.update for every ghost of the games given by a mask: move, catch pacman and pick the next move
+    def update_ghosts(self, games):
+        active = np.repeat(games[:, None], self.ghost_move.shape[1], axis=1)
+        starting = active & (self.ghost_move == NO_MOVE) & (self.ghost_planned != NO_MOVE)
+        self.ghost_move[starting] = self.ghost_planned[starting]
+        self.ghost_planned[starting] = NO_MOVE
+        self.ghost_frame[starting] = 0
+        moving = active & (self.ghost_move != NO_MOVE)
+        self.ghost_frame[moving] += 1
+        move, frame = self.ghost_move[moving], self.ghost_frame[moving]
+        percent = frame / self.ghost_frames[moving]
+        x, y = self.ghost_x[moving], self.ghost_y[moving]
+        self.ghost_left[moving] = ((x + self.steps_x[move] * percent) * game.TILE_SIZE).astype(np.int32) + \
+            GHOST_OFFSET_X
+        self.ghost_top[moving] = ((y + self.steps_y[move] * percent) * game.TILE_SIZE).astype(np.int32)
+        finished = moving & (self.ghost_frame >= self.ghost_frames)
+        move = self.ghost_move[finished]
+        self.ghost_x[finished] += self.steps_x[move]
+        self.ghost_y[finished] += self.steps_y[move]
+        self.ghost_move[finished] = NO_MOVE
+        # catch pacman by the centers of the sprites
+        pacman_x = self.pacman_left + game.PACMAN_SIZE[0] // 2
+        pacman_y = self.pacman_top + game.PACMAN_SIZE[1] // 2
+        ghost_x = self.ghost_left + game.GHOST_SIZE[0] // 2
+        ghost_y = self.ghost_top + game.GHOST_SIZE[1] // 2
+        caught = ((pacman_x[:, None] - ghost_x) ** 2 + (pacman_y[:, None] - ghost_y) ** 2) ** 0.5 < COLLISION_RANGE
+        self.states[games & (active & caught).any(axis=1)] = DEFEAT
+        # the ghosts that stand still pick their next move
+        deciding = active & (self.ghost_move == NO_MOVE) & (self.ghost_planned == NO_MOVE)
+        index, ghost = np.nonzero(deciding)
+        if len(index):
+            randomly = self.rng.random(len(index)) < self.ghost_chance[index, ghost]
+            self.ghost_planned[index, ghost] = np.where(randomly, self.random_moves(index, ghost),
+                                                        self.chase_moves(index, ghost))
+
+    # Ghost.chase: the first move (in DIRECTIONS order) that gets a ghost closer to pacman, looked up
+    # in the distance table of the game's level for just the ghosts that decide
+    def chase_moves(self, index, ghost):
+        cells = self.ids[index, self.ghost_y[index, ghost], self.ghost_x[index, ghost]]
+        targets = self.ids[index, self.pacman_y[index], self.pacman_x[index]]
+        moves = np.empty(len(index), dtype=np.int8)
+        for game_index in np.unique(index):
+            deciding = index == game_index
+            table = self.levels[game_index].get_distance_table()
+            moves[deciding] = table.next_moves(targets[deciding], cells[deciding])
+        return moves
+
+    # a random move out of the open ones
+    def random_moves(self, index, ghost):
+        cell = self.ids[index, self.ghost_y[index, ghost], self.ghost_x[index, ghost]]
+        open_moves = self.neighbours[index, cell] >= 0
+        pick = (self.rng.random(len(index)) * open_moves.sum(axis=1)).astype(np.int64)
+        # index of the pick-th open move
+        return (np.cumsum(open_moves, axis=1) > pick[:, None]).argmax(axis=1).astype(np.int8)
+
+    # which directions lead out of pacman's tile in every game
+    def legal_moves(self):
+        cell = self.ids[np.arange(self.games), self.pacman_y, self.pacman_x]
+        return self.neighbours[np.arange(self.games), cell] >= 0
+
+    # what every game looks like as pacman decides his next move
+    def observe(self):
+        return {"pacman": np.stack([self.pacman_x, self.pacman_y], axis=1),
+                "ghosts": np.stack([self.ghost_x, self.ghost_y], axis=2),
+                "ghost_moves": self.ghost_move.copy(), "ghost_progress": self.ghost_frame / self.ghost_frames,
+                "coins": self.coins.copy(), "walls": self.tile_maps.copy(), "legal_moves": self.legal_moves(),
+                "scores": self.scores.copy(), "states": self.states.copy()}
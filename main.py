@@ -3,13 +3,20 @@ import pygame
 import pygame.freetype
 import sympy
 import Source.game as game
+import Source.replay as replays
+import Source.sprites as sprites
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from datetime import timedelta
 
 LEVEL_WIDTH = 9
 LEVEL_HEIGHT = 9
 # GAME_MODE = "Pathfinding"
 GAME_MODE = "Game"
+PLAN_AHEAD = True  # let the AI plan its next move on a worker thread while the current one plays out
+AI_TIME_BUDGET = 0.010  # seconds pacman may think per move (None to always look PACMAN_AI_DEPTH moves ahead)
+SEARCH_PROCESSES = 0  # worker processes to split pacman's search between (0 to search on the game's process)
+RECORD_REPLAYS = None  # directory to save a replay of every level to once it's over (see Source.replay)
+REPLAY = None  # replay file to watch over and over instead of playing new levels
 
 
 def draw_score(screen, score):
@@ -56,19 +63,65 @@ def draw_pathfinding_stats(screen, stats):
     screen.blit(text, text_rect)
 
 
-def create_level(difficulty):
-    level = None
-    if GAME_MODE == "Pathfinding":
-        level = game.Level(LEVEL_WIDTH, LEVEL_HEIGHT, difficulty=0, ghosts_n_coins=False)
-    elif GAME_MODE == "Game":
-        level = game.Level(LEVEL_WIDTH, LEVEL_HEIGHT, difficulty=difficulty, ghosts_n_coins=True)
-    # get tile sprites
-    tile_list = level.set_up_tile_sprites()
-    # create pacman
-    pacman = game.PacMan(LEVEL_WIDTH // 2, LEVEL_HEIGHT // 2)
-    pacman_list = pygame.sprite.RenderPlain()
-    pacman_list.add(pacman)
-    return level, pacman, pacman_list, tile_list
+def draw_search_stats(screen, stats):
+    font = pygame.freetype.Font("Assets/Fonts/PokemonGb.ttf", 16)
+    color = (255, 255, 255)
+    top = 55
+    for agent, agent_stats in stats.as_dict().items():
+        last, totals = agent_stats["last"], agent_stats["level"]
+        lines = [f"{agent.capitalize()}: {last['nodes']} nodes, {last['pruned']} pruned, depth {last['depth']}",
+                 f"  branching {last['branching']:.2f}, {last['path_queries']} queries",
+                 f"  {last['time_ns'] / 1e6:.2f} ms, level avg "
+                 f"{totals['time_ns'] / 1e6 / max(1, totals['decisions']):.2f} ms"]
+        for line in lines:
+            text, text_rect = font.render(line, color)
+            text_rect.left = 0
+            text_rect.top = top
+            screen.blit(text, text_rect)
+            top += 25
+
+
+# a new simulation and the sprites that draw it, with the recording of it (RECORD_REPLAYS)
+# or the playback it follows (REPLAY)
+def create_level(difficulty, executor=None, score=0):
+    playback, recording = None, None
+    if REPLAY:
+        playback = replays.Playback(replays.Replay.load(REPLAY))
+        simulation = playback.simulation
+    else:
+        simulation = game.Simulation.create(LEVEL_WIDTH, LEVEL_HEIGHT, difficulty, GAME_MODE)
+    view = sprites.GameView(simulation)
+    level, pacman = simulation.level, simulation.pacman
+    level.search_stats = game.SearchStats()  # collect stats about the AI decisions
+    level.executor = executor
+    if not playback:
+        level.score = score
+        if SEARCH_PROCESSES and GAME_MODE == "Game":
+            level.search_pool = game.SearchPool(level, SEARCH_PROCESSES)
+        pacman.time_budget = AI_TIME_BUDGET
+        if level.search_pool:
+            pacman.planner = "parallel"
+        if RECORD_REPLAYS and GAME_MODE == "Game":
+            recording = replays.Replay.record(simulation)
+    return simulation, view, playback, recording
+
+
+# save the recording of a level that is over, report how a playback went
+def end_level(simulation, playback, recording, difficulty):
+    if recording:
+        recording.finish(simulation)
+        os.makedirs(RECORD_REPLAYS, exist_ok=True)
+        name = f"level-{difficulty}-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{recording.seed}.pkr"
+        recording.save(os.path.join(RECORD_REPLAYS, name))
+    if playback:
+        for frame, what, recorded, played in playback.divergences:
+            print(f"replay diverged at frame {frame} ({what}): recorded {recorded}, played back {played}")
+
+
+# stop the worker processes of a level that is over
+def close_level(level, wait=False):
+    if level.search_pool:
+        level.search_pool.shutdown(wait)
 
 
 # define a main function
@@ -86,6 +139,8 @@ def main():
     # create a surface on screen that fits the size of the map
     screen = pygame.display.set_mode((LEVEL_WIDTH*game.TILE_SIZE,
                                       LEVEL_HEIGHT*game.TILE_SIZE))
+    # load the images of the game once the display is there, every level shares them
+    sprites.preload()
 
     game_state = "running"
     current_difficulty = 0
@@ -94,10 +149,12 @@ def main():
     floating_text_animation_frame = 0
     floating_text_animation_frames = 120
 
+    # worker thread for planning ahead
+    executor = ThreadPoolExecutor(max_workers=2) if PLAN_AHEAD else None
+
     # create level
-    level, pacman, pacman_list, tile_list = create_level(current_difficulty)
-    pathfinding_stats = {"algo": "bfs", "time": timedelta(microseconds=0),
-                         "steps": 0, "memory": 0}  # stats about pathfinding algorithms
+    simulation, view, playback, recording = create_level(current_difficulty, executor)
+    level = simulation.level
 
     # game clock
     clock = pygame.time.Clock()
@@ -106,6 +163,8 @@ def main():
     running = True
     # pause the game with space
     pause = False
+    # show stats about the AI decisions with S
+    show_search_stats = False
 
     # main loop
     while running:
@@ -126,18 +185,19 @@ def main():
                 pause = not pause  # pause/unpause
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_p:
                 level.toggle_pathfinding_algo()  # switch to next pathfinding algorithm
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_s:
+                show_search_stats = not show_search_stats
 
         # update game logic
         if not pause:
             if game_state == "running":
-                pacman.update(level, GAME_MODE, pathfinding_stats)
-                level.ghosts.update(level, pacman)
-                level.update()
-                if not level.coins and GAME_MODE == "Game":  # win the game once all of the coins have been eaten
-                    game_state = "victory"
+                game_state = playback.step() if playback else simulation.step()
+                view.update()
+                if game_state != "running":
+                    end_level(simulation, playback, recording, level.difficulty)
+                if game_state == "victory":
                     current_difficulty += 1  # bump up the difficulty
-                elif pacman.dead:
-                    game_state = "defeat"
+                elif game_state == "defeat":
                     current_difficulty = 0  # reset difficulty
             elif game_state == "victory":
                 pass
@@ -146,9 +206,10 @@ def main():
                 # create next level
                 if floating_text_animation_frame >= floating_text_animation_frames:
                     floating_text_animation_frame = 0
-                    curr_score = level.score  # maintain score
-                    level, pacman, pacman_list, tile_list = create_level(current_difficulty)
-                    level.score = curr_score
+                    close_level(level)
+                    # maintain score
+                    simulation, view, playback, recording = create_level(current_difficulty, executor, level.score)
+                    level = simulation.level
                     game_state = "running"
             elif game_state == "defeat":
                 pass
@@ -157,17 +218,18 @@ def main():
                 # create next level
                 if floating_text_animation_frame >= floating_text_animation_frames:
                     floating_text_animation_frame = 0
-                    level, pacman, pacman_list, tile_list = create_level(current_difficulty)
+                    close_level(level)
+                    simulation, view, playback, recording = create_level(current_difficulty, executor)
+                    level = simulation.level
                     game_state = "running"
 
         # draw everything
-        tile_list.draw(screen)
-        level.coins.draw(screen)
-        pacman_list.draw(screen)
-        level.ghosts.draw(screen)
+        view.draw(screen)
         draw_score(screen, level.score)
         if GAME_MODE == "Pathfinding":
-            draw_pathfinding_stats(screen, pathfinding_stats)
+            draw_pathfinding_stats(screen, simulation.pathfinding_stats)
+        elif show_search_stats:
+            draw_search_stats(screen, level.search_stats)
         animation_progress = floating_text_animation_frame / floating_text_animation_frames
         if game_state == "victory":
             label_text = f"Onwards to level {current_difficulty}!"
@@ -177,6 +239,10 @@ def main():
         pygame.display.flip()
         clock.tick(60)
 
+    if executor:
+        executor.shutdown(cancel_futures=True)
+    close_level(level, wait=True)
+
 
 # run the main function only if this module is executed as the main script
 # (if you import this as a module then nothing is executed)
@@ -0,0 +1,36 @@
+import random
+import pytest
+import Source.game as game
+
+# levels built on a given tile map
+#   python -m pytest tests
+
+
+def test_tile_map_is_copied():
+    tile_map = game.Level(11, 11, ghosts_n_coins=False, seed=1).tile_map.copy()
+    level = game.Level(11, 11, ghosts_n_coins=False, tile_map=tile_map)
+    assert tile_map.flags.writeable and not level.tile_map.flags.writeable
+    assert (level.tile_map == tile_map).all()
+    tile_map[1, 1] = 1 - tile_map[1, 1]
+    assert level.tile_map[1, 1] != tile_map[1, 1]
+
+
+# however many walls go in, every open tile can still be reached from every other one
+@pytest.mark.parametrize("wall_chance", [0.15, 0.5, 1.0])
+def test_generated_maze_is_connected(wall_chance):
+    for seed in range(5):
+        level = game.Level(41, 41, ghosts_n_coins=False, wall_chance=wall_chance, seed=seed)
+        table = level.get_distance_table()
+        assert (table.row(0) != table.unreachable).all()
+
+
+# dfs takes the same shortest paths as bfs (it only searches in another order)
+@pytest.mark.parametrize("wall_chance", [0.0, 0.15, 0.5, 1.0])
+def test_dfs_paths_are_shortest(wall_chance):
+    level = game.Level(31, 31, ghosts_n_coins=False, wall_chance=wall_chance, seed=3)
+    graph = level.get_corridor_graph()
+    rng = random.Random(3)
+    for query in range(50):
+        start, target = rng.randrange(graph.size), rng.randrange(graph.size)
+        points = graph.xs[start], graph.ys[start], graph.xs[target], graph.ys[target]
+        assert level.shortest_path_dfs(*points, None) == level.shortest_path_bfs(*points, None)
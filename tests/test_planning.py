@@ -0,0 +1,67 @@
+import threading
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import Source.game as game
+
+# pacman's planners: speculations that aren't needed any more give up
+#   python -m pytest tests
+
+PLANNERS = ["transposition", "array", "alphabeta", "expectimax", "mcts"]
+
+
+def observed(simulation):
+    return game.WorldSnapshot.observe(simulation.level, simulation.pacman)
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+def test_stopped_plan_gives_up(planner):
+    simulation = game.Simulation.create(21, 21, 3, seed=1)
+    pacman = simulation.pacman
+    pacman.planner = planner
+    stop = threading.Event()
+    stop.set()
+    with pytest.raises(game.SearchTimeout):
+        pacman.plan(simulation.level, observed(simulation), None, stop)
+    pacman.time_budget = 0.010
+    if planner == "mcts":  # it keeps to the budget by itself, no deepening to stop
+        with pytest.raises(game.SearchTimeout):
+            pacman.plan(simulation.level, observed(simulation), None, stop)
+    else:
+        outcome, depth, search = pacman.plan(simulation.level, observed(simulation), None, stop)
+        assert depth == 0
+
+
+# planning ahead on another thread doesn't change the game (without a time budget)
+def test_speculation_plays_the_same():
+    moves = []
+    for executor in [None, ThreadPoolExecutor(1)]:
+        simulation = game.Simulation.create(15, 15, 5, seed=2)
+        simulation.level.executor = executor
+        decisions = []
+        simulation.pacman.on_decision = lambda move: decisions.append(move) or move
+        simulation.run(1000)
+        moves.append(decisions)
+        if executor:
+            executor.shutdown()
+    assert moves[0] == moves[1]
+
+
+# with a time budget a decision takes about that long: the default planner checks the deadline within big layers
+# too, the others run a bit past it (mcts finishes the iteration it's on)
+@pytest.mark.parametrize("planner", PLANNERS)
+def test_decisions_keep_to_the_budget(planner):
+    budget = 0.010
+    simulation = game.Simulation.create(31, 31, 5, seed=5)
+    simulation.level.search_stats = game.SearchStats()
+    simulation.pacman.time_budget = budget
+    simulation.pacman.planner = planner
+    totals = simulation.level.search_stats.totals["pacman"]
+    times = []
+    while simulation.state == "running" and len(times) < 200:
+        decisions = totals["decisions"]
+        simulation.step()
+        if totals["decisions"] != decisions:
+            times.append(simulation.level.search_stats.last["pacman"]["time_ns"] / 1e9)
+    assert len(times) > 20
+    assert np.percentile(times, 95) < budget * (1.3 if planner == "transposition" else 2.0)
@@ -0,0 +1,61 @@
+import pytest
+import Source.game as game
+from Source.replay import Replay, Playback
+
+# a recorded game survives being saved and plays back the same way, a changed recording is flagged
+#   python -m pytest tests
+
+SIZE = 15
+DIFFICULTY = 4  # ghosts that move randomly now and then, so there are draws to record
+MAX_FRAMES = 1500
+
+
+@pytest.fixture(scope="module")
+def replay():
+    simulation = game.Simulation.create(SIZE, SIZE, DIFFICULTY, seed=11)
+    replay = Replay.record(simulation)
+    simulation.run(MAX_FRAMES)
+    replay.finish(simulation)
+    return replay
+
+
+def test_round_trip(replay, tmp_path):
+    assert replay.moves and replay.draws
+    replay.save(tmp_path / "game.pkr")
+    loaded = Replay.load(tmp_path / "game.pkr")
+    assert vars(loaded) == vars(replay)
+
+
+def test_playback(replay):
+    assert Playback(Replay.from_bytes(replay.to_bytes())).run() == []
+
+
+def test_changed_move_is_flagged(replay):
+    changed = Replay.from_bytes(replay.to_bytes())
+    frame, move = changed.moves[5]
+    changed.moves[5] = (frame, (move + 1) % 4)
+    divergences = Playback(changed).run()
+    assert divergences[0][:2] == (frame, "move")
+
+
+def test_changed_draw_is_flagged(replay):
+    changed = Replay.from_bytes(replay.to_bytes())
+    frame, value = changed.draws[0]
+    changed.draws[0] = (frame, 1.0 - value if isinstance(value, float) else value + 1)
+    divergences = Playback(changed).run()
+    assert divergences[0][:2] == (frame, "draw")
+
+
+# a game recorded with other difficulty_settings (like self-play with --settings) plays back with them
+def test_playback_with_other_settings(monkeypatch):
+    settings = {"ghost_frames_per_tile": 30, "ghost_amount": 3, "random_move_chance": 0.5}
+    with monkeypatch.context() as patch:
+        patch.setitem(game.difficulty_settings, DIFFICULTY, settings)
+        simulation = game.Simulation.create(SIZE, SIZE, DIFFICULTY, seed=12)
+        recorded = Replay.record(simulation)
+        simulation.run(MAX_FRAMES)
+        recorded.finish(simulation)
+    assert recorded.settings == settings != game.difficulty_settings[DIFFICULTY]
+    playback = Playback(Replay.from_bytes(recorded.to_bytes()))
+    assert len(playback.simulation.level.ghosts) == 3
+    assert playback.run() == []
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+import Source.game as game
+from Source.pathfinding import DIRECTIONS
+from Source.vector_simulation import VectorSimulation, RUNNING, DEFEAT, NO_MOVE
+
+# the vector simulation plays by the rules of Simulation: with random ghost moves off, games on the same levels
+# with the same pacman moves go the same way
+#   python -m pytest tests
+
+GAMES = 16
+SIZE = 11
+STEPS = 100
+
+
+# a Simulation on every level of a vector simulation, pacman makes the moves in actions
+def simulations(vector, actions):
+    games = []
+    for index, level in enumerate(vector.levels):
+        simulation = game.Simulation(level, game.PacMan(SIZE // 2, SIZE // 2))
+        simulation.pacman.choose_best_move = lambda level, index=index: DIRECTIONS[actions[index]]
+        games.append(simulation)
+    return games
+
+
+# pacman's tile once his move is over, the score, whether he was caught and the tiles and sprite corners
+# of the ghosts, after a step of a Simulation (its pacman is a frame behind and eats the coin the step after)
+def simulated_state(simulation):
+    pacman = simulation.pacman
+    move = pacman.curr_move or (0, 0)
+    ghosts = [(ghost.curr_tile_x, ghost.curr_tile_y, ghost.left, ghost.top) for ghost in simulation.level.ghosts]
+    return pacman.curr_tile_x + move[1], pacman.curr_tile_y + move[0], simulation.level.score, \
+        simulation.state == "defeat", ghosts
+
+
+# the same after a step of a game of the vector simulation, with the score it had before the step
+def vector_state(vector, index, score):
+    ghosts = [(int(x), int(y), int(left), int(top)) for x, y, left, top in
+              zip(vector.ghost_x[index], vector.ghost_y[index], vector.ghost_left[index], vector.ghost_top[index])]
+    return int(vector.pacman_x[index]), int(vector.pacman_y[index]), int(score), \
+        bool(vector.states[index] == DEFEAT), ghosts
+
+
+@pytest.mark.parametrize("difficulty", [0, 2, 3, 5, 6])
+def test_matches_simulation(difficulty, monkeypatch):
+    monkeypatch.setitem(game.difficulty_settings[difficulty], "random_move_chance", 0.0)
+    vector = VectorSimulation(GAMES, SIZE, difficulty, seed=difficulty)
+    observations = vector.reset()
+    actions = np.zeros(GAMES, dtype=np.int64)
+    games = simulations(vector, actions)
+    rng = np.random.default_rng(difficulty)
+    compared = 0
+    for step in range(STEPS):
+        actions[:] = [rng.choice(np.flatnonzero(legal)) for legal in observations["legal_moves"]]
+        running, scores = vector.states == RUNNING, vector.scores.copy()
+        for simulation in games:
+            for frame in range(game.PACMAN_MOVE_FRAMES):
+                simulation.step()
+        observations, rewards, dones, states = vector.step(actions)
+        for index in np.flatnonzero(running):
+            simulated, vectorized = simulated_state(games[index]), vector_state(vector, index, scores[index])
+            if simulated[3] or vectorized[3]:  # pacman was caught, the characters stop at different frames
+                simulated, vectorized = simulated[2:4], vectorized[2:4]
+            assert simulated == vectorized, f"game {index} after step {step}"
+            compared += 1
+    assert compared > GAMES * 4
+
+
+def test_waiting():
+    vector = VectorSimulation(4, SIZE, 0, seed=0)
+    vector.reset()
+    observations, rewards, dones, states = vector.step(np.full(4, NO_MOVE))
+    assert (observations["pacman"] == SIZE // 2).all()
+    assert (vector.frames == game.PACMAN_MOVE_FRAMES).all()